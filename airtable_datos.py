@@ -0,0 +1,759 @@
+# -*- coding: utf-8 -*-
+"""
+Acceso a la tabla Confirmaciones_de_Entrega de Airtable sin depender de Streamlit,
+para que la app, los scripts por lotes y el servidor compartan la misma lógica.
+"""
+
+import os
+import re
+import json
+import sqlite3
+import contextlib
+import time
+import datetime
+import bisect
+import posixpath
+import threading
+import unicodedata
+from collections import defaultdict
+from concurrent.futures import Future
+
+import requests
+import numpy as np
+import pandas as pd
+from airtable import Airtable, AirtableError
+
+TABLA_ENTREGAS = 'Confirmaciones_de_Entrega'
+VISTA_ENTREGAS = 'Grid view'
+
+# Columnas que usa el formulario; el resto no hace falta traerlo de Airtable.
+CAMPOS_FORMULARIO = [
+    'ID-partido', 'Rec', 'Piloto', 'Fecha partido', 'Analista', 'Mail',
+    'Analista(Form)', 'Mail(Form)', 'Verificado', 'Codigo_unico', 'Hash_PDF', 'Fecha_UTC', 'PDF',
+]
+# Columnas que la entrega empezó a rellenar después y que una base creada antes
+# puede no tener. Airtable rechaza (422 UNKNOWN_FIELD_NAME) cualquier lectura o
+# escritura que nombre una columna que no existe, así que estas se piden y se
+# escriben solo mientras la base no diga que le faltan.
+CAMPOS_OPCIONALES = ('Fecha_UTC', 'SHA256_PDF', 'Drive_ID')
+TAMANO_PAGINA = 100
+
+TABLA_ANALISTAS = 'analista'
+CAMPO_NOMBRE_ANALISTA = os.environ.get("ANALISTAS_CAMPO_NOMBRE", "Nombre")
+CAMPO_MAIL_ANALISTA = os.environ.get("ANALISTAS_CAMPO_MAIL", "Mail")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ESPEJO_PATH = os.environ.get("ENTREGAS_ESPEJO", os.path.join(BASE_DIR, ".cache", "entregas.sqlite"))
+
+
+def credenciales_airtable_entorno():
+    """Lee AIRTABLE_BASE_ID y AIRTABLE_API_KEY de las variables de entorno."""
+    try:
+        return os.environ["AIRTABLE_BASE_ID"], os.environ["AIRTABLE_API_KEY"]
+    except KeyError as e:
+        raise RuntimeError(f"Falta la variable de entorno {e.args[0]}") from None
+
+
+def crear_cliente_airtable(base_id, api_key, api_url=None):
+    """
+    Crea el cliente de Airtable. api_url (o AIRTABLE_API_URL) permite apuntar a
+    un servidor local que imite la API, p. ej. en pruebas.
+    """
+    cliente = Airtable(base_id, api_key)
+    api_url = api_url or os.environ.get("AIRTABLE_API_URL")
+    if api_url:
+        cliente.airtable_url = api_url
+        cliente.base_url = posixpath.join(api_url, base_id)
+    return cliente
+
+
+CARACTERES_A_ELIMINAR = r"[\"\'\[\]\(\)\{\}]"
+# Campos vinculados (lookups) que Airtable devuelve como listas.
+COLUMNAS_VINCULADAS = ['Analista', 'Mail']
+
+
+def limpiar_caracteres(texto):
+    """
+    Elimina comillas (simples y dobles) y corchetes ([], (), {}) de una cadena de texto.
+    """
+    return re.sub(CARACTERES_A_ELIMINAR, "", texto)
+
+
+def _completar_columnas(df):
+    # Verifica si la columna 'Codigo_unico' existe y la crea si no es así
+    if 'Codigo_unico' not in df.columns:
+        df['Codigo_unico'] = '------'
+    return df
+
+
+def normalizar_vinculados(df, columnas=COLUMNAS_VINCULADAS):
+    """
+    Deja cada campo vinculado como texto: su primer valor, pasado por
+    limpiar_caracteres. Se hace una vez por carga y sobre la columna entera,
+    no fila a fila en cada rerun. Aplicarla a una columna ya normalizada no la cambia.
+    """
+    for columna in columnas:
+        if columna not in df.columns:
+            continue
+        # explode() saca un elemento por fila (las listas vacías quedan como NaN).
+        valores = df[columna].explode()
+        primeros = valores[~valores.index.duplicated()]
+        df[columna] = (primeros.astype('string').str.replace(CARACTERES_A_ELIMINAR, '', regex=True)
+                       .str.strip().fillna('').astype(object))
+    return df
+
+
+# Por URL de tabla, los CAMPOS_OPCIONALES que la base no tiene. Lo comparten
+# las lecturas y EscritorAirtable, así que cada columna ausente cuesta un solo 422.
+_CAMPOS_AUSENTES = defaultdict(set)
+
+
+def campo_desconocido(error):
+    """Nombre de la columna de un error UNKNOWN_FIELD_NAME de Airtable, o None."""
+    if getattr(error, 'type', None) != 'UNKNOWN_FIELD_NAME':
+        return None
+    encontrado = re.search(r'"([^"]+)"', str(getattr(error, 'message', None) or ''))
+    return encontrado.group(1) if encontrado else None
+
+
+def campos_ausentes(cliente, tabla=TABLA_ENTREGAS):
+    """CAMPOS_OPCIONALES que la tabla no tiene, según lo visto hasta ahora."""
+    return _CAMPOS_AUSENTES[posixpath.join(cliente.base_url, tabla)]
+
+
+def leer_registros_paginados(cliente, tabla=TABLA_ENTREGAS, vista=VISTA_ENTREGAS, campos=None, formula=None, tamano_pagina=TAMANO_PAGINA):
+    """
+    Recorre todas las páginas de la tabla siguiendo el cursor 'offset' de
+    Airtable y devuelve los registros página a página, como listas.
+
+    campos limita las columnas que viajan por la red y formula se envía como
+    filterByFormula, así que el filtrado lo hace Airtable. Si la base no tiene
+    alguno de los CAMPOS_OPCIONALES pedidos, se vuelve a pedir sin él y los
+    registros llegan sin esa columna.
+    """
+    ausentes = campos_ausentes(cliente, tabla)
+    offset = None
+    while True:
+        try:
+            respuesta = cliente.get(
+                tabla, limit=tamano_pagina, offset=offset, view=vista,
+                filter_by_formula=formula, fields=[c for c in campos or [] if c not in ausentes]
+            )
+        except AirtableError as e:
+            campo = campo_desconocido(e)
+            if campo not in CAMPOS_OPCIONALES or campo in ausentes:
+                raise
+            ausentes.add(campo)
+            continue
+        registros = respuesta.get('records', [])
+        if registros:
+            yield registros
+        offset = respuesta.get('offset')
+        if not offset:
+            break
+
+
+def dataframe_desde_paginas(paginas):
+    """
+    Construye el DataFrame de entregas a partir de un iterable de páginas.
+    Cada página se convierte a columnas en cuanto llega, así que nunca se
+    acumulan todos los diccionarios 'fields' a la vez. Los campos vinculados
+    salen ya como texto (normalizar_vinculados).
+    """
+    bloques = [pd.DataFrame([r['fields'] for r in pagina]) for pagina in paginas]
+    df = pd.concat(bloques, ignore_index=True) if bloques else pd.DataFrame()
+    return normalizar_vinculados(_completar_columnas(df))
+
+
+def cargar_tabla_entregas(base_id, api_key, campos=None, formula=None):
+    """Descarga la tabla de entregas (todas las páginas) y la devuelve como DataFrame."""
+    at_Table1 = crear_cliente_airtable(base_id, api_key)
+    return dataframe_desde_paginas(leer_registros_paginados(at_Table1, campos=campos, formula=formula))
+
+
+def _formato_airtable(momento):
+    return momento.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+class EspejoAirtable:
+    """
+    Copia local en SQLite de Confirmaciones_de_Entrega.
+
+    La primera sincronización descarga la tabla completa; las siguientes piden
+    solo los registros modificados desde la última marca de agua, usando
+    LAST_MODIFIED_TIME() en filterByFormula. Las bajas en Airtable no se ven en
+    una sincronización incremental, así que cada RESINCRONIZACION_COMPLETA se
+    vuelve a descargar todo.
+    """
+
+    # Solape para no perder cambios por desfase de relojes con Airtable.
+    MARGEN = datetime.timedelta(seconds=60)
+    RESINCRONIZACION_COMPLETA = datetime.timedelta(hours=24)
+
+    def __init__(self, cliente, ruta=ESPEJO_PATH, tabla=TABLA_ENTREGAS, vista=VISTA_ENTREGAS, campos=None):
+        self.cliente = cliente
+        self.ruta = ruta
+        self.tabla = tabla
+        self.vista = vista
+        self.campos = campos
+        self._lock = threading.Lock()
+        if os.path.dirname(ruta):
+            os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        with self._conectar() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS registros (id TEXT PRIMARY KEY, creado TEXT, fields TEXT NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS estado (clave TEXT PRIMARY KEY, valor TEXT)")
+
+    @contextlib.contextmanager
+    def _conectar(self):
+        conn = sqlite3.connect(self.ruta, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _leer_estado(self, conn, clave):
+        fila = conn.execute("SELECT valor FROM estado WHERE clave = ?", (clave,)).fetchone()
+        return datetime.datetime.fromisoformat(fila[0]) if fila else None
+
+    def _guardar_estado(self, conn, clave, momento):
+        conn.execute("INSERT OR REPLACE INTO estado (clave, valor) VALUES (?, ?)", (clave, momento.isoformat()))
+
+    def sincronizar(self, completo=False):
+        """
+        Trae a SQLite los cambios desde la última sincronización.
+        Devuelve el número de registros recibidos.
+        """
+        with self._lock, self._conectar() as conn:
+            ahora = datetime.datetime.now(datetime.timezone.utc)
+            marca = self._leer_estado(conn, 'marca_agua')
+            ultima_completa = self._leer_estado(conn, 'ultima_completa')
+            if marca is None or ultima_completa is None or ahora - ultima_completa > self.RESINCRONIZACION_COMPLETA:
+                completo = True
+
+            if completo:
+                conn.execute("DELETE FROM registros")
+                formula = None
+            else:
+                formula = f"IS_AFTER(LAST_MODIFIED_TIME(), DATETIME_PARSE('{_formato_airtable(marca)}'))"
+
+            recibidos = 0
+            for pagina in leer_registros_paginados(self.cliente, self.tabla, self.vista, campos=self.campos, formula=formula):
+                conn.executemany(
+                    "INSERT OR REPLACE INTO registros (id, creado, fields) VALUES (?, ?, ?)",
+                    [(r['id'], r.get('createdTime'), json.dumps(r['fields'])) for r in pagina]
+                )
+                recibidos += len(pagina)
+            # La marca se guarda en la misma transacción que los registros.
+            self._guardar_estado(conn, 'marca_agua', ahora - self.MARGEN)
+            if completo:
+                self._guardar_estado(conn, 'ultima_completa', ahora)
+        return recibidos
+
+    def tabla_entregas(self, tamano_bloque=1000):
+        """Devuelve el contenido del espejo como DataFrame, en orden de creación."""
+        with self._conectar() as conn:
+            cursor = conn.execute("SELECT fields FROM registros ORDER BY creado, id")
+            paginas = iter(lambda: [{'fields': json.loads(f)} for (f,) in cursor.fetchmany(tamano_bloque)], [])
+            return dataframe_desde_paginas(paginas)
+
+    def actualizar_registro(self, record_id, fields):
+        """Fusiona en el espejo los campos escritos en Airtable para un registro."""
+        with self._lock, self._conectar() as conn:
+            fila = conn.execute("SELECT fields FROM registros WHERE id = ?", (record_id,)).fetchone()
+            if fila is None:
+                return False
+            actuales = json.loads(fila[0])
+            actuales.update(fields)
+            conn.execute("UPDATE registros SET fields = ? WHERE id = ?", (json.dumps(actuales), record_id))
+        return True
+
+
+# Columnas con pocos valores distintos: como category ocupan menos y comparan más rápido.
+COLUMNAS_CATEGORICAS = ['Verificado', 'Piloto', 'Analista']
+
+
+def _categorizar(df, columnas=COLUMNAS_CATEGORICAS):
+    for columna in columnas:
+        if columna not in df.columns or isinstance(df[columna].dtype, pd.CategoricalDtype):
+            continue
+        try:
+            df[columna] = df[columna].astype('category')
+        except TypeError:
+            # Campos vinculados sin normalizar (listas): no son hashables.
+            pass
+    return df
+
+
+def normalizar_busqueda(texto):
+    """Minúsculas y sin tildes, para que 'jose' encuentre 'José'."""
+    texto = unicodedata.normalize('NFKD', str(texto).lower())
+    return ''.join(c for c in texto if not unicodedata.combining(c))
+
+
+def _texto_celda(valor):
+    # Lookups como listas; celdas vacías como NaN o None.
+    if isinstance(valor, list):
+        return ', '.join(map(str, valor))
+    if valor is None or (isinstance(valor, float) and pd.isna(valor)):
+        return ''
+    return str(valor)
+
+
+class IndiceNgramas:
+    """
+    Índice de búsqueda sobre las opciones (ID-partido) de una foto.
+
+    Con 3 o más caracteres se cruzan las listas de trigramas de la consulta
+    (de la más corta a la más larga) y solo se comprueba la subcadena en los
+    candidatos que quedan; con 1 o 2, se busca por prefijo con bisección sobre
+    los textos ordenados. Se construye una vez por carga de la tabla.
+    """
+
+    N = 3
+
+    def __init__(self, opciones):
+        self.textos = [normalizar_busqueda(opcion) for opcion in opciones]
+        self._textos_np = np.array(self.textos, dtype=str)
+        self._orden = sorted(range(len(self.textos)), key=self.textos.__getitem__)
+        self._ordenados = [self.textos[i] for i in self._orden]
+        listas = defaultdict(list)
+        for posicion, texto in enumerate(self.textos):
+            for ngrama in {texto[i:i + self.N] for i in range(len(texto) - self.N + 1)}:
+                listas[ngrama].append(posicion)
+        self._listas = {ngrama: np.array(posiciones, dtype=np.int32) for ngrama, posiciones in listas.items()}
+
+    def __len__(self):
+        return len(self.textos)
+
+    def buscar(self, consulta):
+        """Posiciones de las opciones que contienen la consulta: primero las que empiezan por ella."""
+        consulta = normalizar_busqueda(consulta).strip()
+        if not consulta:
+            return np.arange(len(self.textos), dtype=np.int32)
+        if len(consulta) < self.N:
+            return self._prefijo(consulta)
+        listas = []
+        for ngrama in {consulta[i:i + self.N] for i in range(len(consulta) - self.N + 1)}:
+            lista = self._listas.get(ngrama)
+            if lista is None:
+                return np.empty(0, dtype=np.int32)
+            listas.append(lista)
+        listas.sort(key=len)
+        candidatos = listas[0]
+        for lista in listas[1:]:
+            candidatos = np.intersect1d(candidatos, lista, assume_unique=True)
+            if not len(candidatos):
+                return candidatos
+        if len(consulta) > self.N:
+            candidatos = candidatos[np.char.find(self._textos_np[candidatos], consulta) >= 0]
+        # Las que empiezan por la consulta son un tramo contiguo de los textos ordenados.
+        prefijo = np.isin(candidatos, self._prefijo(consulta), assume_unique=True)
+        return np.concatenate([candidatos[prefijo], candidatos[~prefijo]])
+
+    def _prefijo(self, consulta):
+        inicio = bisect.bisect_left(self._ordenados, consulta)
+        fin = bisect.bisect_left(self._ordenados, consulta + '\uffff')
+        return np.sort(np.array(self._orden[inicio:fin], dtype=np.int32))
+
+
+class SnapshotEntregas:
+    """
+    Foto inmutable de la tabla de entregas con su índice por 'ID-partido'.
+
+    El índice y la lista de opciones ordenada se construyen una vez por carga,
+    así que seleccionar un partido en cada rerun no recorre la tabla. El índice
+    de búsqueda (ngramas) y las columnas de los filtros se crean la primera vez
+    que se buscan.
+    """
+
+    def __init__(self, df, indice=None, opciones=None, ngramas=None):
+        self.df = df
+        if indice is None:
+            indice = {}
+            if 'ID-partido' in df.columns:
+                for posicion, partido_id in enumerate(df['ID-partido'].tolist()):
+                    indice.setdefault(partido_id, []).append(posicion)
+        self.indice = indice
+        if opciones is None:
+            opciones = sorted((p for p in indice if not pd.isna(p)), key=str)
+        self.opciones = opciones
+        self._ngramas = ngramas
+        self._filtros = None
+
+    @classmethod
+    def desde_dataframe(cls, df):
+        return cls(_categorizar(df))
+
+    @property
+    def empty(self):
+        return self.df.empty
+
+    def __len__(self):
+        return len(self.df)
+
+    def posiciones(self, partido_id):
+        return self.indice.get(partido_id, [])
+
+    def fila(self, partido_id):
+        """Primera fila del partido, o None si no existe."""
+        posiciones = self.indice.get(partido_id)
+        if not posiciones:
+            return None
+        return self.df.iloc[posiciones[0]]
+
+    @property
+    def ngramas(self):
+        if self._ngramas is None:
+            self._ngramas = IndiceNgramas(self.opciones)
+        return self._ngramas
+
+    def _columnas_filtro(self):
+        """Verificado, piloto (normalizado) y fecha de la primera fila de cada opción, alineados con opciones."""
+        if self._filtros is None:
+            filas = self.df.iloc[[self.indice[opcion][0] for opcion in self.opciones]]
+
+            def columna(nombre):
+                if nombre not in filas.columns:
+                    return pd.Series([None] * len(filas), dtype=object)
+                return filas[nombre].astype(object).reset_index(drop=True)
+
+            verificado = columna('Verificado').fillna('').astype(str).to_numpy()
+            # Pocos pilotos distintos: el fragmento se busca en cada nombre una sola vez.
+            codigos, nombres = pd.factorize(columna('Piloto').map(_texto_celda))
+            pilotos = (codigos, [normalizar_busqueda(nombre) for nombre in nombres])
+            fechas = pd.to_datetime(columna('Fecha partido'), errors='coerce').to_numpy()
+            self._filtros = (verificado, pilotos, fechas)
+        return self._filtros
+
+    def estados(self):
+        """Valores de 'Verificado' presentes, para el filtro."""
+        return sorted(set(self._columnas_filtro()[0]) - {''})
+
+    def buscar(self, texto='', verificado=None, piloto=None, desde=None, hasta=None):
+        """
+        Posiciones en opciones de los partidos que encajan con la búsqueda y los
+        filtros: verificado es una colección de estados admitidos, piloto un
+        fragmento del nombre y desde/hasta un rango inclusivo de 'Fecha partido'.
+        """
+        resultado = self.ngramas.buscar(texto)
+        if not len(resultado) or not (verificado or piloto or desde or hasta):
+            return resultado
+        estados, pilotos, fechas = self._columnas_filtro()
+        mascara = np.ones(len(resultado), dtype=bool)
+        if verificado:
+            mascara &= np.isin(estados[resultado], list(verificado))
+        if piloto:
+            fragmento = normalizar_busqueda(piloto).strip()
+            codigos, nombres = pilotos
+            admitidos = [codigo for codigo, nombre in enumerate(nombres) if fragmento in nombre]
+            mascara &= np.isin(codigos[resultado], admitidos)
+        if desde:
+            mascara &= fechas[resultado] >= np.datetime64(pd.Timestamp(desde))
+        if hasta:
+            mascara &= fechas[resultado] <= np.datetime64(pd.Timestamp(hasta))
+        return resultado[mascara]
+
+
+class CacheEntregas:
+    """
+    Caché compartida (write-through) de la tabla de entregas.
+
+    tabla() sirve la foto en memoria mientras no caduque. Tras una escritura,
+    aplicar_actualizacion() parchea solo ese registro en memoria y en el
+    espejo, en lugar de tirar la caché de todos los usuarios.
+    """
+
+    def __init__(self, espejo, ttl=600):
+        self.espejo = espejo
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._cargado = 0.0
+        self.aciertos = 0
+        self.fallos = 0
+        self.parches = 0
+
+    def tabla(self):
+        """Devuelve la SnapshotEntregas actual; no debe modificarse (se comparte entre sesiones)."""
+        with self._lock:
+            if self._snapshot is not None and time.monotonic() - self._cargado < self.ttl:
+                self.aciertos += 1
+                return self._snapshot
+            self.fallos += 1
+            self.espejo.sincronizar()
+            self._snapshot = SnapshotEntregas.desde_dataframe(self.espejo.tabla_entregas())
+            # Se construye aquí, en la carga, y no en el primer rerun que busque.
+            self._snapshot.ngramas
+            self._cargado = time.monotonic()
+            return self._snapshot
+
+    def aplicar_actualizacion(self, record_id, fields):
+        """Parchea un registro ya escrito en Airtable, identificado por su 'Rec'."""
+        self.espejo.actualizar_registro(record_id, fields)
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None or 'Rec' not in snapshot.df.columns:
+                return
+            filas = snapshot.df.index[snapshot.df['Rec'] == record_id]
+            if len(filas) == 0:
+                return
+            # Copia antes de escribir: otras sesiones pueden estar leyendo la foto actual.
+            df = snapshot.df.copy()
+            for campo, valor in fields.items():
+                if campo not in df.columns:
+                    df[campo] = None
+                df[campo] = df[campo].astype(object)
+                for fila in filas:
+                    df.at[fila, campo] = valor
+            _categorizar(df, [c for c in fields if c in COLUMNAS_CATEGORICAS])
+            if 'ID-partido' in fields:
+                self._snapshot = SnapshotEntregas(df)
+            else:
+                self._snapshot = SnapshotEntregas(df, snapshot.indice, snapshot.opciones, snapshot.ngramas)
+            self.parches += 1
+
+    def estadisticas(self):
+        return {'aciertos': self.aciertos, 'fallos': self.fallos, 'parches': self.parches}
+
+
+class DirectorioAnalistas:
+    """
+    Índice analista -> mail para autocompletar el formulario.
+
+    Se carga una vez de la tabla 'analista' y se completa con las parejas
+    Analista/Mail que ya trae la tabla de entregas, así que sigue sirviendo si
+    la tabla de analistas no se puede leer. La búsqueda no distingue
+    mayúsculas ni tildes.
+    """
+
+    def __init__(self, parejas=()):
+        self._mails = {}
+        for nombre, mail in parejas:
+            self.anadir(nombre, mail)
+
+    def anadir(self, nombre, mail):
+        nombre = limpiar_caracteres(_texto_celda(nombre)).strip()
+        mail = limpiar_caracteres(_texto_celda(mail)).strip()
+        if not nombre:
+            return
+        clave = normalizar_busqueda(nombre)
+        # La primera fuente manda; las siguientes solo rellenan huecos.
+        actual = self._mails.get(clave)
+        if actual is None or (not actual[1] and mail):
+            self._mails[clave] = (nombre, mail)
+
+    @classmethod
+    def desde_tablas(cls, cliente=None, df=None, tabla=TABLA_ANALISTAS,
+                     campo_nombre=CAMPO_NOMBRE_ANALISTA, campo_mail=CAMPO_MAIL_ANALISTA):
+        directorio = cls()
+        if cliente is not None:
+            for pagina in leer_registros_paginados(cliente, tabla, vista=None, campos=[campo_nombre, campo_mail]):
+                for registro in pagina:
+                    campos = registro.get('fields', {})
+                    directorio.anadir(campos.get(campo_nombre), campos.get(campo_mail))
+        if df is not None and {'Analista', 'Mail'} <= set(df.columns):
+            parejas = df[['Analista', 'Mail']].astype(object).drop_duplicates()
+            for nombre, mail in parejas.itertuples(index=False):
+                directorio.anadir(nombre, mail)
+        return directorio
+
+    def __len__(self):
+        return len(self._mails)
+
+    def nombres(self):
+        return sorted((nombre for nombre, _ in self._mails.values()), key=normalizar_busqueda)
+
+    def mail(self, nombre):
+        """Mail del analista, o '' si no está en el directorio."""
+        encontrado = self._mails.get(normalizar_busqueda(nombre or '').strip())
+        return encontrado[1] if encontrado else ''
+
+
+class CuboTokens:
+    """
+    Limitador de peticiones (token bucket) del lado del cliente.
+    Airtable admite 5 peticiones por segundo y base.
+    """
+
+    def __init__(self, tasa=5.0, capacidad=5):
+        self.tasa = tasa
+        self.capacidad = capacidad
+        self._tokens = float(capacidad)
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+        self.esperas = 0
+        self.segundos_esperando = 0.0
+
+    def tomar(self):
+        """Consume un token, esperando si hace falta. Devuelve los segundos esperados."""
+        with self._lock:
+            ahora = time.monotonic()
+            self._tokens = min(self.capacidad, self._tokens + (ahora - self._ultimo) * self.tasa)
+            self._ultimo = ahora
+            self._tokens -= 1
+            espera = -self._tokens / self.tasa if self._tokens < 0 else 0.0
+            if espera:
+                self.esperas += 1
+                self.segundos_esperando += espera
+        if espera:
+            time.sleep(espera)
+        return espera
+
+    def disponible(self):
+        """Si tomar() devolvería ya, sin esperar."""
+        with self._lock:
+            return self._tokens + (time.monotonic() - self._ultimo) * self.tasa >= 1
+
+
+class EscritorAirtable:
+    """
+    Capa de escritura de TABLA_ENTREGAS que agrupa y fusiona actualizaciones.
+
+    escribir() deja los campos pendientes por registro (las escrituras sobre el
+    mismo registro se fusionan) y devuelve un Future. Un hilo los envía con el
+    PATCH multi-registro de Airtable, hasta MAX_REGISTROS por petición, pasando
+    por el CuboTokens para no superar el límite de la API. Si el limitador tiene
+    capacidad o ya hay un lote lleno, lo pendiente sale en el acto; si no,
+    intervalo es la ventana en la que se juntan más escrituras. Los
+    CAMPOS_OPCIONALES que la base no tiene se quitan de los envíos.
+    """
+
+    MAX_REGISTROS = 10
+    REINTENTOS = 5
+
+    def __init__(self, cliente, tabla=TABLA_ENTREGAS, limitador=None, intervalo=0.2):
+        self.url = posixpath.join(cliente.base_url, tabla)
+        self.ausentes = campos_ausentes(cliente, tabla)
+        self.headers = dict(cliente.headers, **{'Content-Type': 'application/json'})
+        self.limitador = limitador or CuboTokens()
+        self.intervalo = intervalo
+        self._sesion = requests.Session()
+        self._pendientes = {}
+        self._lock = threading.Lock()
+        self._hay_datos = threading.Event()
+        self._lote_lleno = threading.Event()
+        self._parar = threading.Event()
+        self._hilo = None
+        self.metricas = {'peticiones': 0, 'registros': 0, 'escrituras': 0, 'fusionadas': 0, 'reintentos': 0, 'errores': 0,
+                         'segundos_reintentando': 0.0, 'lotes_separados': 0, 'campos_omitidos': 0}
+
+    def iniciar(self):
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._bucle, name="escritor-airtable", daemon=True)
+            self._hilo.start()
+        return self
+
+    def parar(self):
+        self._parar.set()
+        self._hay_datos.set()
+        self._lote_lleno.set()
+
+    def escribir(self, record_id, fields):
+        """Encola una actualización parcial; el Future se resuelve al confirmarla Airtable."""
+        futuro = Future()
+        with self._lock:
+            self.metricas['escrituras'] += 1
+            pendiente = self._pendientes.get(record_id)
+            if pendiente is None:
+                self._pendientes[record_id] = (dict(fields), [futuro])
+            else:
+                pendiente[0].update(fields)
+                pendiente[1].append(futuro)
+                self.metricas['fusionadas'] += 1
+            if len(self._pendientes) >= self.MAX_REGISTROS:
+                self._lote_lleno.set()
+        self._hay_datos.set()
+        return futuro
+
+    def _enviar(self, lote):
+        cuerpo = json.dumps({'records': [
+            {'id': record_id, 'fields': {campo: valor for campo, valor in fields.items() if campo not in self.ausentes}}
+            for record_id, (fields, _) in lote
+        ]})
+        for intento in range(self.REINTENTOS):
+            self.limitador.tomar()
+            try:
+                respuesta = self._sesion.patch(self.url, data=cuerpo, headers=self.headers, timeout=30)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                # El PATCH fija valores: repetirlo aunque el primero llegase a aplicarse no cambia nada.
+                ultimo = e
+                espera = 2 ** intento
+            else:
+                self.metricas['peticiones'] += 1
+                if respuesta.status_code != 429 and respuesta.status_code < 500:
+                    break
+                # Airtable pide esperar 30 s tras un 429.
+                ultimo = AirtableError(str(respuesta.status_code), "Demasiados reintentos al escribir en Airtable")
+                espera = float(respuesta.headers.get('Retry-After', 30 if respuesta.status_code == 429 else 2 ** intento))
+            self.metricas['reintentos'] += 1
+            self.metricas['segundos_reintentando'] += espera
+            time.sleep(espera)
+        else:
+            raise ultimo
+        if respuesta.status_code != requests.codes.ok:
+            raise self._error(respuesta)
+        return respuesta.json()
+
+    @staticmethod
+    def _error(respuesta):
+        """AirtableError de una respuesta fallida, con su status_code aunque el cuerpo no sea JSON (p. ej. de un proxy)."""
+        try:
+            error_json = respuesta.json().get('error', {})
+        except (ValueError, AttributeError):
+            error_json = {'message': respuesta.text[:200] or None}
+        if not isinstance(error_json, dict):
+            error_json = {'type': error_json}
+        error = AirtableError(error_json.get('type', str(respuesta.status_code)), error_json.get('message'))
+        error.status_code = respuesta.status_code
+        return error
+
+    def vaciar(self):
+        """Envía todo lo pendiente en lotes de MAX_REGISTROS."""
+        with self._lock:
+            pendientes = list(self._pendientes.items())
+            self._pendientes.clear()
+        for i in range(0, len(pendientes), self.MAX_REGISTROS):
+            self._enviar_lote(pendientes[i:i + self.MAX_REGISTROS])
+
+    def _enviar_lote(self, lote):
+        try:
+            self._enviar(lote)
+        except Exception as e:
+            campo = campo_desconocido(e)
+            if campo in CAMPOS_OPCIONALES and campo not in self.ausentes:
+                # La base no tiene esa columna: se deja de escribir y el lote sale sin ella.
+                self.ausentes.add(campo)
+                self.metricas['campos_omitidos'] += 1
+                return self._enviar_lote(lote)
+            if len(lote) > 1 and 400 <= getattr(e, 'status_code', 0) < 500:
+                # El PATCH de varios registros es atómico: un registro inválido tumba el
+                # lote entero. De uno en uno, solo falla ese y el resto de entregas sigue.
+                self.metricas['lotes_separados'] += 1
+                for elemento in lote:
+                    self._enviar_lote([elemento])
+                return
+            self.metricas['errores'] += 1
+            for _, (_, futuros) in lote:
+                for futuro in futuros:
+                    futuro.set_exception(e)
+            return
+        self.metricas['registros'] += len(lote)
+        for _, (_, futuros) in lote:
+            for futuro in futuros:
+                futuro.set_result(True)
+
+    def _bucle(self):
+        while not self._parar.is_set():
+            self._hay_datos.wait()
+            self._hay_datos.clear()
+            if not self.limitador.disponible():
+                # La petición tendría que esperar al limitador de todos modos: mientras,
+                # se juntan más escrituras, hasta llenar un lote.
+                self._lote_lleno.wait(self.intervalo)
+            self._lote_lleno.clear()
+            self.vaciar()
+
+    def estadisticas(self):
+        return dict(self.metricas, esperas_limite=self.limitador.esperas,
+                    segundos_esperando=round(self.limitador.segundos_esperando, 3))
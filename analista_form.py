@@ -6,31 +6,13 @@ Created on Sun Aug 10 09:38:21 2025
 """
 
 import streamlit as st
-import pandas as pd
 import os
-import re
-import hashlib
-import datetime
-from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
-from googleapiclient.http import MediaIoBaseUpload
-import base64
-from email.mime.text import MIMEText
-from email.mime.image import MIMEImage
-from email.mime.multipart import MIMEMultipart
-from email.mime.audio import MIMEAudio
-from email.mime.base import MIMEBase
-from email import encoders
-import mimetypes
-from io import BytesIO
-import random
-import uuid
-# Importaciones para la mejora del PDF
-from jinja2 import Template
-from weasyprint import HTML, CSS
-from airtable import Airtable
+
+# Solo módulos ligeros al inicio: la pantalla de acceso se pinta sin esperar a
+# pandas, WeasyPrint ni las librerías de Google, que se importan en las
+# funciones que los usan (y las precarga el calentamiento en segundo plano).
+from metricas import metricas, medir, iniciar_servidor_metricas
+from arranque import Calentamiento
 
 # --- App configuration ---
 st.set_page_config(page_title="Protocolo entrega de imágenes", page_icon="✅", layout="wide")
@@ -40,382 +22,365 @@ st.title("Protocolo de confidencialidad en la entrega de imágenes")
 st.markdown('<link rel="manifest" href="/manifest.json">', unsafe_allow_html=True)
 
 
-# --- LOGIN LOGIC ---
-if "authenticated" not in st.session_state:
-    st.session_state["authenticated"] = False
-
-try:
-    PASSWORD = st.secrets["PASSWORD"]
-except KeyError:
-    st.error("No se encontró la contraseña en los secretos de Streamlit. Por favor, configura st.secrets['PASSWORD'].")
-    st.stop()
-
-if not st.session_state["authenticated"]:
-    st.subheader("Acceso Restringido")
-    password_input = st.text_input("Introduce la contraseña para acceder:", type="password")
-    
-    if st.button("Acceder"):
-        if password_input == PASSWORD:
-            st.session_state["authenticated"] = True
-            st.success("Acceso concedido.")
-            st.rerun()
-        else:
-            st.error("Contraseña incorrecta.")
-    
-    st.stop()
-
 # --- GOOGLE APIs ---
 SCOPES_GMAIL = ['https://www.googleapis.com/auth/gmail.send']
 SCOPES_DRIVE = ['https://www.googleapis.com/auth/drive']
 DRIVE_FOLDER_ID = "1yNFgOvRclge1SY9QtvnD980f3-4In_hs"
 
-@st.cache_resource(ttl=3600)
-def get_creds(scopes):
+class SinCredenciales(RuntimeError):
+    pass
+
+@st.cache_resource
+def _gestor_credenciales():
+    # Lanza en vez de devolver None: cache_resource no guarda las excepciones,
+    # así que un fallo (p. ej. en el calentamiento) se reintenta en la siguiente llamada.
+    creds_info = st.secrets.get("google_creds")
+    if not (creds_info and "token" in creds_info and "refresh_token" in creds_info):
+        raise SinCredenciales("No se encontraron credenciales válidas en st.secrets.")
+    from google_servicios import GestorCredenciales
+    return GestorCredenciales(creds_info, SCOPES_GMAIL + SCOPES_DRIVE).iniciar()
+
+def get_gestor_credenciales():
     """
     Manages Google authentication using a refresh token
     stored in st.secrets, to avoid the local server flow.
+    One token covers Gmail and Drive and is refreshed in the background.
     """
-    creds = None
     try:
-        creds_info = st.secrets.get("google_creds")
-        if creds_info and "token" in creds_info and "refresh_token" in creds_info:
-            creds = Credentials.from_authorized_user_info(info=creds_info, scopes=scopes)
-
-            if creds.expired and creds.refresh_token:
-                creds.refresh(Request())
-        else:
-            st.error("No se encontraron credenciales válidas en st.secrets.")
-            st.info("Por favor, sigue los pasos de la conclusión para generar un token y guardarlo.")
-            st.stop()
+        return _gestor_credenciales()
     except Exception as e:
-        st.error(f"Error al cargar las credenciales: {e}")
+        if isinstance(e, SinCredenciales):
+            st.error(str(e))
+            st.info("Por favor, sigue los pasos de la conclusión para generar un token y guardarlo.")
+        else:
+            st.error(f"Error al cargar las credenciales: {e}")
         st.stop()
-    
-    return creds
-
-def autenticar_gmail():
-    """Authenticates and returns the Gmail API service."""
-    creds = get_creds(SCOPES_GMAIL)
-    if creds:
-        return build('gmail', 'v1', credentials=creds)
-    return None
-
-def autenticar_drive():
-    """Authenticates and returns the Google Drive API service."""
-    creds = get_creds(SCOPES_DRIVE)
-    if creds:
-        return build('drive', 'v3', credentials=creds)
-    return None
-
-def crear_mensaje(remitente, destinatario, asunto, cuerpo_html, adjuntos=None):
-    """Creates and returns an email message with attachments."""
-    mensaje = MIMEMultipart()
-    mensaje['to'] = destinatario
-    mensaje['from'] = remitente
-    mensaje['subject'] = asunto
-    
-    mensaje.attach(MIMEText(cuerpo_html, 'html'))
-    
-    if adjuntos:
-        for adjunto_dict in adjuntos:
-            filename = adjunto_dict['nombre']
-            file_content = adjunto_dict['contenido']
-            
-            content_type, encoding = mimetypes.guess_type(filename)
-            if content_type is None or encoding is not None:
-                content_type = 'application/octet-stream'
-            
-            main_type, sub_type = content_type.split('/', 1)
-            
-            if main_type == 'image':
-                msg = MIMEImage(file_content, _subtype=sub_type)
-            elif main_type == 'audio':
-                msg = MIMEAudio(file_content, _subtype=sub_type)
-            else:
-                msg = MIMEBase(main_type, sub_type)
-                msg.set_payload(file_content)
-                encoders.encode_base64(msg)
-            
-            msg.add_header('Content-Disposition', 'attachment', filename=filename)
-            mensaje.attach(msg)
-    
-    return {'raw': base64.urlsafe_b64encode(mensaje.as_bytes()).decode()}
+        # Fuera del script (los hilos del calentamiento) st.stop() no corta la ejecución.
+        raise
+
+def get_creds():
+    """Returns the shared Google credentials, already refreshed."""
+    return get_gestor_credenciales().credenciales()
+
+@st.cache_resource
+def get_buzon_salida():
+    """Persistent outbox and its Gmail sender thread."""
+    from correo import BuzonSalida
+    from google_servicios import obtener_registro
+    gestor = get_gestor_credenciales()
+    cuota = int(os.environ.get("GMAIL_CUOTA_MINUTO", "60"))
+    return BuzonSalida(
+        lambda: obtener_registro().servicio('gmail', 'v1', gestor.credenciales()),
+        cuota_por_minuto=cuota
+    ).iniciar()
 
-def enviar_mensaje(servicio, remitente, mensaje):
-    """Sends the message via the Gmail API service."""
-    try:
-        mensaje_enviado = (servicio.users().messages().send(userId=remitente, body=mensaje).execute())
-        st.success(f"Correo enviado correctamente. ID del mensaje: {mensaje_enviado['id']}")
-        return mensaje_enviado
-    except Exception as e:
-        st.error(f"Ocurrió un error al enviar el correo: {e}")
-        return None
-
-def limpiar_caracteres(texto):
+# --- MAIN APPLICATION CODE (AUTHENTICATED USERS ONLY) ---
+def is_valid_email(email):
     """
-    Elimina comillas (simples y dobles) y corchetes ([], (), {}) de una cadena de texto.
+    Validates the format of an email address using a regular expression.
     """
-    caracteres_a_eliminar = r"[\"\'\[\]\(\)\{\}]"
-    return re.sub(caracteres_a_eliminar, "", texto)
+    from correo import es_mail_valido
+    return es_mail_valido(email)
+
+@st.cache_resource
+def get_espejo_airtable():
+    """Local SQLite mirror of the deliveries table, shared by every session."""
+    from airtable_datos import CAMPOS_FORMULARIO, EspejoAirtable, crear_cliente_airtable
+    cliente = crear_cliente_airtable(st.secrets["AIRTABLE_BASE_ID"], st.secrets["AIRTABLE_API_KEY"])
+    return EspejoAirtable(cliente, campos=CAMPOS_FORMULARIO)
+
+@st.cache_resource
+def get_cache_entregas():
+    """Write-through cache of tabla_entregas; submits patch it instead of clearing it."""
+    from airtable_datos import CacheEntregas
+    cache = CacheEntregas(get_espejo_airtable(), ttl=600)
+    metricas.registrar_fuente('cache_entregas', cache.estadisticas)
+    return cache
 
-# --- Función auxiliar para convertir imagen a Base64 ---
-def image_to_base64(image_path):
-    """Convierte una imagen local en una cadena Base64."""
+def conectar_a_airtable():
+    """Returns the indexed SnapshotEntregas of the deliveries table."""
+    with medir('airtable_carga'):
+        return get_cache_entregas().tabla()
+
+@st.cache_resource(ttl=3600)
+def get_directorio_analistas():
+    """Analyst -> mail index for the form's autocomplete (analista table + pairs in the deliveries table)."""
+    import requests
+    from airtable import AirtableError
+    from airtable_datos import DirectorioAnalistas, crear_cliente_airtable
+    df = conectar_a_airtable().df
     try:
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
-    except FileNotFoundError:
-        st.error(f"Error: No se encontró la imagen en la ruta {image_path}")
-        return None
+        cliente = crear_cliente_airtable(st.secrets["AIRTABLE_BASE_ID"], st.secrets["AIRTABLE_API_KEY"])
+        return DirectorioAnalistas.desde_tablas(cliente, df)
+    except (AirtableError, requests.RequestException):
+        # Sin la tabla de analistas el directorio se queda con lo que trae la de entregas.
+        return DirectorioAnalistas.desde_tablas(df=df)
 
-def calcular_hash_bytes(data):
-    """Calcula el hash SHA256 de un objeto en bytes."""
-    return hashlib.sha256(data).hexdigest()
-    
-# --- PDF CREATION FUNCTION (MODIFIED) ---
-def crear_pdf_con_template_en_memoria(selected_row, analista_value, codigo_unico, pdf_hash="", fecha_utc="", incluir_hash=True):
-    """
-    Generates a report PDF in memory (BytesIO) using an HTML template and Jinja2.
+RESULTADOS_POR_PAGINA = 50
+
+def selector_partidos(tabla):
     """
-    logo_path = "./img/LogoFLY-FUT.png"
-    base64_logo = image_to_base64(logo_path)
-    
-    html_template_string = """
-    <!DOCTYPE html>
-    <html lang="es">
-    <head>
-        <meta charset="UTF-8">
-        <title>Reporte de Confirmación de Entrega</title>
-        <style>
-            body { font-family: Arial, sans-serif; margin: 40px; color: #333; }
-            .header { text-align: center; border-bottom: 2px solid #333; padding-bottom: 20px; margin-bottom: 30px; }
-            .header h1 { color: #333; }
-            .content { line-height: 1.6; }
-            .field-row { margin-bottom: 10px; }
-            .field-name { font-weight: bold; color: #555; }
-            .field-value { margin-left: 10px; }
-            .logo { width: 300px; margin-bottom: 20px; }
-            .legal-annex { margin-top: 50px; font-size: 11px; color: #666; }
-            .legal-annex h4 { font-size: 12px; text-align: center; color: #333; }
-            .hash-section { margin-top: 15px; font-size: 10px; word-break: break-all; }
-        </style>
-    </head>
-    <body>
-        <div class="header">
-            {% if base64_logo %}
-                <img src="data:image/png;base64,{{ base64_logo }}" alt="Logo de la empresa" class="logo">
-            {% endif %}
-            <h1>Confirmación de Entrega</h1>
-        </div>
-        <div class="content">
-            <div class="field-row">
-                <span class="field-name">ID-partido:</span>
-                <span class="field-value">{{ row['ID-partido'] }}</span>
-            </div>
-            <div class="field-row">
-                <span class="field-name">Analista:</span>
-                <span class="field-value">{{ analista }}</span>
-            </div>
-            <div class="field-row">
-                <span class="field-name">Piloto:</span>
-                <span class="field-value">{{ row['Piloto'] }}</span>
-            </div>
-            <div class="field-row">
-                <span class="field-name">Fecha Partido:</span>
-                <span class="field-value">{{ row['Fecha partido'] }}</span>
-            </div>
-
-        </div>
-        <hr>
-        <div class="legal-annex">
-            <p>La confirmación de su recepción constituyen una aceptación expresa de la entrega física del material
-            identificado en este documento, así como la asunción de su custodia.</p>
-            <p>Esta confirmación constituye una firma electrónica simple y queda asociada a la identidad
-            del receptor, la fecha y hora de confirmación y la descripción del material
-            entregado. El registro se conserva para fines de auditoría y resolución de disputas.</p>
-            {% if incluir_hash %}
-            <div class="field-row hash-section">
-                <span class="field-name">Fecha/hora UTC de generación:</span>
-                <span class="field-value">{{ fecha_utc }}</span>
-            </div>
-            <div class="field-row hash-section">
-                <span class="field-name">Hash (SHA256) del PDF final:</span>
-                <span class="field-value">{{ pdf_hash }}</span>
-            </div>
-            {% endif %}
-        </div>
-    </body>
-    </html>
+    Search-as-you-type match selector. The search runs on the snapshot's
+    n-gram index and only the current page of results is sent to the
+    browser, however many matches the table holds.
     """
-
-    template = Template(html_template_string)
-    html_out = template.render(
-        row=selected_row,  
-        analista=analista_value,  
-        codigo=codigo_unico,  
-        pdf_hash=pdf_hash,
-        base64_logo=base64_logo,
-        fecha_utc=fecha_utc,
-        incluir_hash=incluir_hash
+    busqueda = st.text_input("Buscar partido", placeholder="ID de partido, p. ej. J05-ATM")
+    with st.expander("Filtros"):
+        col_estado, col_piloto, col_fecha = st.columns(3)
+        estados = col_estado.multiselect("Verificado", tabla.estados())
+        piloto = col_piloto.text_input("Piloto")
+        fechas = col_fecha.date_input("Fecha partido", value=(), format="DD/MM/YYYY")
+    desde = fechas[0] if len(fechas) > 0 else None
+    hasta = fechas[1] if len(fechas) > 1 else None
+
+    with medir('busqueda_partidos'):
+        resultados = tabla.buscar(busqueda, estados, piloto, desde, hasta)
+    total = len(resultados)
+    if not total:
+        st.info("Ningún partido coincide con la búsqueda.")
+        return None
+    paginas = -(-total // RESULTADOS_POR_PAGINA)
+    pagina = 1
+    if paginas > 1:
+        # Sin key: al cambiar el número de páginas el widget vuelve a la primera.
+        pagina = st.number_input("Página", min_value=1, max_value=paginas, value=1)
+    inicio = (pagina - 1) * RESULTADOS_POR_PAGINA
+    opciones = [tabla.opciones[i] for i in resultados[inicio:inicio + RESULTADOS_POR_PAGINA]]
+    st.caption(f"{inicio + 1}–{inicio + len(opciones)} de {total} partidos")
+    return st.selectbox('Selecciona un ID de partido', options=opciones)
+
+@st.cache_resource
+def get_escritor_airtable():
+    """Coalescing, rate-limited Airtable writer shared by every session."""
+    from airtable_datos import EscritorAirtable, crear_cliente_airtable
+    cliente = crear_cliente_airtable(st.secrets["AIRTABLE_BASE_ID"], st.secrets["AIRTABLE_API_KEY"])
+    escritor = EscritorAirtable(cliente).iniciar()
+    metricas.registrar_fuente('escritor_airtable', escritor.estadisticas)
+    return escritor
+
+def get_url_publica():
+    """Public base URL of server.py, used in the confirmation links (empty if not deployed)."""
+    return st.secrets.get("ENTREGAS_URL_PUBLICA") or os.environ.get("ENTREGAS_URL_PUBLICA", "")
+
+@st.cache_resource
+def get_indice_tokens():
+    """Token -> Rec index shared with server.py, which serves the confirmation links."""
+    from confirmaciones import IndiceTokens
+    return IndiceTokens()
+
+@st.cache_resource
+def get_cola_entregas():
+    """Durable submit queue and its worker pool, shared by every session."""
+    from cola_entregas import ColaTrabajos, PipelineEntrega
+    from google_servicios import AgrupadorPermisos, obtener_registro
+    gestor = get_gestor_credenciales()
+    cache = get_cache_entregas()
+    obtener_drive = lambda: obtener_registro().servicio('drive', 'v3', gestor.credenciales())
+    pipeline = PipelineEntrega(
+        get_escritor_airtable(),
+        obtener_drive,
+        DRIVE_FOLDER_ID,
+        al_actualizar=cache.aplicar_actualizacion,
+        permisos=AgrupadorPermisos(obtener_drive).iniciar(),
+        tokens=get_indice_tokens(),
+        # Sin URL pública no hay enlace que mandar: solo se genera el certificado.
+        buzon=get_buzon_salida() if get_url_publica() else None,
+        url_publica=get_url_publica()
     )
-
-    pdf_buffer = BytesIO()
-    HTML(string=html_out).write_pdf(target=pdf_buffer)
-    return pdf_buffer.getvalue()
-
-# --- Function to upload PDF to Drive (MODIFIED) ---
-def subir_a_drive_desde_bytes(pdf_bytes, file_name, folder_id):
+    from bloqueos import crear_bloqueos
+    workers = int(os.environ.get("ENTREGAS_WORKERS", "4"))
+    # Bloqueos por Rec compartidos con server.py (mismo fichero por defecto).
+    return ColaTrabajos(pipeline, workers=workers, bloqueos=crear_bloqueos()).iniciar()
+
+ETIQUETAS_ETAPA = {
+    'airtable_pendiente': "Actualizando Airtable a 'Pendiente'...",
+    'pdf': "Generando PDF...",
+    'drive': "Subiendo a Google Drive...",
+    'airtable_final': "Guardando el enlace del PDF en Airtable...",
+    'correo': "Enviando el enlace de confirmación...",
+}
+
+@st.fragment(run_every=2)
+def mostrar_estado_entrega():
+    """Polls the state of this session's last submit."""
+    from cola_entregas import EN_COLA, EN_PROCESO, COMPLETADO
+    trabajo_id = st.session_state.get('trabajo_entrega')
+    if not trabajo_id:
+        return
+    trabajo = get_cola_entregas().estado(trabajo_id)
+    if trabajo is None:
+        return
+    if trabajo['estado'] == EN_COLA:
+        st.info("Entrega en cola...")
+    elif trabajo['estado'] == EN_PROCESO:
+        st.info(ETIQUETAS_ETAPA.get(trabajo['etapa'], "Procesando la entrega..."))
+    elif trabajo['estado'] == COMPLETADO:
+        st.success("Registro de Airtable actualizado a 'Pendiente' y el PDF subido.")
+        if trabajo['resultado'].get('correo'):
+            st.info("Enlace de confirmación en cola de envío.")
+    else:
+        st.error(f"No se pudo completar la entrega: {trabajo['error']}. Por favor, inténtalo de nuevo.")
+        # Reintenta el mismo trabajo: mismo certificado, que ya está en la caché de PDF.
+        if st.button("Reintentar la entrega", key=f"reintentar_{trabajo_id}"):
+            get_cola_entregas().reintentar(trabajo_id)
+            st.rerun(scope="fragment")
+
+@st.cache_resource
+def get_servidor_metricas():
+    """Prometheus /metrics on METRICAS_PUERTO, if set (Streamlit can't serve its own routes)."""
+    puerto = os.environ.get("METRICAS_PUERTO")
+    return iniciar_servidor_metricas(int(puerto), disponibilidad=lambda: get_calentamiento().estado()) if puerto else None
+
+def mostrar_diagnostico():
+    """Operator-only panel with per-stage latencies and the latest spans."""
+    clave_operador = st.secrets.get("OPERADOR_PASSWORD")
+    if not clave_operador:
+        return
+    with st.sidebar.expander("Diagnóstico"):
+        if not st.session_state.get("operador"):
+            if st.text_input("Contraseña de operador", type="password", key="clave_operador") == clave_operador:
+                st.session_state["operador"] = True
+                st.rerun()
+            return
+        import pandas as pd
+        arranque = get_calentamiento().estado()
+        st.caption(f"Calentamiento: {'listo' if arranque['listo'] else 'en curso'}"
+                   + (f" en {arranque['segundos']:.1f} s" if arranque['segundos'] else ""))
+        st.dataframe(pd.DataFrame([
+            {'paso': paso, 'estado': datos['estado'], 'segundos': datos['segundos'], 'error': datos['error']}
+            for paso, datos in arranque['pasos'].items()
+        ]), hide_index=True)
+        if not metricas.activado:
+            st.info("Instrumentación desactivada (ENTREGAS_METRICAS=0).")
+            return
+        resumen = metricas.resumen()
+        if resumen:
+            st.dataframe(pd.DataFrame([
+                {'etapa': etapa, 'resultado': resultado, 'n': datos['n'], 'media (s)': round(datos['media'], 3),
+                 'p50 ≤ (s)': datos['p50'], 'p95 ≤ (s)': datos['p95'], 'p99 ≤ (s)': datos['p99']}
+                for (etapa, resultado), datos in resumen.items()
+            ]), hide_index=True)
+        recientes = metricas.recientes(20)
+        if recientes:
+            st.dataframe(pd.DataFrame(recientes).drop(columns='fin'), hide_index=True)
+        st.caption(f"Cola de entregas: {get_cola_entregas().pendientes()} pendientes · Correo: {get_buzon_salida().contar()}")
+        escritor = get_escritor_airtable().estadisticas()
+        st.caption(f"Escrituras en Airtable: {escritor['registros']} registros en {escritor['peticiones']} peticiones, "
+                   f"{escritor['reintentos']} reintentos ({escritor['segundos_reintentando']:.1f} s), {escritor['esperas_limite']} esperas por límite "
+                   f"({escritor['segundos_esperando']:.1f} s), {escritor['errores']} errores")
+        cache_tabla = get_cache_entregas().estadisticas()
+        st.caption(f"Caché de la tabla: {cache_tabla['aciertos']} aciertos, {cache_tabla['fallos']} fallos, "
+                   f"{cache_tabla['parches']} parches")
+        from certificado import obtener_renderizador
+        cache_pdf = obtener_renderizador().cache.estadisticas()
+        st.caption(f"Caché de PDF: {cache_pdf['tasa_aciertos']:.0%} de aciertos "
+                   f"({cache_pdf['aciertos_memoria']} en memoria, {cache_pdf['aciertos_disco']} en disco), "
+                   f"{cache_pdf['bytes_ahorrados'] / 1e6:.1f} MB sin renderizar")
+        pool = get_pool_render()
+        if pool is not None:
+            datos_pool = pool.estadisticas()
+            st.caption(f"Renderizadores: {datos_pool['listos']}/{datos_pool['procesos']} listos, "
+                       f"{datos_pool['en_cola']}/{datos_pool['max_cola']} en cola, "
+                       f"{datos_pool['renders']} PDFs, {datos_pool['reinicios']} reinicios"
+                       + (f", {datos_pool['memoria_mb']:.0f} MB" if 'memoria_mb' in datos_pool else ""))
+
+@st.cache_resource
+def get_pool_render():
+    from pool_render import crear_pool
+    return crear_pool()
+
+def precalentar_pdf():
+    # Con pool, WeasyPrint carga en sus procesos y este solo espera a que estén listos.
+    from certificado import usar_pool
+    usar_pool(get_pool_render()).precalentar()
+
+def precalentar_google():
+    from google_servicios import obtener_registro
+    registro = obtener_registro()
+    registro.documento('gmail', 'v1')
+    registro.documento('drive', 'v3')
+    get_creds()
+
+def precalentar_servicios():
+    # Arranca los workers y reanuda los trabajos y correos pendientes aunque nadie haya entrado.
+    get_cola_entregas()
+    get_buzon_salida()
+
+@st.cache_resource
+def get_calentamiento():
     """
-    Uploads a file to Google Drive from a bytes object, makes it public, and returns its view link.
+    Warm-up started on the first script run, before the login screen: fonts,
+    discovery documents, credentials and the first table snapshot load while
+    the user types the password.
     """
-    servicio_drive = autenticar_drive()
-    if not servicio_drive:
-        return None
-
-    file_metadata = {'name': file_name, 'parents': [folder_id]}
+    return Calentamiento([
+        ('pdf', precalentar_pdf),
+        ('google', precalentar_google),
+        ('datos', conectar_a_airtable),
+        ('analistas', get_directorio_analistas),
+        ('servicios', precalentar_servicios),
+    ]).iniciar()
 
-    # Usar MediaIoBaseUpload, que es la clase correcta para objetos de tipo BytesIO.
-    media = MediaIoBaseUpload(BytesIO(pdf_bytes), mimetype='application/pdf', resumable=True)
-    
-    try:
-        archivo = servicio_drive.files().create(body=file_metadata, media_body=media, fields='id, webContentLink').execute()
-        st.success(f"Archivo subido a Google Drive. ID: {archivo.get('id')}")
+get_calentamiento()
+get_servidor_metricas()
 
-        servicio_drive.permissions().create(
-            fileId=archivo.get('id'),
-            body={'type': 'anyone', 'role': 'reader'},
-            fields='id'
-        ).execute()
-
-        return archivo.get('webContentLink')
-    except Exception as e:
-        st.error(f"Error al subir o compartir el archivo: {e}")
-        return None
+# --- LOGIN LOGIC ---
+if "authenticated" not in st.session_state:
+    st.session_state["authenticated"] = False
 
-def envia_mail(mail_value, nombre_completo_piloto, codigo, nombre_analista, partido_id, fecha_partido, tipo_evento):
-    """
-    Envía un correo electrónico al analista con el código único y los detalles legales.
-    """
-    try:
-        service_gmail = autenticar_gmail()
-        if not service_gmail:
-            return False
-            
-        remitente = 'me'
+try:
+    PASSWORD = st.secrets["PASSWORD"]
+except KeyError:
+    st.error("No se encontró la contraseña en los secretos de Streamlit. Por favor, configura st.secrets['PASSWORD'].")
+    st.stop()
 
-        if isinstance(tipo_evento, list) and tipo_evento:
-            tipo_evento_str = tipo_evento[0].capitalize()
+if not st.session_state["authenticated"]:
+    st.subheader("Acceso Restringido")
+    password_input = st.text_input("Introduce la contraseña para acceder:", type="password")
+    
+    if st.button("Acceder"):
+        if password_input == PASSWORD:
+            st.session_state["authenticated"] = True
+            st.success("Acceso concedido.")
+            st.rerun()
         else:
-            tipo_evento_str = str(tipo_evento).capitalize()
-
-        asunto = f'[Fly-Fut] Confirmación de entrega de tarjeta SD - {tipo_evento_str}: {partido_id}'
-        
-        cuerpo_html = f"""
-        <html>
-        <head></head>
-        <body>
-            <p>Hola <b>{nombre_analista}</b>,</p>
-            <p>El piloto <b>{nombre_completo_piloto}</b> ha iniciado la entrega física de la tarjeta SD con el material del **{tipo_evento_str}** <b>{partido_id}</b>, jugado el <b>{fecha_partido}</b>.</p>
-            <hr style="border: 0; border-top: 1px solid #ccc; margin: 30px 0;">
-            <h4>Declaración de No Repudio y Validez Legal</h4>
-            <p>Al hacer clic en el siguiente enlace, usted está confirmando la recepción y aceptación de la custodia de la tarjeta SD. Esta acción genera un registro digital con fecha y hora, que certifica la entrega del material.</p>
-            <p style="text-align: center; margin-top: 20px;">
-                <a href="URL_DEL_ENLACE_DE_CONFIRMACION" style="background-color: #007bff; color: white; padding: 10px 20px; text-decoration: none; border-radius: 5px; font-weight: bold;">Confirmar Entrega</a>
-            </p>
-            <p>Esta confirmación tiene carácter de <b>firma electrónica simple</b> y garantiza la integridad de la transacción, impidiendo que cualquiera de las partes pueda repudiar la entrega posteriormente. Este registro se almacena de forma segura en nuestra base de datos para futuras auditorías.</p>
-            <p>Si tienes alguna pregunta o incidencia, por favor, contacta con nuestro departamento legal en <a href="mailto:legal@fly-fut.com">legal@fly-fut.com</a>.</p>
-            <p>Gracias por tu colaboración.</p>
-            <p>Atentamente,<br>
-            El equipo de Fly-Fut</p>
-        </body>
-        </html>
-        """
-        
-        mensaje = crear_mensaje(remitente, mail_value, asunto, cuerpo_html)
-        enviar_mensaje(service_gmail, remitente, mensaje)
-        return True
-    except Exception as e:
-        st.error(f"No se pudo enviar el correo: {e}")
-        return False
+            st.error("Contraseña incorrecta.")
     
-def enviar_pdf_confirmacion(mail_value, nombre_piloto, nombre_analista, partido_id, adjuntos=None):
-    """
-    Sends the final confirmation email with the attached PDF.
-    """
-    try:
-        service_gmail = autenticar_gmail()
-        if not service_gmail:
-            return False
-            
-        remitente = 'me'
-        asunto = f'Confirmación de entrega de imágenes - PDF adjunto para {partido_id}'
-        
-        cuerpo_html = f"""
-        <html>
-        <body>
-            <p>Hola {nombre_analista},</p>
-            <p>Se adjunta el certificado de confirmación de entrega del material del partido <b>{partido_id}</b>, que fue validado por el piloto <b>{nombre_piloto}</b>.</p>
-            <p>Este documento certifica la correcta transferencia del material según nuestro protocolo de seguridad.</p>
-            <p>Gracias por tu colaboración.</p>
-        </body>
-        </html>
-        """
-        
-        mensaje = crear_mensaje(remitente, mail_value, asunto, cuerpo_html, adjuntos)
-        enviar_mensaje(service_gmail, remitente, mensaje)
-        return True
-    except Exception as e:
-        st.error(f"Ocurrió un error al enviar el correo de confirmación: {e}")
-        return False
+    st.stop()
 
-# --- AIRTABLE API ---
-AIRTABLE_API_KEY = st.secrets["AIRTABLE_API_KEY"]
-AIRTABLE_BASE_ID = st.secrets["AIRTABLE_BASE_ID"]
-airtable = Airtable(AIRTABLE_BASE_ID, 'analista', AIRTABLE_API_KEY)
+mostrar_diagnostico()
 
-
-# --- MAIN APPLICATION CODE (AUTHENTICATED USERS ONLY) ---
-def is_valid_email(email):
-    """
-    Validates the format of an email address using a regular expression.
-    """
-    regex = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    return re.match(regex, email) is not None
-
-@st.cache_data(ttl=600)
-def conectar_a_airtable():
-    at_Table1 = Airtable(st.secrets["AIRTABLE_BASE_ID"], st.secrets["AIRTABLE_API_KEY"])
-    result_at_Table1 = at_Table1.get('Confirmaciones_de_Entrega', view='Grid view')
-    airtable_rows = [r['fields'] for r in result_at_Table1['records']]
-    df = pd.DataFrame(airtable_rows)
-
-    # Verifica si la columna 'Codigo_unico' existe y la crea si no es así
-    if 'Codigo_unico' not in df.columns:
-        df['Codigo_unico'] = '------'
-    
-    return df
+calentamiento = get_calentamiento()
+if not calentamiento.listo:
+    with st.spinner("Preparando la aplicación..."):
+        calentamiento.esperar(timeout=60)
 
 tabla_entregas = conectar_a_airtable()
 
 # --- Main screen ---
 if not tabla_entregas.empty:
-    partidos = tabla_entregas['ID-partido'].unique().tolist()
-    opcion_seleccionada = st.selectbox('Selecciona un ID de partido', options=partidos)
-    df_filtrado = tabla_entregas[tabla_entregas['ID-partido'] == opcion_seleccionada]
+    opcion_seleccionada = selector_partidos(tabla_entregas)
+    selected_row = tabla_entregas.fila(opcion_seleccionada) if opcion_seleccionada is not None else None
 
-    if not df_filtrado.empty:
-        selected_row = df_filtrado.iloc[0]
+    if selected_row is not None:
         st.session_state['selected_row'] = selected_row
-        
+        directorio = get_directorio_analistas()
+
+        # Fuera del formulario para que el mail se rellene al elegir el analista.
+        analista_fila = selected_row.get('Analista', '')
+        nombres = directorio.nombres()
+        if analista_fila and analista_fila not in nombres:
+            nombres = [analista_fila] + nombres
+        analista_value_input = st.selectbox(
+            "Analista", nombres, index=nombres.index(analista_fila) if analista_fila else None,
+            accept_new_options=True, placeholder="Escribe para buscar un analista", key=f"analista_{opcion_seleccionada}"
+        ) or ''
+        mail_defecto = selected_row.get('Mail', '') if analista_value_input == analista_fila else ''
+
         with st.form("update_form"):
-            analista_list = selected_row.get('Analista', '')
-            analista_raw = limpiar_caracteres(analista_list[0])
-            analista_value_input = st.text_input("Analista", value=analista_raw)
             st.text_input("Piloto", value=selected_row.get('Piloto', 'N/A'), disabled=True)
             st.text_input("Fecha Partido", value=selected_row.get('Fecha partido', 'N/A'), disabled=True)
-            mail_list = selected_row.get('Mail', '')
-            mail_raw=limpiar_caracteres(mail_list[0])
-            mail_value_input = st.text_input("Mail", value=mail_raw)
+            mail_value_input = st.text_input("Mail", value=mail_defecto or directorio.mail(analista_value_input))
             
             # --- Se elimina la opción de radio, se asume que siempre es "Enviar enlace"
             
@@ -428,65 +393,23 @@ if not tabla_entregas.empty:
                 st.warning("Por favor, introduce una dirección de correo electrónico válida.")
             else:
                 # La lógica para enviar el enlace solo se ejecuta si la validación es exitosa
-                at_Table1 = Airtable(st.secrets["AIRTABLE_BASE_ID"], st.secrets["AIRTABLE_API_KEY"])
                 record_id = selected_row.get('Rec')
                 
                 if record_id:
-                    # Update Airtable to 'Pendiente' before generating PDF
-                    # 1. Generar un token único
-                    token = str(uuid.uuid4())
-                    # 2. Actualizar Airtable con el nuevo token y el estado "Pendiente"
-                    fields_to_update_pending = {
-                        'Analista(Form)': analista_value_input,
-                        'Mail(Form)': mail_value_input,
-                        'Verificado': 'Pendiente', 
-                        'Codigo_unico': token
-                    }
-                    at_Table1.update('Confirmaciones_de_Entrega', record_id, fields_to_update_pending)
-                    st.success("Registro de Airtable actualizado a 'Pendiente'.")
-        
-                    with st.spinner("Generando PDF y subiendo a Google Drive..."):
-                        codigo_placeholder = "N/A"
-                        fecha_utc = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
-                        
-                        pdf_content_without_hash = crear_pdf_con_template_en_memoria(
-                            selected_row,
-                            analista_value_input,
-                            codigo_placeholder,
-                            fecha_utc=fecha_utc,
-                            incluir_hash=False
-                        )
-                        pdf_hash = calcular_hash_bytes(pdf_content_without_hash)
-                        final_pdf_content = crear_pdf_con_template_en_memoria(
-                            selected_row,
-                            analista_value_input,
-                            codigo_placeholder,
-                            pdf_hash=pdf_hash,
-                            fecha_utc=fecha_utc,
-                            incluir_hash=True
-                        )
-        
-                        file_name = f"reporte_verificado_{selected_row.get('ID-partido', 'sin_id')}.pdf"
-                        pdf_url = subir_a_drive_desde_bytes(final_pdf_content, file_name, DRIVE_FOLDER_ID)
-                    
-                    if pdf_url:
-                        # Update Airtable to 'Verificado' after successful PDF upload
-                        fields_to_update = {
-                            'Verificado': 'Pendiente',
-                            'PDF': [{'url': pdf_url}],
-                            'Hash_PDF': pdf_hash,
-                            'Codigo_unico': token
-                        }
-                        at_Table1.update('Confirmaciones_de_Entrega', record_id, fields_to_update)
-                        st.success("Registro de Airtable actualizado a 'Pendiente' y el PDF subido.")
-                        
-                        st.cache_data.clear()
-                        st.cache_resource.clear()
-                        st.rerun()
-                    else:
-                        st.error("No se pudo subir el PDF. Por favor, inténtalo de nuevo.")
+                    # El trabajo se procesa en segundo plano; el formulario solo lo encola.
+                    from cola_entregas import datos_entrega, clave_idempotencia
+                    # Un doble clic u otro operador con los mismos datos se une al trabajo en marcha.
+                    trabajo_id, nuevo = get_cola_entregas().encolar_o_unir(
+                        datos_entrega(selected_row, analista_value_input, mail_value_input), clave=record_id,
+                        idempotencia=clave_idempotencia(record_id, analista_value_input, mail_value_input)
+                    )
+                    st.session_state['trabajo_entrega'] = trabajo_id
+                    if not nuevo:
+                        st.info("Esta entrega ya estaba enviada: se muestra su estado en lugar de repetirla.")
                 else:
                     st.error("No se pudo obtener el ID del registro para actualizar Airtable.")
+
+        mostrar_estado_entrega()
             
     else:
         st.warning("No se encontraron registros para el partido seleccionado.")
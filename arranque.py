@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Calentamiento del proceso: carga en segundo plano lo que la primera entrega
+necesitaría (fuentes de WeasyPrint, documentos de descubrimiento, credenciales,
+primera instantánea de la tabla) mientras el usuario todavía está en la
+pantalla de acceso, y ofrece una señal de "listo".
+"""
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from metricas import medir
+
+PENDIENTE = 'pendiente'
+EN_CURSO = 'en_curso'
+OK = 'ok'
+ERROR = 'error'
+
+
+class Calentamiento:
+    """
+    Ejecuta los pasos de calentamiento en paralelo, cada uno en su hilo.
+
+    pasos: lista de (nombre, funcion) sin argumentos. Un paso que falla no
+    detiene a los demás; queda en ERROR y el camino normal lo reintentará.
+    """
+
+    def __init__(self, pasos):
+        self.pasos = list(pasos)
+        self._estado = {nombre: {'estado': PENDIENTE, 'segundos': None, 'error': None} for nombre, _ in self.pasos}
+        self._listo = threading.Event()
+        self._lock = threading.Lock()
+        self._hilo = None
+        self.inicio = None
+        self.duracion = None
+
+    def _ejecutar(self, nombre, funcion):
+        with self._lock:
+            self._estado[nombre]['estado'] = EN_CURSO
+        inicio = time.perf_counter()
+        try:
+            with medir(f'arranque_{nombre}'):
+                funcion()
+        except BaseException as e:
+            # Incluye st.stop() (StopException) cuando faltan secretos.
+            resultado = {'estado': ERROR, 'error': f"{type(e).__name__}: {e}"}
+        else:
+            resultado = {'estado': OK, 'error': None}
+        resultado['segundos'] = time.perf_counter() - inicio
+        with self._lock:
+            self._estado[nombre].update(resultado)
+
+    def _bucle(self):
+        self.inicio = time.perf_counter()
+        with ThreadPoolExecutor(max(len(self.pasos), 1), thread_name_prefix="calentamiento") as pool:
+            for nombre, funcion in self.pasos:
+                pool.submit(self._ejecutar, nombre, funcion)
+        self.duracion = time.perf_counter() - self.inicio
+        self._listo.set()
+
+    def iniciar(self):
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._bucle, name="calentamiento", daemon=True)
+            self._hilo.start()
+        return self
+
+    @property
+    def listo(self):
+        """True cuando todos los pasos han terminado (bien o mal)."""
+        return self._listo.is_set()
+
+    def esperar(self, timeout=None):
+        return self._listo.wait(timeout)
+
+    def estado(self):
+        """{'listo', 'sano', 'segundos', 'pasos': {nombre: {...}}} para la señal de disponibilidad."""
+        with self._lock:
+            pasos = {nombre: dict(datos) for nombre, datos in self._estado.items()}
+        return {
+            'listo': self.listo,
+            'sano': self.listo and all(p['estado'] == OK for p in pasos.values()),
+            'segundos': self.duracion,
+            'pasos': pasos,
+        }
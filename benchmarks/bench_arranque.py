@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Arranque en frío: tiempo de importación de cada módulo de la app y tiempo
+hasta el primer render de analista_form.py (la pantalla de acceso), cada
+medida en un intérprete nuevo para que nada venga ya importado.
+
+El primer render se mide con streamlit.testing (AppTest) y secretos falsos.
+Como bench_entrega.py, --guardar-base guarda el resultado en
+benchmarks/baselines/arranque.json y sin él se compara con esa base.
+
+Uso: python benchmarks/bench_arranque.py [--repeticiones 5] [--guardar-base]
+"""
+
+import os
+import sys
+import json
+import argparse
+import platform
+import datetime
+import statistics
+import subprocess
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+MODULOS = ['metricas', 'arranque', 'certificado', 'google_servicios', 'airtable_datos', 'correo', 'cola_entregas']
+MARGEN_RUIDO_MS = 20.0
+
+SCRIPT_IMPORTACION = """
+import sys, time
+inicio = time.perf_counter()
+import {modulo}
+print("ms", (time.perf_counter() - inicio) * 1000)
+"""
+
+SCRIPT_PRIMER_RENDER = """
+import time
+inicio = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+importado = time.perf_counter()
+app = AppTest.from_file({ruta!r}, default_timeout=120)
+app.secrets['PASSWORD'] = 'bench'
+app.secrets['AIRTABLE_API_KEY'] = 'bench'
+app.secrets['AIRTABLE_BASE_ID'] = 'appBENCH'
+app.run()
+assert [s.value for s in app.subheader] == ['Acceso Restringido'], app.exception
+print("ms", (time.perf_counter() - importado) * 1000)
+"""
+
+
+def _medir(script, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        salida = subprocess.run([sys.executable, "-c", script], cwd=RAIZ, capture_output=True, text=True)
+        if salida.returncode != 0:
+            raise RuntimeError(salida.stderr.strip().splitlines()[-1] if salida.stderr else "fallo sin salida")
+        # El calentamiento puede escribir en stdout; la medida va en la línea "ms <valor>".
+        medida = [linea for linea in salida.stdout.splitlines() if linea.startswith("ms ")][-1]
+        tiempos.append(float(medida.split()[1]))
+    return round(statistics.median(tiempos), 1)
+
+
+def ejecutar(repeticiones):
+    importacion = {}
+    for modulo in MODULOS:
+        try:
+            importacion[modulo] = _medir(SCRIPT_IMPORTACION.format(modulo=modulo), repeticiones)
+        except RuntimeError as e:
+            importacion[modulo] = None
+            print(f"{modulo}: no se pudo importar ({e})")
+    return {
+        'importacion_ms': importacion,
+        'primer_render_ms': _medir(SCRIPT_PRIMER_RENDER.format(ruta=os.path.join(RAIZ, "analista_form.py")), repeticiones),
+        'repeticiones': repeticiones,
+        'fecha': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'maquina': f"{platform.machine()} {platform.python_implementation()} {platform.python_version()}",
+    }
+
+
+def comparar(resultado, base, tolerancia):
+    regresiones = []
+    pares = [('primer_render', base['primer_render_ms'], resultado['primer_render_ms'])]
+    pares += [(f"import {m}", base['importacion_ms'].get(m), ms) for m, ms in resultado['importacion_ms'].items()]
+    for nombre, antes, ahora in pares:
+        if antes is not None and ahora is not None and ahora > antes * (1 + tolerancia) + MARGEN_RUIDO_MS:
+            regresiones.append(f"{nombre}: {antes:.0f} -> {ahora:.0f} ms")
+    return regresiones
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tiempos de arranque en frío de la app.")
+    parser.add_argument("--repeticiones", type=int, default=5, help="Intérpretes nuevos por medida (se usa la mediana)")
+    parser.add_argument("--guardar-base", action="store_true", help="Guarda el resultado como base")
+    parser.add_argument("--tolerancia", type=float, default=0.2, help="Empeoramiento admitido frente a la base")
+    args = parser.parse_args(argv)
+
+    resultado = ejecutar(args.repeticiones)
+    for modulo, ms in resultado['importacion_ms'].items():
+        if ms is not None:
+            print(f"import {modulo:<18} {ms:8.1f} ms")
+    print(f"primer render (acceso)   {resultado['primer_render_ms']:8.1f} ms")
+
+    ruta_base = os.path.join(BASELINES_DIR, "arranque.json")
+    if args.guardar_base:
+        os.makedirs(BASELINES_DIR, exist_ok=True)
+        with open(ruta_base, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, indent=2)
+        print(f"Base guardada en {ruta_base}")
+        return 0
+    if not os.path.exists(ruta_base):
+        print("Sin base guardada (usa --guardar-base).")
+        return 0
+    with open(ruta_base, encoding="utf-8") as f:
+        base = json.load(f)
+    regresiones = comparar(resultado, base, args.tolerancia)
+    for regresion in regresiones:
+        print(f"REGRESIÓN {regresion}")
+    if not regresiones:
+        print(f"Sin regresiones frente a arranque.json ({base['fecha']}).")
+    return 1 if regresiones else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Latencia por certificado al subirlo a un Drive local falso: subida resumable
+más permiso individual (comportamiento anterior) frente a subida multipart
+por debajo del umbral y permisos agrupados en peticiones batch.
+
+Uso: python benchmarks/bench_drive.py [certificados] [hilos] [latencia_ms]
+"""
+
+import os
+import sys
+import time
+import statistics
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.oauth2.credentials import Credentials
+from googleapiclient.http import MediaIoBaseUpload
+
+from google_servicios import RegistroServicios, AgrupadorPermisos, subir_pdf_a_drive
+from servidores_falsos import ServidorGoogleFalso
+
+PDF_FALSO = b"%PDF-1.7\n" + b"0" * 40_000
+
+
+def subir_anterior(servicio_drive, pdf_bytes, file_name, folder_id):
+    media = MediaIoBaseUpload(BytesIO(pdf_bytes), mimetype='application/pdf', resumable=True)
+    archivo = servicio_drive.files().create(body={'name': file_name, 'parents': [folder_id]},
+                                            media_body=media, fields='id, webContentLink').execute()
+    servicio_drive.permissions().create(fileId=archivo['id'], body={'type': 'anyone', 'role': 'reader'}, fields='id').execute()
+    return archivo['id'], archivo['webContentLink']
+
+
+def ejecutar(nombre, subir, servidor, certificados, hilos):
+    servidor.peticiones.clear()
+    tiempos = []
+
+    def una(i):
+        inicio = time.perf_counter()
+        subir(f"reporte_verificado_{i}.pdf")
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(hilos) as pool:
+        list(pool.map(una, range(certificados)))
+    total = time.perf_counter() - inicio
+    tiempos.sort()
+    print(f"{nombre:<22} mediana={statistics.median(tiempos):7.1f} ms  p95={tiempos[int(len(tiempos) * 0.95) - 1]:7.1f} ms  "
+          f"peticiones={len(servidor.peticiones):4d}  {certificados / total:6.1f} cert/s")
+
+
+if __name__ == "__main__":
+    certificados = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    hilos = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    latencia = float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.02
+
+    servidor = ServidorGoogleFalso(latencia=latencia).arrancar()
+    creds = Credentials(token="token-local")
+    registro = RegistroServicios(endpoints={'drive': servidor.url})
+    drive = lambda: registro.servicio('drive', 'v3', creds)
+    permisos = AgrupadorPermisos(drive).iniciar()
+
+    ejecutar("resumable + permiso", lambda nombre: subir_anterior(drive(), PDF_FALSO, nombre, "carpeta"),
+             servidor, certificados, hilos)
+    ejecutar("multipart + permiso", lambda nombre: subir_pdf_a_drive(drive(), PDF_FALSO, nombre, "carpeta"),
+             servidor, certificados, hilos)
+    ejecutar("multipart + batch", lambda nombre: subir_pdf_a_drive(drive(), PDF_FALSO, nombre, "carpeta", permisos),
+             servidor, certificados, hilos)
+    permisos.parar()
+    servidor.shutdown()
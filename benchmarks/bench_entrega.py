@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark de extremo a extremo de una entrega contra servidores locales que
+imitan Airtable, Drive y Gmail: carga de la tabla, cola, PDF, subida a Drive,
+escrituras en Airtable y envío del correo de confirmación.
+
+Informa de p50/p95/p99 por etapa y de entregas por segundo. Con --guardar-base
+guarda el resultado en benchmarks/baselines/; sin él, compara con la base del
+mismo escenario (si existe) y termina con código 1 si hay una regresión.
+
+Uso: python benchmarks/bench_entrega.py [--entregas 200] [--latencia-ms 20]
+     [--tasa-error 0.02] [--pdf falso] [--guardar-base]
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import hashlib
+import argparse
+import platform
+import datetime
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.oauth2.credentials import Credentials
+
+from airtable_datos import (TABLA_ENTREGAS, CAMPOS_FORMULARIO, EspejoAirtable, CacheEntregas, EscritorAirtable,
+                            crear_cliente_airtable)
+from google_servicios import RegistroServicios, AgrupadorPermisos
+from cola_entregas import ColaTrabajos, PipelineEntrega, COMPLETADO, ERROR
+from correo import BuzonSalida, PENDIENTE, ENVIANDO, ENVIADO, FALLIDO
+from confirmaciones import IndiceTokens
+from servidores_falsos import ServidorAirtableFalso, ServidorGoogleFalso
+from fixtures_entregas import registros_entregas
+
+BASELINES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+ETAPAS = ['carga', 'cola', 'pdf', 'drive', 'airtable', 'correo', 'total']
+PDF_FALSO = b"%PDF-1.7\n" + b"0" * 40_000
+# Por debajo de este margen (ms) una diferencia de p95 se considera ruido.
+MARGEN_RUIDO_MS = 2.0
+# Con menos muestras el p95 es una sola medida (p. ej. 'carga', n=1): no se compara.
+MIN_MUESTRAS = 20
+
+
+def pdf_falso(fila, analista, codigo, fecha_utc=""):
+    """Sustituto de crear_pdf_certificado para medir solo las etapas de red."""
+    return PDF_FALSO, hashlib.sha256(json.dumps([fila, analista, codigo, fecha_utc], sort_keys=True, default=str).encode()).hexdigest()
+
+
+def percentil(valores, p):
+    """Percentil por rango más cercano."""
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    return ordenados[max(math.ceil(p / 100 * len(ordenados)), 1) - 1]
+
+
+def resumir(muestras):
+    """{etapa: [segundos]} -> {etapa: {'n', 'p50', 'p95', 'p99'}} en milisegundos."""
+    return {
+        etapa: {'n': len(valores), **{f"p{p}": round(percentil(valores, p) * 1000, 2) for p in (50, 95, 99)}}
+        for etapa, valores in muestras.items() if valores
+    }
+
+
+def _segundos_entre(desde_iso, hasta_iso):
+    return (datetime.datetime.fromisoformat(hasta_iso) - datetime.datetime.fromisoformat(desde_iso)).total_seconds()
+
+
+def ejecutar(args, directorio):
+    registros = registros_entregas(args.entregas, semilla=args.semilla)
+    inyeccion = dict(tasa_error=args.tasa_error, codigo_error=args.codigo_error, semilla=args.semilla)
+    airtable = ServidorAirtableFalso({TABLA_ENTREGAS: registros}, latencia=args.latencia_ms / 1000, **inyeccion).arrancar()
+    google = ServidorGoogleFalso(latencia=args.latencia_ms / 1000, **inyeccion).arrancar()
+
+    cliente = crear_cliente_airtable("appBENCH", "key-local", api_url=airtable.api_url)
+    creds = Credentials(token="token-local")
+    registro = RegistroServicios(endpoints={'drive': google.url, 'gmail': google.url})
+    obtener_drive = lambda: registro.servicio('drive', 'v3', creds)
+
+    muestras = {etapa: [] for etapa in ETAPAS}
+
+    inicio = time.perf_counter()
+    cache = CacheEntregas(EspejoAirtable(cliente, ruta=os.path.join(directorio, "espejo.sqlite"), campos=CAMPOS_FORMULARIO))
+    tabla = cache.tabla()
+    muestras['carga'].append(time.perf_counter() - inicio)
+
+    escritor = EscritorAirtable(cliente).iniciar()
+    permisos = AgrupadorPermisos(obtener_drive).iniciar()
+    buzon = BuzonSalida(lambda: registro.servicio('gmail', 'v1', creds), ruta=os.path.join(directorio, "buzon.sqlite"),
+                        cuota_por_minuto=args.cuota_gmail).iniciar()
+    pipeline = PipelineEntrega(escritor, obtener_drive, "carpeta-bench", al_actualizar=cache.aplicar_actualizacion,
+                               permisos=permisos, generar_pdf=pdf_falso if args.pdf == 'falso' else None,
+                               tokens=IndiceTokens(os.path.join(directorio, "tokens.sqlite")),
+                               buzon=buzon, url_publica="https://entregas.local")
+
+    def procesar(datos, marcar_etapa):
+        espera = time.time() - datos['encolado']
+        resultado = pipeline(datos, marcar_etapa)
+        resultado['tiempos']['cola'] = espera
+        resultado['tiempos']['total'] = time.time() - datos['encolado']
+        resultado['fin'] = time.perf_counter()
+        return resultado
+
+    cola = ColaTrabajos(procesar, ruta=os.path.join(directorio, "cola.sqlite"), workers=args.workers, espera=0.05).iniciar()
+
+    # Mismos datos que encola el formulario al pulsar "Enviar enlace de confirmación".
+    inicio = time.perf_counter()
+    trabajos = []
+    for partido_id in tabla.opciones:
+        fila = tabla.fila(partido_id)
+        trabajos.append(cola.encolar({
+            'rec': fila.get('Rec'),
+            'fila': fila.dropna().to_dict(),
+            'analista': fila.get('Analista'),
+            'mail': fila.get('Mail'),
+            'token': f"bench-{partido_id}",
+            'fecha_utc': "2025-08-10 12:00:00 UTC",
+            'encolado': time.time(),
+        }, clave=fila.get('Rec')))
+
+    limite = time.time() + args.timeout
+    while cola.pendientes() and time.time() < limite:
+        time.sleep(0.05)
+    estados = [cola.estado(trabajo_id) for trabajo_id in trabajos]
+    completados = [t for t in estados if t['estado'] == COMPLETADO]
+    fin = max((t['resultado']['fin'] for t in completados), default=time.perf_counter())
+
+    for trabajo in completados:
+        for etapa, segundos in trabajo['resultado']['tiempos'].items():
+            muestras[etapa].append(segundos)
+
+    while (buzon.contar().get(PENDIENTE) or buzon.contar().get(ENVIANDO)) and time.time() < limite:
+        time.sleep(0.05)
+    correos = [buzon.estado(t['resultado']['correo']) for t in completados]
+    for correo in correos:
+        if correo['estado'] == ENVIADO:
+            muestras['correo'].append(_segundos_entre(correo['creado'], correo['enviado']))
+
+    for componente in (cola, buzon, permisos, escritor):
+        componente.parar()
+    airtable.shutdown()
+    google.shutdown()
+
+    return {
+        'escenario': escenario(args),
+        'config': {'entregas': args.entregas, 'workers': args.workers, 'latencia_ms': args.latencia_ms,
+                   'tasa_error': args.tasa_error, 'codigo_error': args.codigo_error, 'semilla': args.semilla,
+                   'pdf': args.pdf, 'cuota_gmail': args.cuota_gmail},
+        'etapas': resumir(muestras),
+        'entregas_s': round(len(completados) / (fin - inicio), 2) if completados else 0.0,
+        'errores': {
+            'entregas': sum(1 for t in estados if t['estado'] == ERROR),
+            'sin_terminar': sum(1 for t in estados if t['estado'] not in (COMPLETADO, ERROR)),
+            'correos': sum(1 for c in correos if c['estado'] == FALLIDO),
+            'inyectados_airtable': airtable.errores,
+            'inyectados_google': google.errores,
+        },
+        'peticiones': {'airtable': len(airtable.peticiones), 'google': len(google.peticiones)},
+        'fecha': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'maquina': f"{platform.machine()} {platform.python_implementation()} {platform.python_version()}",
+    }
+
+
+def escenario(args):
+    return f"entrega_{args.pdf}_n{args.entregas}_w{args.workers}_l{args.latencia_ms:g}_e{args.tasa_error:g}"
+
+
+def imprimir(resultado):
+    print(f"Escenario {resultado['escenario']}")
+    print(f"{'etapa':<10} {'n':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for etapa in ETAPAS:
+        datos = resultado['etapas'].get(etapa)
+        if datos:
+            print(f"{etapa:<10} {datos['n']:>5} {datos['p50']:>9.1f} {datos['p95']:>9.1f} {datos['p99']:>9.1f}")
+    print(f"entregas/s: {resultado['entregas_s']:.2f}   errores: {resultado['errores']}   peticiones: {resultado['peticiones']}")
+
+
+def comparar(resultado, base, tolerancia):
+    """Lista de regresiones frente a la base: p95 por etapa (con MIN_MUESTRAS o más) y entregas por segundo."""
+    regresiones = []
+    for etapa, datos in resultado['etapas'].items():
+        anterior = base['etapas'].get(etapa)
+        if not anterior or min(datos['n'], anterior['n']) < MIN_MUESTRAS:
+            continue
+        if datos['p95'] > anterior['p95'] * (1 + tolerancia) + MARGEN_RUIDO_MS:
+            regresiones.append(f"{etapa}: p95 {anterior['p95']:.1f} -> {datos['p95']:.1f} ms")
+    if resultado['entregas_s'] < base['entregas_s'] * (1 - tolerancia):
+        regresiones.append(f"entregas/s: {base['entregas_s']:.2f} -> {resultado['entregas_s']:.2f}")
+    for clave in ('entregas', 'correos'):
+        if resultado['errores'][clave] > base['errores'][clave]:
+            regresiones.append(f"errores en {clave}: {base['errores'][clave]} -> {resultado['errores'][clave]}")
+    return regresiones
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de extremo a extremo de las entregas.")
+    parser.add_argument("--entregas", type=int, default=200, help="Entregas a procesar")
+    parser.add_argument("--workers", type=int, default=4, help="Workers de la cola")
+    parser.add_argument("--latencia-ms", type=float, default=20, help="Latencia de cada respuesta de los servidores falsos")
+    parser.add_argument("--tasa-error", type=float, default=0.0, help="Fracción de peticiones que fallan")
+    parser.add_argument("--codigo-error", type=int, default=503, help="Código HTTP de los errores inyectados")
+    parser.add_argument("--semilla", type=int, default=0, help="Semilla de los datos y de los errores")
+    parser.add_argument("--pdf", choices=['real', 'falso'], default='real',
+                        help="'falso' sustituye WeasyPrint por un PDF fijo para medir solo la red")
+    parser.add_argument("--cuota-gmail", type=int, default=6000, help="Envíos de Gmail por minuto")
+    parser.add_argument("--timeout", type=float, default=300, help="Segundos máximos de espera")
+    parser.add_argument("--guardar-base", action="store_true", help="Guarda el resultado como base del escenario")
+    parser.add_argument("--tolerancia", type=float, default=0.2, help="Empeoramiento admitido frente a la base")
+    args = parser.parse_args(argv)
+
+    directorio = tempfile.mkdtemp(prefix="bench_entrega_")
+    try:
+        resultado = ejecutar(args, directorio)
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+    imprimir(resultado)
+
+    ruta_base = os.path.join(BASELINES_DIR, f"{resultado['escenario']}.json")
+    if args.guardar_base:
+        os.makedirs(BASELINES_DIR, exist_ok=True)
+        with open(ruta_base, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, indent=2, ensure_ascii=False)
+        print(f"Base guardada en {ruta_base}")
+        return 0
+    if not os.path.exists(ruta_base):
+        print("Sin base para este escenario (usa --guardar-base).")
+        return 0
+    with open(ruta_base, encoding="utf-8") as f:
+        base = json.load(f)
+    regresiones = comparar(resultado, base, args.tolerancia)
+    for regresion in regresiones:
+        print(f"REGRESIÓN {regresion}")
+    if not regresiones:
+        print(f"Sin regresiones frente a {os.path.basename(ruta_base)} ({base['fecha']}).")
+    return 1 if regresiones else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+Exportación de la tabla de entregas contra un Airtable local falso: registros
+por segundo y memoria máxima del proceso, para comprobar que la memoria no
+crece con el número de registros (se escribe por bloques).
+
+Uso: python benchmarks/bench_exportacion.py [registros] [filas_por_grupo]
+"""
+
+import os
+import sys
+import time
+import resource
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from airtable_datos import TABLA_ENTREGAS, crear_cliente_airtable, leer_registros_paginados
+from exportar_entregas import CAMPOS_EXPORTACION, exportar, leer_exportacion
+from fixtures_entregas import registros_entregas
+from servidores_falsos import ServidorAirtableFalso
+
+
+def memoria_maxima_mb():
+    # ru_maxrss va en KB en Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+if __name__ == "__main__":
+    registros = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    filas_por_grupo = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+
+    servidor = ServidorAirtableFalso({TABLA_ENTREGAS: registros_entregas(registros)}).arrancar()
+    cliente = crear_cliente_airtable("appBENCH", "key-local", api_url=servidor.api_url)
+    antes = memoria_maxima_mb()
+    with tempfile.TemporaryDirectory() as directorio:
+        inicio = time.perf_counter()
+        filas, rutas = exportar(lambda formula: leer_registros_paginados(cliente, campos=CAMPOS_EXPORTACION, formula=formula),
+                                directorio, filas_por_grupo=filas_por_grupo)
+        segundos = time.perf_counter() - inicio
+        tamanos = {formato: os.path.getsize(ruta) / 1e6 for formato, ruta in rutas.items()}
+        print(f"{filas} registros en {segundos:.1f} s ({filas / segundos:.0f}/s)  "
+              f"memoria máxima +{memoria_maxima_mb() - antes:.0f} MB  "
+              + "  ".join(f"{formato}={mb:.1f} MB" for formato, mb in tamanos.items()))
+        assert len(leer_exportacion(directorio)) == registros
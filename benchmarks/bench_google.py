@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Latencia de una subida a Drive (files.create + permissions.create) y de un
+envío de Gmail contra un stub local: construyendo el cliente en cada llamada
+(comportamiento anterior) frente al RegistroServicios.
+
+Uso: python benchmarks/bench_google.py [repeticiones]
+"""
+
+import os
+import sys
+import time
+import statistics
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httplib2
+import google_auth_httplib2
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build_from_document
+from googleapiclient.http import MediaIoBaseUpload
+
+from google_servicios import RegistroServicios
+from servidores_falsos import ServidorGoogleFalso
+
+PDF_FALSO = b"%PDF-1.7\n" + b"0" * 40_000
+
+
+def subir(servicio_drive):
+    media = MediaIoBaseUpload(BytesIO(PDF_FALSO), mimetype='application/pdf', resumable=True)
+    archivo = servicio_drive.files().create(body={'name': 'bench.pdf'}, media_body=media, fields='id, webContentLink').execute()
+    servicio_drive.permissions().create(fileId=archivo['id'], body={'type': 'anyone', 'role': 'reader'}, fields='id').execute()
+
+
+def enviar(servicio_gmail):
+    servicio_gmail.users().messages().send(userId='me', body={'raw': 'aG9sYQ=='}).execute()
+
+
+def medir(nombre, funcion, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    print(f"{nombre:<26} mediana={statistics.median(tiempos):7.2f} ms  p95={sorted(tiempos)[int(len(tiempos) * 0.95) - 1]:7.2f} ms")
+
+
+if __name__ == "__main__":
+    repeticiones = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    servidor = ServidorGoogleFalso().arrancar()
+    creds = Credentials(token="token-local")
+    registro = RegistroServicios(endpoints={'drive': servidor.url, 'gmail': servidor.url})
+
+    def construir(api, version):
+        # Lo que hacía build() en cada llamada: parsear el documento y crear un transporte nuevo.
+        with open(os.path.join(registro.discovery_dir, f"{api}.{version}.json"), encoding="utf-8") as f:
+            documento = f.read()
+        documento = documento.replace('"rootUrl": "https://www.googleapis.com/"', f'"rootUrl": "{servidor.url}"')
+        documento = documento.replace('"rootUrl": "https://gmail.googleapis.com/"', f'"rootUrl": "{servidor.url}"')
+        http = google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http())
+        return build_from_document(documento, http=http)
+
+    medir("drive, build por llamada", lambda: subir(construir('drive', 'v3')), repeticiones)
+    medir("drive, registro", lambda: subir(registro.servicio('drive', 'v3', creds)), repeticiones)
+    medir("gmail, build por llamada", lambda: enviar(construir('gmail', 'v1')), repeticiones)
+    medir("gmail, registro", lambda: enviar(registro.servicio('gmail', 'v1', creds)), repeticiones)
+    servidor.shutdown()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Latencia por certificado: reconstrucción completa en cada llamada (comportamiento
+anterior) frente al renderizador compartido de certificado.py, y certificados por
+segundo con varios hilos pidiendo a la vez: renderizador en el propio proceso
+frente al pool de procesos de pool_render.py. La caché de PDF se desactiva para
+medir siempre WeasyPrint.
+
+Uso: python benchmarks/bench_render.py [repeticiones] [procesos] [hilos]
+"""
+
+import os
+import sys
+import time
+import statistics
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jinja2 import Template
+from weasyprint import HTML, CSS
+
+import certificado
+from pool_render import PoolRenderizado
+
+FILA = {'ID-partido': 'J01-BENCH-LOCAL', 'Piloto': 'Piloto Prueba', 'Fecha partido': '2025-08-10'}
+FECHA_UTC = "2025-08-10 12:00:00 UTC"
+
+
+def render_sin_cache():
+    """Reconstruye plantilla, logo, CSS y fuentes en cada llamada."""
+    with open(os.path.join(certificado.TEMPLATES_DIR, certificado.PLANTILLA_CERTIFICADO), encoding="utf-8") as f:
+        template = Template(f.read())
+    html_out = template.render(
+        row=FILA, analista="Analista", codigo="N/A", pdf_hash="0" * 64,
+        base64_logo=certificado.image_to_base64(certificado.LOGO_PATH),
+        fecha_utc=FECHA_UTC, incluir_hash=True
+    )
+    pdf_buffer = BytesIO()
+    HTML(string=html_out).write_pdf(target=pdf_buffer, stylesheets=[CSS(filename=certificado.CSS_CERTIFICADO)])
+    return pdf_buffer.getvalue()
+
+
+def render_con_cache():
+    return certificado.crear_pdf_con_template_en_memoria(
+        FILA, "Analista", "N/A", pdf_hash="0" * 64, fecha_utc=FECHA_UTC
+    )
+
+
+def medir(nombre, funcion, repeticiones):
+    funcion()  # calentamiento
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    print(f"{nombre:<12} media={statistics.mean(tiempos):8.1f} ms  "
+          f"mediana={statistics.median(tiempos):8.1f} ms  min={min(tiempos):8.1f} ms")
+
+
+def rendimiento(nombre, hilos, certificados):
+    """Certificados por segundo con 'hilos' peticiones concurrentes, cada una con HTML distinto."""
+    def uno(i):
+        fila = dict(FILA, **{'ID-partido': f"J01-BENCH-{i:05d}"})
+        return certificado.crear_pdf_con_template_en_memoria(fila, "Analista", "N/A", pdf_hash="0" * 64,
+                                                            fecha_utc=FECHA_UTC)
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(hilos) as ejecutor:
+        list(ejecutor.map(uno, range(certificados)))
+    segundos = time.perf_counter() - inicio
+    print(f"{nombre:<12} {certificados / segundos:8.1f} cert/s  ({certificados} certificados, {hilos} hilos)")
+
+
+if __name__ == "__main__":
+    repeticiones = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    procesos = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count() or 1
+    hilos = int(sys.argv[3]) if len(sys.argv) > 3 else 2 * procesos
+    certificado.obtener_renderizador().cache = None
+    medir("sin cache", render_sin_cache, repeticiones)
+    medir("con cache", render_con_cache, repeticiones)
+
+    rendimiento("en proceso", hilos, repeticiones * 2)
+    pool = PoolRenderizado(procesos).iniciar()
+    pool.esperar_listo()
+    certificado.usar_pool(pool)
+    medir("pool", render_con_cache, repeticiones)
+    rendimiento(f"pool x{procesos}", hilos, repeticiones * 2)
+    pool.parar()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Coste por rerun de seleccionar un partido: escaneo completo del DataFrame
+(unique + máscara booleana) frente al índice de SnapshotEntregas, y el
+buscador paginado (índice de n-gramas + filtros) frente a mandar todas las
+opciones al selectbox.
+
+Uso: python benchmarks/bench_seleccion.py [filas]
+"""
+
+import os
+import sys
+import time
+import json
+import random
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+
+from airtable_datos import SnapshotEntregas
+
+
+def tabla_sintetica(filas):
+    random.seed(0)
+    pilotos = [f"Piloto {i}" for i in range(40)]
+    analistas = [f"Analista {i}" for i in range(25)]
+    return pd.DataFrame({
+        'ID-partido': [f"J{i // 10:04d}-PARTIDO-{i:06d}" for i in range(filas)],
+        'Rec': [f"rec{i:014d}" for i in range(filas)],
+        'Piloto': [random.choice(pilotos) for _ in range(filas)],
+        'Analista': [random.choice(analistas) for _ in range(filas)],
+        'Verificado': [random.choice(['Pendiente', 'Verificado', 'No verificado']) for _ in range(filas)],
+        'Fecha partido': ['2025-08-10'] * filas,
+    })
+
+
+def medir(nombre, funcion, repeticiones=20):
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    print(f"{nombre:<22} mediana={statistics.median(tiempos):9.3f} ms  max={max(tiempos):9.3f} ms")
+
+
+if __name__ == "__main__":
+    filas = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    df = tabla_sintetica(filas)
+    objetivo = df['ID-partido'].iloc[filas // 2]
+
+    def escaneo():
+        partidos = df['ID-partido'].unique().tolist()
+        return partidos, df[df['ID-partido'] == objetivo].iloc[0]
+
+    inicio = time.perf_counter()
+    snapshot = SnapshotEntregas.desde_dataframe(df.copy())
+    print(f"{filas} filas; construcción del índice: {(time.perf_counter() - inicio) * 1000:.1f} ms (una vez por carga)")
+
+    def indice():
+        return snapshot.opciones, snapshot.fila(objetivo)
+
+    medir("escaneo por rerun", escaneo)
+    medir("índice por rerun", indice)
+    print(f"memoria: {df.memory_usage(deep=True).sum() / 1e6:.1f} MB -> "
+          f"{snapshot.df.memory_usage(deep=True).sum() / 1e6:.1f} MB con columnas categóricas")
+
+    inicio = time.perf_counter()
+    snapshot.ngramas
+    print(f"índice de búsqueda: {(time.perf_counter() - inicio) * 1000:.1f} ms (una vez por carga)")
+    medir("búsqueda 'partido-0001'", lambda: snapshot.buscar("partido-0001"))
+    medir("búsqueda 'j00'", lambda: snapshot.buscar("j00"))
+    medir("búsqueda + filtros", lambda: snapshot.buscar("partido", ['Pendiente'], "piloto 1", "2025-01-01", "2025-12-31"))
+    pagina = [snapshot.opciones[i] for i in snapshot.buscar("")[:50]]
+    print(f"opciones enviadas al navegador: {len(json.dumps(snapshot.opciones)) / 1e3:.0f} KB todas -> "
+          f"{len(json.dumps(pagina)) / 1e3:.1f} KB por página")
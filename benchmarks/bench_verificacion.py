@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Auditoría del archivo contra un Drive local falso: certificados por segundo
+descargando uno a uno frente a varias descargas en paralelo, con unos pocos
+ficheros alterados o borrados para comprobar que el informe los detecta.
+
+Uso: python benchmarks/bench_verificacion.py [certificados] [workers] [latencia_ms] [kb_por_pdf]
+"""
+
+import os
+import sys
+import json
+import random
+import hashlib
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+from google.oauth2.credentials import Credentials
+
+from google_servicios import RegistroServicios
+from verificar_certificados import OrigenDrive, registros_auditables, auditar, nombre_fichero, DISTINTO, FALTA
+from servidores_falsos import ServidorGoogleFalso
+
+ALTERADOS = 3
+BORRADOS = 2
+
+
+def archivo_falso(certificados, kb, semilla=0):
+    """(ficheros para el servidor, DataFrame de la tabla, huellas {ID-partido: sha256})."""
+    azar = random.Random(semilla)
+    ficheros, filas, huellas = {}, [], {}
+    for i in range(certificados):
+        partido_id = f"J{i // 10 + 1:02d}-{i:05d}"
+        contenido = b"%PDF-1.7\n" + azar.randbytes(kb * 1024) + b"\n%%EOF\n"
+        ficheros[f"drive{i:08d}"] = {'name': nombre_fichero(partido_id), 'parents': ['carpeta'], 'contenido': contenido}
+        fila = {'ID-partido': partido_id, 'Rec': f"rec{i:014d}", 'Hash_PDF': hashlib.sha256(partido_id.encode()).hexdigest()}
+        if i % 2:
+            # Registros anteriores a 'SHA256_PDF': la referencia sale del manifiesto.
+            huellas[partido_id] = hashlib.sha256(contenido).hexdigest()
+        else:
+            fila.update({'SHA256_PDF': hashlib.sha256(contenido).hexdigest(), 'Drive_ID': f"drive{i:08d}"})
+        filas.append(fila)
+    ids = sorted(ficheros)
+    for file_id in ids[:ALTERADOS]:
+        ficheros[file_id]['contenido'] += b"%"
+    for file_id in ids[ALTERADOS:ALTERADOS + BORRADOS]:
+        del ficheros[file_id]
+    return ficheros, pd.DataFrame(filas), huellas
+
+
+def ejecutar(nombre, servidor, registros, huellas, workers):
+    creds = Credentials(token="token-local")
+    registro = RegistroServicios(endpoints={'drive': servidor.url})
+    origen = OrigenDrive(lambda: registro.servicio('drive', 'v3', creds), "carpeta")
+    servidor.peticiones.clear()
+    with tempfile.TemporaryDirectory() as directorio:
+        recuento, total_bytes, segundos = auditar(registros, origen, huellas, os.path.join(directorio, "informe.jsonl"),
+                                                  workers=workers)
+    assert recuento[DISTINTO] == ALTERADOS and recuento[FALTA] == BORRADOS, recuento
+    print(f"{nombre:<14} {len(registros) / segundos:7.1f} cert/s  {total_bytes / 1e6 / segundos:6.1f} MB/s  "
+          f"peticiones={len(servidor.peticiones)}  {json.dumps(recuento)}")
+
+
+if __name__ == "__main__":
+    certificados = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    latencia = float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.02
+    kb = int(sys.argv[4]) if len(sys.argv) > 4 else 40
+
+    ficheros, df, huellas = archivo_falso(certificados, kb)
+    servidor = ServidorGoogleFalso(latencia=latencia, ficheros=ficheros).arrancar()
+    registros = registros_auditables(df)
+    # Uno a uno solo sobre una muestra: a esta latencia el total tardaría demasiado.
+    muestra = registros[:max(certificados // 10, ALTERADOS + BORRADOS)]
+    ejecutar("1 descarga", servidor, muestra, huellas, 1)
+    ejecutar(f"{workers} descargas", servidor, registros, huellas, workers)
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+Registros sintéticos de Confirmaciones_de_Entrega con la misma forma que
+devuelve Airtable (lookups como listas, 'Rec' con el id del registro).
+Con la misma semilla se generan siempre los mismos registros.
+"""
+
+import random
+import datetime
+import unicodedata
+
+NOMBRES = ['Lucía', 'Hugo', 'Martina', 'Mateo', 'Sofía', 'Leo', 'Julia', 'Pablo', 'Valeria', 'Daniel']
+APELLIDOS = ['García', 'Martínez', 'López', 'Sánchez', 'Pérez', 'Gómez', 'Fernández', 'Ruiz', 'Díaz', 'Moreno']
+EQUIPOS = ['ATM', 'BAR', 'BET', 'CEL', 'GET', 'MAL', 'OSA', 'RMA', 'RSO', 'SEV', 'VAL', 'VIL']
+
+
+def _persona(azar):
+    return f"{azar.choice(NOMBRES)} {azar.choice(APELLIDOS)}"
+
+
+def _mail(nombre):
+    ascii_ = unicodedata.normalize('NFKD', nombre).encode('ascii', 'ignore').decode()
+    return ascii_.lower().replace(' ', '.') + "@club.local"
+
+
+def registros_entregas(n, semilla=0):
+    """n registros con los campos de CAMPOS_FORMULARIO, sin entregar todavía."""
+    azar = random.Random(semilla)
+    analistas = [_persona(azar) for _ in range(max(n // 20, 5))]
+    inicio = datetime.date(2025, 8, 10)
+    registros = []
+    for i in range(n):
+        record_id = f"rec{i:014d}"
+        analista = azar.choice(analistas)
+        local, visitante = azar.sample(EQUIPOS, 2)
+        registros.append({
+            'id': record_id,
+            'createdTime': f"{inicio.isoformat()}T00:00:00.000Z",
+            'fields': {
+                'ID-partido': f"J{i // 10 + 1:02d}-{local}-{visitante}-{i:05d}",
+                'Rec': record_id,
+                'Piloto': _persona(azar),
+                'Fecha partido': (inicio + datetime.timedelta(days=i // 10 * 7)).isoformat(),
+                'Analista': [analista],
+                'Mail': [_mail(analista)],
+            },
+        })
+    return registros
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+"""
+Servidores HTTP locales que imitan lo mínimo de las APIs de Google y de
+Airtable que usa la app, para medir latencias sin salir de la máquina.
+
+Todos admiten una latencia fija por petición y una tasa de errores inyectados
+(con semilla, para que dos ejecuciones fallen en las mismas peticiones).
+"""
+
+import json
+import time
+import uuid
+import random
+import threading
+import urllib.parse
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _ManejadorBase(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _responder(self, estado, cuerpo=None, cabeceras=None):
+        datos = json.dumps(cuerpo or {}).encode()
+        self.send_response(estado)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(datos)))
+        for clave, valor in (cabeceras or {}).items():
+            self.send_header(clave, valor)
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def _leer_cuerpo(self):
+        longitud = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(longitud) if longitud else b""
+
+    def _atender(self):
+        servidor = self.server
+        cuerpo = self._leer_cuerpo()
+        servidor.registrar(self.command, self.path, len(cuerpo))
+        if servidor.latencia:
+            time.sleep(servidor.latencia)
+        if servidor.fallar():
+            return self._responder(servidor.codigo_error, {"error": {"message": "Error inyectado"}},
+                                   {"Retry-After": str(servidor.retry_after)})
+        ruta = urllib.parse.urlparse(self.path)
+        return self.procesar(ruta, urllib.parse.parse_qs(ruta.query), cuerpo)
+
+    do_GET = do_POST = do_PUT = do_PATCH = _atender
+
+
+class _ServidorFalso(ThreadingHTTPServer):
+    """
+    latencia: segundos que tarda cada respuesta.
+    tasa_error: fracción de peticiones que responden codigo_error.
+    retry_after: valor de la cabecera Retry-After en los errores inyectados.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, manejador, latencia=0.0, tasa_error=0.0, codigo_error=503, retry_after=0, semilla=0):
+        super().__init__(("127.0.0.1", 0), manejador)
+        self.latencia = latencia
+        self.tasa_error = tasa_error
+        self.codigo_error = codigo_error
+        self.retry_after = retry_after
+        self.peticiones = []
+        self.errores = 0
+        self._azar = random.Random(semilla)
+        self._lock = threading.Lock()
+
+    def registrar(self, metodo, ruta, tamano):
+        with self._lock:
+            self.peticiones.append((metodo, ruta, tamano))
+
+    def fallar(self):
+        if not self.tasa_error:
+            return False
+        with self._lock:
+            if self._azar.random() < self.tasa_error:
+                self.errores += 1
+                return True
+        return False
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}/"
+
+    def arrancar(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class _ManejadorGoogle(_ManejadorBase):
+
+    def _responder_batch(self, cuerpo):
+        """Responde a un batch multipart/mixed con un 200 por cada parte."""
+        mensaje = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + cuerpo
+        )
+        frontera = "respuesta_batch_" + uuid.uuid4().hex
+        partes = []
+        for parte in mensaje.iter_parts():
+            id_contenido = parte["Content-ID"].replace("<", "<response-", 1)
+            datos = json.dumps({"id": uuid.uuid4().hex})
+            partes.append(
+                f"--{frontera}\r\nContent-Type: application/http\r\nContent-ID: {id_contenido}\r\n\r\n"
+                f"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n{datos}\r\n"
+            )
+        respuesta = ("".join(partes) + f"--{frontera}--\r\n").encode()
+        self.send_response(200)
+        self.send_header("Content-Type", f"multipart/mixed; boundary={frontera}")
+        self.send_header("Content-Length", str(len(respuesta)))
+        self.end_headers()
+        self.wfile.write(respuesta)
+
+    def _descargar(self, file_id):
+        """alt=media; con ficheros cargados en el servidor respeta la cabecera Range."""
+        ficheros = self.server.ficheros
+        if ficheros is None:
+            datos = b"%PDF-1.7\n% " + file_id.encode() + b"\n%%EOF\n"
+        elif file_id in ficheros:
+            datos = ficheros[file_id]['contenido']
+        else:
+            return self._responder(404, {"error": {"message": f"File not found: {file_id}"}})
+        estado, total = 200, len(datos)
+        rango = self.headers.get("Range", "")
+        if rango.startswith("bytes=") and total:
+            inicio, _, fin = rango[len("bytes="):].partition("-")
+            inicio = int(inicio or 0)
+            fin = min(int(fin) if fin else total - 1, total - 1)
+            datos, estado = datos[inicio:fin + 1], 206
+        self.send_response(estado)
+        self.send_header("Content-Type", "application/pdf")
+        self.send_header("Content-Length", str(len(datos)))
+        if estado == 206:
+            self.send_header("Content-Range", f"bytes {inicio}-{fin}/{total}")
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def _listar(self, consulta):
+        """files.list paginado; del filtro q solo se entiende "'<carpeta>' in parents"."""
+        ficheros = self.server.ficheros or {}
+        carpeta = None
+        q = (consulta.get("q") or [""])[0]
+        if " in parents" in q:
+            carpeta = q.split(" in parents")[0].strip().strip("'")
+        listado = [{'id': file_id, 'name': f['name'], 'size': str(len(f['contenido'])), 'createdTime': f.get('creado', '')}
+                   for file_id, f in ficheros.items() if carpeta is None or carpeta in f.get('parents', [])]
+        tamano = int((consulta.get("pageSize") or [100])[0])
+        inicio = int((consulta.get("pageToken") or [0])[0])
+        respuesta = {'files': listado[inicio:inicio + tamano]}
+        if inicio + tamano < len(listado):
+            respuesta['nextPageToken'] = str(inicio + tamano)
+        return self._responder(200, respuesta)
+
+    def procesar(self, ruta, consulta, cuerpo):
+        if ruta.path.startswith("/upload/drive/v3/files"):
+            if consulta.get("uploadType") == ["resumable"] and self.command == "POST":
+                sesion = f"http://{self.headers['Host']}/upload/drive/v3/files?uploadType=resumable&upload_id={uuid.uuid4().hex}"
+                return self._responder(200, cabeceras={"Location": sesion})
+            id_fichero = uuid.uuid4().hex
+            return self._responder(200, {"id": id_fichero, "webContentLink": f"https://drive.local/{id_fichero}"})
+        if ruta.path in ("/batch", "/batch/drive/v3"):
+            return self._responder_batch(cuerpo)
+        if ruta.path.startswith("/drive/v3/files/") and ruta.path.endswith("/permissions"):
+            return self._responder(200, {"id": "anyoneWithLink"})
+        if ruta.path.startswith("/drive/v3/files/") and consulta.get("alt") == ["media"]:
+            return self._descargar(ruta.path.rsplit("/", 1)[-1])
+        if ruta.path == "/drive/v3/files" and self.command == "GET":
+            return self._listar(consulta)
+        if ruta.path.startswith("/gmail/v1/users/") and ruta.path.endswith("/messages/send"):
+            return self._responder(200, {"id": uuid.uuid4().hex})
+        return self._responder(404, {"error": {"message": f"Ruta no simulada: {ruta.path}"}})
+
+
+class ServidorGoogleFalso(_ServidorFalso):
+    """
+    Stub de Drive v3 (subidas simple/resumable, descarga, listado, permisos y
+    batch) y Gmail v1 (send y batch).
+
+    ficheros: {file_id: {'name', 'parents', 'contenido'}} que sirven la
+    descarga y el listado. Sin ficheros, cualquier id descarga un PDF mínimo.
+    """
+
+    def __init__(self, latencia=0.0, ficheros=None, **kwargs):
+        super().__init__(_ManejadorGoogle, latencia, **kwargs)
+        self.ficheros = ficheros
+
+
+class _ManejadorAirtable(_ManejadorBase):
+
+    def procesar(self, ruta, consulta, cuerpo):
+        # /v0/<base>/<tabla>[/<record_id>]
+        partes = [urllib.parse.unquote(p) for p in ruta.path.split("/") if p]
+        if len(partes) < 3 or partes[0] != "v0":
+            return self._responder(404, {"error": "NOT_FOUND"})
+        servidor = self.server
+        tabla = partes[2]
+        record_id = partes[3] if len(partes) > 3 else None
+
+        if self.command == "GET":
+            desconocido = servidor.campo_desconocido(consulta.get("fields") or consulta.get("fields[]") or [])
+            if desconocido:
+                return self._responder_campo_desconocido(desconocido)
+            registros = servidor.listar(tabla)
+            tamano = int((consulta.get("pageSize") or [100])[0])
+            inicio = int((consulta.get("offset") or [0])[0])
+            respuesta = {"records": registros[inicio:inicio + tamano]}
+            if inicio + tamano < len(registros):
+                respuesta["offset"] = str(inicio + tamano)
+            return self._responder(200, respuesta)
+
+        if self.command == "PATCH":
+            datos = json.loads(cuerpo or b"{}")
+            if record_id:
+                cambios = [{"id": record_id, "fields": datos.get("fields", {})}]
+            else:
+                cambios = datos.get("records", [])
+            if len(cambios) > 10:
+                return self._responder(422, {"error": {"type": "INVALID_RECORDS", "message": "Máximo 10 registros"}})
+            desconocido = servidor.campo_desconocido([campo for r in cambios for campo in r.get("fields", {})])
+            if desconocido:
+                return self._responder_campo_desconocido(desconocido)
+            actualizados = [servidor.actualizar(tabla, r["id"], r.get("fields", {})) for r in cambios]
+            if any(r is None for r in actualizados):
+                return self._responder(404, {"error": {"type": "MODEL_ID_NOT_FOUND"}})
+            return self._responder(200, actualizados[0] if record_id else {"records": actualizados})
+
+        return self._responder(405, {"error": "METHOD_NOT_ALLOWED"})
+
+    def _responder_campo_desconocido(self, campo):
+        return self._responder(422, {"error": {"type": "UNKNOWN_FIELD_NAME", "message": f'Unknown field name: "{campo}"'}})
+
+
+class ServidorAirtableFalso(_ServidorFalso):
+    """
+    Stub de la API REST de Airtable: listado paginado (pageSize/offset) y
+    PATCH de un registro o de hasta 10 por petición. filterByFormula se ignora,
+    así que una sincronización incremental trae siempre la tabla entera.
+
+    tablas: {nombre_tabla: [registros con 'id', 'createdTime' y 'fields']}.
+    campos: columnas que tiene la base; si se indican, una proyección o un PATCH
+    que nombre otra responde 422 UNKNOWN_FIELD_NAME, como Airtable.
+    """
+
+    def __init__(self, tablas=None, latencia=0.0, campos=None, **kwargs):
+        super().__init__(_ManejadorAirtable, latencia, **kwargs)
+        self.tablas = {nombre: {r["id"]: r for r in registros} for nombre, registros in (tablas or {}).items()}
+        self.campos = set(campos) if campos is not None else None
+
+    def campo_desconocido(self, nombres):
+        if self.campos is None:
+            return None
+        return next((nombre for nombre in nombres if nombre not in self.campos), None)
+
+    @property
+    def api_url(self):
+        """URL que hay que pasar como api_url a crear_cliente_airtable."""
+        return f"{self.url}v0/"
+
+    def listar(self, tabla):
+        with self._lock:
+            return list(self.tablas.get(tabla, {}).values())
+
+    def actualizar(self, tabla, record_id, fields):
+        with self._lock:
+            registro = self.tablas.get(tabla, {}).get(record_id)
+            if registro is None:
+                return None
+            registro["fields"] = dict(registro["fields"], **fields)
+            return dict(registro)
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Bloqueos con caducidad (leases) por registro.
+
+Un trabajo de entrega toma el bloqueo de su 'Rec' antes de generar el PDF y
+subirlo, y lo renueva en cada etapa; si el proceso muere, el bloqueo caduca
+solo y otro worker puede seguir. Dos implementaciones con la misma interfaz:
+
+- BloqueosMemoria: dentro de un proceso (un único servidor).
+- BloqueosSQLite: en un fichero compartido, para la app y server.py en la
+  misma máquina o con el directorio en un volumen común.
+
+ENTREGAS_BLOQUEOS elige la ruta del fichero, o 'memoria' para la primera.
+"""
+
+import os
+import time
+import sqlite3
+import threading
+import contextlib
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BLOQUEOS_PATH = os.environ.get("ENTREGAS_BLOQUEOS", os.path.join(BASE_DIR, ".cache", "bloqueos.sqlite"))
+# Mayor que la etapa más lenta (subida a Drive con reintentos): se renueva en cada etapa.
+DURACION = 300
+
+
+class BloqueosMemoria:
+
+    def __init__(self):
+        self._bloqueos = {}
+        self._lock = threading.Lock()
+
+    def adquirir(self, clave, titular, duracion=DURACION):
+        """Toma (o renueva, si ya es suyo) el bloqueo de clave. Devuelve si lo tiene."""
+        ahora = time.time()
+        with self._lock:
+            actual = self._bloqueos.get(clave)
+            if actual is not None and actual[0] != titular and actual[1] > ahora:
+                return False
+            self._bloqueos[clave] = (titular, ahora + duracion)
+            return True
+
+    def liberar(self, clave, titular):
+        with self._lock:
+            if self._bloqueos.get(clave, (None,))[0] == titular:
+                del self._bloqueos[clave]
+
+    def titular(self, clave):
+        """Titular vigente del bloqueo, o None."""
+        with self._lock:
+            actual = self._bloqueos.get(clave)
+            return actual[0] if actual is not None and actual[1] > time.time() else None
+
+
+class BloqueosSQLite:
+
+    def __init__(self, ruta=BLOQUEOS_PATH):
+        self.ruta = ruta
+        if os.path.dirname(ruta):
+            os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        with self._conectar() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS bloqueos (clave TEXT PRIMARY KEY, titular TEXT NOT NULL, expira REAL NOT NULL)")
+
+    @contextlib.contextmanager
+    def _conectar(self):
+        conn = sqlite3.connect(self.ruta, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def adquirir(self, clave, titular, duracion=DURACION):
+        """Toma (o renueva, si ya es suyo) el bloqueo de clave. Devuelve si lo tiene."""
+        ahora = time.time()
+        with self._conectar() as conn:
+            # Una sola sentencia: el UPSERT solo pisa la fila si es del mismo titular o ha caducado.
+            cursor = conn.execute(
+                """INSERT INTO bloqueos (clave, titular, expira) VALUES (?, ?, ?)
+                   ON CONFLICT (clave) DO UPDATE SET titular = excluded.titular, expira = excluded.expira
+                   WHERE bloqueos.titular = excluded.titular OR bloqueos.expira <= ?""",
+                (clave, titular, ahora + duracion, ahora)
+            )
+        return cursor.rowcount == 1
+
+    def liberar(self, clave, titular):
+        with self._conectar() as conn:
+            conn.execute("DELETE FROM bloqueos WHERE clave = ? AND titular = ?", (clave, titular))
+
+    def titular(self, clave):
+        """Titular vigente del bloqueo, o None."""
+        with self._conectar() as conn:
+            fila = conn.execute("SELECT titular FROM bloqueos WHERE clave = ? AND expira > ?",
+                                (clave, time.time())).fetchone()
+        return fila[0] if fila else None
+
+
+def crear_bloqueos(ruta=BLOQUEOS_PATH):
+    """BloqueosSQLite en ruta; con ENTREGAS_BLOQUEOS=memoria, solo dentro de este proceso."""
+    return BloqueosMemoria() if ruta == "memoria" else BloqueosSQLite(ruta)
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Caché de certificados PDF direccionada por contenido.
+
+La clave es un SHA-256 de lo que determina el PDF: el HTML final del
+certificado (que ya contiene los campos de la fila, el analista, el código, la
+fecha UTC, el hash estampado y el logo) y la versión de la hoja de estilos.
+Dos peticiones con la misma clave producirían los mismos bytes, así que un
+reintento, un envío duplicado o el reenvío de un registro sin cambios (que
+conserva su fecha, ver cola_entregas.fecha_certificado) se sirve sin pasar
+por WeasyPrint.
+
+Dos niveles: un LRU en memoria limitado en bytes y un directorio en disco
+limitado en tamaño, del que se expulsan primero los ficheros usados hace más
+tiempo (por mtime, que se actualiza en cada acierto).
+"""
+
+import os
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_PDF_PATH = os.environ.get("ENTREGAS_CACHE_PDF", os.path.join(BASE_DIR, ".cache", "pdf"))
+MAX_MEMORIA = 64 * 1024 * 1024
+MAX_DISCO = 512 * 1024 * 1024
+# Cambiarla invalida todas las entradas (p. ej. si cambia cómo se llama a WeasyPrint).
+VERSION = "1"
+
+
+def clave_pdf(html_out, version_estilos=""):
+    """Clave de caché de un render: SHA-256 del HTML final y de la versión de los estilos."""
+    resumen = hashlib.sha256(f"{VERSION}\0{version_estilos}\0".encode())
+    resumen.update(html_out.encode('utf-8'))
+    return resumen.hexdigest()
+
+
+class CachePDF:
+    """
+    LRU en memoria + nivel en disco, compartida por todos los hilos del proceso
+    (y el disco, por todos los procesos de la máquina).
+
+    directorio=None deja solo el nivel de memoria.
+    """
+
+    def __init__(self, directorio=CACHE_PDF_PATH, max_memoria=MAX_MEMORIA, max_disco=MAX_DISCO):
+        self.directorio = directorio
+        self.max_memoria = max_memoria
+        self.max_disco = max_disco
+        self._memoria = OrderedDict()
+        self._bytes_memoria = 0
+        self._bytes_disco = 0
+        self._lock = threading.Lock()
+        self.metricas = {'aciertos_memoria': 0, 'aciertos_disco': 0, 'fallos': 0, 'bytes_ahorrados': 0,
+                         'expulsados_memoria': 0, 'expulsados_disco': 0}
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+            self._bytes_disco = sum(tamano for _, tamano, _ in self._ficheros_disco())
+
+    def _ruta(self, clave):
+        return os.path.join(self.directorio, clave[:2], f"{clave}.pdf")
+
+    def _ficheros_disco(self):
+        for raiz, _, nombres in os.walk(self.directorio):
+            for nombre in nombres:
+                if nombre.endswith(".pdf"):
+                    ruta = os.path.join(raiz, nombre)
+                    try:
+                        stat = os.stat(ruta)
+                    except FileNotFoundError:
+                        continue
+                    yield ruta, stat.st_size, stat.st_mtime
+
+    def _guardar_memoria(self, clave, datos):
+        if len(datos) > self.max_memoria:
+            return
+        with self._lock:
+            if clave in self._memoria:
+                self._memoria.move_to_end(clave)
+                return
+            self._memoria[clave] = datos
+            self._bytes_memoria += len(datos)
+            while self._bytes_memoria > self.max_memoria:
+                _, expulsado = self._memoria.popitem(last=False)
+                self._bytes_memoria -= len(expulsado)
+                self.metricas['expulsados_memoria'] += 1
+
+    def obtener(self, clave):
+        """Bytes del PDF o None. Un acierto en disco sube la entrada a memoria."""
+        with self._lock:
+            datos = self._memoria.get(clave)
+            if datos is not None:
+                self._memoria.move_to_end(clave)
+                self.metricas['aciertos_memoria'] += 1
+                self.metricas['bytes_ahorrados'] += len(datos)
+                return datos
+        if self.directorio:
+            ruta = self._ruta(clave)
+            try:
+                with open(ruta, "rb") as f:
+                    datos = f.read()
+                os.utime(ruta)
+            except FileNotFoundError:
+                datos = None
+            if datos is not None:
+                self._guardar_memoria(clave, datos)
+                with self._lock:
+                    self.metricas['aciertos_disco'] += 1
+                    self.metricas['bytes_ahorrados'] += len(datos)
+                return datos
+        with self._lock:
+            self.metricas['fallos'] += 1
+        return None
+
+    def guardar(self, clave, datos):
+        self._guardar_memoria(clave, datos)
+        if not self.directorio or len(datos) > self.max_disco:
+            return
+        ruta = self._ruta(clave)
+        if os.path.exists(ruta):
+            return
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        # Escritura atómica: otro proceso puede estar leyendo la misma clave.
+        descriptor, temporal = tempfile.mkstemp(dir=os.path.dirname(ruta), suffix=".tmp")
+        with os.fdopen(descriptor, "wb") as f:
+            f.write(datos)
+        os.replace(temporal, ruta)
+        with self._lock:
+            self._bytes_disco += len(datos)
+            excedido = self._bytes_disco > self.max_disco
+        if excedido:
+            self._recortar_disco()
+
+    def _recortar_disco(self):
+        """Borra los ficheros usados hace más tiempo hasta quedar en el 90 % del límite."""
+        ficheros = sorted(self._ficheros_disco(), key=lambda f: f[2])
+        total = sum(tamano for _, tamano, _ in ficheros)
+        objetivo = self.max_disco * 0.9
+        borrados = 0
+        for ruta, tamano, _ in ficheros:
+            if total <= objetivo:
+                break
+            try:
+                os.remove(ruta)
+            except FileNotFoundError:
+                pass
+            total -= tamano
+            borrados += 1
+        with self._lock:
+            self._bytes_disco = total
+            self.metricas['expulsados_disco'] += borrados
+
+    def estadisticas(self):
+        with self._lock:
+            consultas = self.metricas['aciertos_memoria'] + self.metricas['aciertos_disco'] + self.metricas['fallos']
+            aciertos = self.metricas['aciertos_memoria'] + self.metricas['aciertos_disco']
+            return dict(self.metricas, tasa_aciertos=aciertos / consultas if consultas else 0.0,
+                        bytes_memoria=self._bytes_memoria, entradas_memoria=len(self._memoria),
+                        bytes_disco=self._bytes_disco)
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+Generación del certificado PDF de confirmación de entrega.
+
+El renderizador vive durante todo el proceso: mantiene la plantilla Jinja2
+compilada, el logo ya codificado en Base64, la hoja de estilos parseada y la
+configuración de fuentes de WeasyPrint. Si la plantilla, el CSS o el logo
+cambian en disco, se recargan en la siguiente llamada. Los PDF ya generados se
+guardan en una CachePDF, así que repetir un render idéntico no pasa por WeasyPrint.
+
+WeasyPrint (con Pango y fontconfig) es la importación más lenta de la app, así
+que solo se carga en el primer render o en precalentar().
+"""
+
+import os
+import json
+import base64
+import hashlib
+import tempfile
+import threading
+from io import BytesIO
+
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
+
+from cache_pdf import CachePDF, clave_pdf
+from metricas import metricas
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
+PLANTILLA_CERTIFICADO = "certificado.html"
+CSS_CERTIFICADO = os.path.join(TEMPLATES_DIR, "certificado.css")
+LOGO_PATH = os.path.join(BASE_DIR, "img", "LogoFLY-FUT.png")
+
+# Campos de la fila que identifican un certificado, por versión del formato.
+# Cambiar la plantilla o el logo no cambia el hash; añadir o quitar un campo
+# es una versión nueva, y las anteriores se siguen pudiendo verificar.
+CAMPOS_CERTIFICADO = {
+    1: ('ID-partido', 'Piloto', 'Fecha partido'),
+}
+VERSION_CERTIFICADO = max(CAMPOS_CERTIFICADO)
+
+
+def image_to_base64(image_path):
+    """Convierte una imagen local en una cadena Base64."""
+    try:
+        with open(image_path, "rb") as image_file:
+            return base64.b64encode(image_file.read()).decode('utf-8')
+    except FileNotFoundError:
+        return None
+
+
+def calcular_hash_bytes(data):
+    """Calcula el hash SHA256 de un objeto en bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def _weasyprint():
+    import weasyprint
+    from weasyprint.text.fonts import FontConfiguration
+    return weasyprint, FontConfiguration
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+class RenderizadorCertificado:
+    """
+    Renderizador de certificados reutilizable durante toda la vida del proceso.
+
+    cache: CachePDF opcional consultada antes de cada render con WeasyPrint.
+    pool: PoolRenderizado opcional; si está, WeasyPrint corre en sus procesos
+        y este proceso solo genera el HTML.
+    """
+
+    def __init__(self, templates_dir=TEMPLATES_DIR, css_path=CSS_CERTIFICADO, logo_path=LOGO_PATH, bytecode_dir=None,
+                 cache=None):
+        if bytecode_dir is None:
+            bytecode_dir = os.path.join(tempfile.gettempdir(), "entrega_imagenes_jinja")
+        os.makedirs(bytecode_dir, exist_ok=True)
+
+        # auto_reload compara el mtime de la plantilla en cada get_template.
+        self.env = Environment(
+            loader=FileSystemLoader(templates_dir),
+            auto_reload=True,
+            bytecode_cache=FileSystemBytecodeCache(bytecode_dir),
+        )
+        self.css_path = css_path
+        self.logo_path = logo_path
+        self.font_config = None
+        self.cache = cache
+        self.pool = None
+
+        self._lock = threading.Lock()
+        self._logo = (None, None)
+        self._css = (None, None)
+        self._version_css = (None, None)
+
+    def _logo_base64(self):
+        mtime = _mtime(self.logo_path)
+        cache_mtime, cache_logo = self._logo
+        if cache_logo is None or cache_mtime != mtime:
+            cache_logo = image_to_base64(self.logo_path)
+            self._logo = (mtime, cache_logo)
+        return cache_logo
+
+    def _hoja_estilos(self):
+        mtime = _mtime(self.css_path)
+        cache_mtime, cache_css = self._css
+        if cache_css is None or cache_mtime != mtime:
+            cache_css = _weasyprint()[0].CSS(filename=self.css_path, font_config=self._fuentes())
+            self._css = (mtime, cache_css)
+        return cache_css
+
+    def _version_estilos(self):
+        """SHA-256 del CSS, para que un cambio de estilos no sirva PDF antiguos de la caché."""
+        mtime = _mtime(self.css_path)
+        cache_mtime, version = self._version_css
+        if version is None or cache_mtime != mtime:
+            with open(self.css_path, "rb") as f:
+                version = hashlib.sha256(f.read()).hexdigest()
+            self._version_css = (mtime, version)
+        return version
+
+    def _fuentes(self):
+        if self.font_config is None:
+            self.font_config = _weasyprint()[1]()
+        return self.font_config
+
+    def renderizar_html(self, selected_row, analista_value, codigo_unico, pdf_hash="", fecha_utc="", incluir_hash=True):
+        """Renderiza el HTML del certificado con la plantilla compilada."""
+        template = self.env.get_template(PLANTILLA_CERTIFICADO)
+        return template.render(
+            row=selected_row,
+            analista=analista_value,
+            codigo=codigo_unico,
+            pdf_hash=pdf_hash,
+            base64_logo=self._logo_base64(),
+            fecha_utc=fecha_utc,
+            incluir_hash=incluir_hash
+        )
+
+    def html_a_pdf(self, html_out, usar_cache=True):
+        """Convierte el HTML en PDF reutilizando la hoja de estilos y las fuentes."""
+        clave = None
+        if usar_cache and self.cache is not None:
+            clave = clave_pdf(html_out, self._version_estilos())
+            pdf = self.cache.obtener(clave)
+            if pdf is not None:
+                return pdf
+        if self.pool is not None:
+            pdf = self.pool.html_a_pdf(html_out)
+        else:
+            pdf_buffer = BytesIO()
+            # FontConfiguration no es segura entre hilos y cada sesión de Streamlit corre en uno propio.
+            with self._lock:
+                _weasyprint()[0].HTML(string=html_out, base_url=BASE_DIR).write_pdf(
+                    target=pdf_buffer,
+                    stylesheets=[self._hoja_estilos()],
+                    font_config=self._fuentes()
+                )
+            pdf = pdf_buffer.getvalue()
+        if clave is not None:
+            self.cache.guardar(clave, pdf)
+        return pdf
+
+    def precalentar(self):
+        """
+        Importa WeasyPrint y hace un render de prueba para cargar fuentes, CSS,
+        logo y plantilla antes de la primera entrega real. Con pool, espera a
+        que sus workers lo hayan hecho y este proceso no carga WeasyPrint.
+        """
+        if self.pool is not None:
+            if not self.pool.esperar_listo():
+                raise TimeoutError("Los renderizadores no han arrancado a tiempo.")
+            if self.pool.error_arranque:
+                raise RuntimeError(self.pool.error_arranque)
+            self.renderizar_html({'ID-partido': '-'}, '-', '-')
+            return 0
+        fila = {'ID-partido': '-', 'Piloto': '-', 'Fecha partido': '-'}
+        # Sin caché: el objetivo es que WeasyPrint cargue fuentes y estilos.
+        return len(self.html_a_pdf(self.renderizar_html(fila, '-', '-', pdf_hash='0' * 64), usar_cache=False))
+
+
+_renderizador = None
+_renderizador_lock = threading.Lock()
+
+
+def obtener_renderizador():
+    """Devuelve el renderizador compartido por todo el proceso."""
+    global _renderizador
+    if _renderizador is None:
+        with _renderizador_lock:
+            if _renderizador is None:
+                cache = CachePDF()
+                metricas.registrar_fuente('cache_pdf', cache.estadisticas)
+                _renderizador = RenderizadorCertificado(cache=cache)
+    return _renderizador
+
+
+def usar_pool(pool):
+    """Manda los renders del renderizador compartido a un PoolRenderizado (None: en el propio proceso)."""
+    renderizador = obtener_renderizador()
+    renderizador.pool = pool
+    if pool is not None:
+        metricas.registrar_fuente('pool_render', pool.estadisticas)
+    return renderizador
+
+
+def renderizar_html_certificado(selected_row, analista_value, codigo_unico, pdf_hash="", fecha_utc="", incluir_hash=True):
+    """
+    Renders the certificate HTML with Jinja2. With an empty pdf_hash the hash
+    slot is left blank.
+    """
+    return obtener_renderizador().renderizar_html(
+        selected_row, analista_value, codigo_unico,
+        pdf_hash=pdf_hash, fecha_utc=fecha_utc, incluir_hash=incluir_hash
+    )
+
+
+def crear_pdf_con_template_en_memoria(selected_row, analista_value, codigo_unico, pdf_hash="", fecha_utc="", incluir_hash=True):
+    """
+    Generates a report PDF in memory (BytesIO) using an HTML template and Jinja2.
+    """
+    renderizador = obtener_renderizador()
+    html_out = renderizador.renderizar_html(
+        selected_row, analista_value, codigo_unico,
+        pdf_hash=pdf_hash, fecha_utc=fecha_utc, incluir_hash=incluir_hash
+    )
+    return renderizador.html_a_pdf(html_out)
+
+
+def _texto_canonico(valor):
+    # NaN (valor != valor) es lo que deja pandas en una celda vacía.
+    return "" if valor is None or valor != valor else str(valor)
+
+
+def documento_canonico(selected_row, analista_value, codigo_unico, fecha_utc="", version=VERSION_CERTIFICADO):
+    """
+    Serialización canónica (JSON con claves ordenadas) de los datos del
+    certificado: los campos de la fila de esa versión, analista, código y
+    fecha de generación.
+    """
+    return json.dumps({
+        'version': version,
+        'fila': {campo: _texto_canonico(selected_row.get(campo)) for campo in CAMPOS_CERTIFICADO[version]},
+        'analista': _texto_canonico(analista_value),
+        'codigo': _texto_canonico(codigo_unico),
+        'fecha_utc': _texto_canonico(fecha_utc),
+    }, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+
+
+def calcular_hash_certificado(selected_row, analista_value, codigo_unico, fecha_utc="", version=VERSION_CERTIFICADO):
+    """
+    Calcula el SHA256 del documento canónico. No depende del HTML, el CSS ni
+    el logo, así que sobrevive a los cambios de plantilla.
+    """
+    documento = documento_canonico(selected_row, analista_value, codigo_unico, fecha_utc, version)
+    return calcular_hash_bytes(documento.encode('utf-8'))
+
+
+def crear_pdf_certificado(selected_row, analista_value, codigo_unico, fecha_utc=""):
+    """
+    Genera el certificado final con una sola pasada de WeasyPrint.
+    Devuelve (pdf_bytes, pdf_hash); el hash queda estampado en el PDF.
+    """
+    pdf_hash = calcular_hash_certificado(selected_row, analista_value, codigo_unico, fecha_utc)
+    pdf_bytes = crear_pdf_con_template_en_memoria(
+        selected_row,
+        analista_value,
+        codigo_unico,
+        pdf_hash=pdf_hash,
+        fecha_utc=fecha_utc,
+        incluir_hash=True
+    )
+    return pdf_bytes, pdf_hash
+
+
+def verificar_hash_certificado(selected_row, analista_value, codigo_unico, fecha_utc, pdf_hash):
+    """Comprueba que un hash estampado corresponde a los datos del certificado, con cualquier versión conocida."""
+    return any(calcular_hash_certificado(selected_row, analista_value, codigo_unico, fecha_utc, version) == pdf_hash
+               for version in CAMPOS_CERTIFICADO)
@@ -0,0 +1,454 @@
+# -*- coding: utf-8 -*-
+"""
+Cola persistente (SQLite) para el proceso de entrega.
+
+El formulario solo encola el trabajo y vuelve; un pool de hilos lo procesa
+etapa a etapa (Airtable 'Pendiente', PDF, Drive, Airtable final) y deja el
+estado y la etapa actual en la base de datos para que la interfaz lo consulte.
+Si el proceso se cae con trabajos a medias, al arrancar se vuelven a poner en
+cola, así que un refresco del navegador o un reinicio ya no dejan registros
+a medio actualizar.
+"""
+
+import os
+import json
+import uuid
+import time
+import socket
+import hashlib
+import sqlite3
+import datetime
+import threading
+import contextlib
+import traceback
+
+from certificado import crear_pdf_certificado, calcular_hash_bytes, calcular_hash_certificado
+from google_servicios import subir_pdf_a_drive
+from metricas import medir
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+COLA_PATH = os.environ.get("ENTREGAS_COLA", os.path.join(BASE_DIR, ".cache", "cola_entregas.sqlite"))
+
+EN_COLA = 'en_cola'
+EN_PROCESO = 'en_proceso'
+COMPLETADO = 'completado'
+ERROR = 'error'
+
+ETAPAS = ['airtable_pendiente', 'pdf', 'drive', 'airtable_final', 'correo']
+# Código estampado en el certificado; el token de confirmación solo viaja en el correo.
+CODIGO_CERTIFICADO = "N/A"
+# Un envío idéntico a un trabajo completado hace menos de esto devuelve ese trabajo.
+VENTANA_IDEMPOTENCIA = datetime.timedelta(minutes=10)
+# Colas creadas en este proceso: un bloqueo con este host y pid pero de otra
+# cola es de un proceso anterior que tuvo el mismo pid (p. ej. tras reiniciar el contenedor).
+_COLAS_VIVAS = set()
+
+
+def _ahora():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+def clave_idempotencia(rec, analista, mail):
+    """
+    Clave de un envío: el registro y lo que el operador ha escrito en el
+    formulario. Dos envíos con la misma clave son el mismo envío (doble clic,
+    dos operadores a la vez), aunque lleven tokens distintos.
+    """
+    partes = [str(rec or ''), ' '.join(str(analista or '').split()).casefold(), str(mail or '').strip().lower()]
+    return hashlib.sha256('\0'.join(partes).encode('utf-8')).hexdigest()
+
+
+def fecha_certificado(fila, analista):
+    """
+    Fecha de generación del certificado. En un reenvío cuyo 'Hash_PDF' sale de
+    estos mismos datos, analista y 'Fecha_UTC', se mantiene esa fecha: el PDF
+    es idéntico y se sirve de la caché. Si algo ha cambiado, la de ahora.
+    """
+    fecha = fila.get('Fecha_UTC')
+    if isinstance(fecha, str) and fecha and \
+            fila.get('Hash_PDF') == calcular_hash_certificado(fila, analista, CODIGO_CERTIFICADO, fecha):
+        return fecha
+    return datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
+
+
+def datos_entrega(fila, analista, mail):
+    """Datos del trabajo de una entrega a partir de la fila de la tabla (una Series)."""
+    return {
+        'rec': fila.get('Rec'),
+        'fila': fila.dropna().to_dict(),
+        'analista': analista,
+        'mail': mail,
+        'token': str(uuid.uuid4()),
+        'fecha_utc': fecha_certificado(fila, analista),
+    }
+
+
+class ColaTrabajos:
+    """
+    Cola de trabajos duradera con un pool de hilos.
+
+    procesador(datos, marcar_etapa) hace el trabajo y devuelve un resultado
+    serializable en JSON; si lanza una excepción, el trabajo queda en ERROR.
+
+    Los trabajos con la misma 'clave' (el Rec) no se procesan a la vez: un
+    worker no reclama un trabajo si otro de su clave está en proceso en esta
+    cola, y con 'bloqueos' (BloqueosMemoria o BloqueosSQLite) además toma el
+    bloqueo de la clave, que vale entre procesos con colas distintas.
+
+    El bloqueo se toma dentro de la misma transacción que pasa el trabajo a
+    'en_proceso', así que todo trabajo en proceso tiene un bloqueo vigente
+    mientras su proceso vive. Por eso, cuando la app y server.py comparten el
+    fichero de la cola, iniciar() solo recupera los trabajos cuyo bloqueo ha
+    caducado (o era de este mismo host y pid, de antes de un reinicio), y los
+    workers repiten la revisión cada INTERVALO_RECUPERACION para recoger los de
+    un proceso caído en cuanto caduque su bloqueo; sin 'bloqueos' no hay forma
+    de saberlo y solo iniciar() recupera todos los que estén en proceso.
+    """
+
+    INTERVALO_RECUPERACION = 60
+
+    def __init__(self, procesador, ruta=COLA_PATH, workers=4, espera=1.0, bloqueos=None):
+        self.procesador = procesador
+        self.ruta = ruta
+        self.workers = workers
+        self.espera = espera
+        self.bloqueos = bloqueos
+        # Trabajos cuyo bloqueo tiene otro proceso: no se reclaman hasta el instante indicado.
+        self._aplazados = {}
+        self._proxima_recuperacion = 0.0
+        self._instancia = uuid.uuid4().hex
+        _COLAS_VIVAS.add(self._instancia)
+        self._lock = threading.Lock()
+        self._hay_trabajo = threading.Event()
+        self._parar = threading.Event()
+        self._hilos = []
+        if os.path.dirname(ruta):
+            os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        with self._conectar() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS trabajos (
+                id TEXT PRIMARY KEY, clave TEXT, estado TEXT NOT NULL, etapa TEXT,
+                datos TEXT NOT NULL, resultado TEXT, error TEXT, intentos INTEGER DEFAULT 0,
+                creado TEXT, actualizado TEXT)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS trabajos_estado ON trabajos (estado, creado)")
+            # Colas creadas antes de la idempotencia.
+            columnas = {fila['name'] for fila in conn.execute("PRAGMA table_info(trabajos)")}
+            if 'idempotencia' not in columnas:
+                conn.execute("ALTER TABLE trabajos ADD COLUMN idempotencia TEXT")
+            if 'duplicados' not in columnas:
+                conn.execute("ALTER TABLE trabajos ADD COLUMN duplicados INTEGER DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS trabajos_idempotencia ON trabajos (idempotencia, creado)")
+
+    @contextlib.contextmanager
+    def _conectar(self):
+        conn = sqlite3.connect(self.ruta, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _titular(self, trabajo_id):
+        return f"{socket.gethostname()}:{os.getpid()}:{self._instancia}:{trabajo_id}"
+
+    @staticmethod
+    def _titular_vivo(titular):
+        """Si el titular de un bloqueo vigente puede seguir trabajando (no es de un pid reutilizado)."""
+        proceso, instancia, _ = titular.rsplit(":", 2)
+        return proceso != f"{socket.gethostname()}:{os.getpid()}" or instancia in _COLAS_VIVAS
+
+    @staticmethod
+    def _clave_bloqueo(trabajo_id, clave):
+        return clave or f"trabajo:{trabajo_id}"
+
+    def _recuperar(self):
+        """Vuelve a poner en cola los trabajos en proceso cuyo proceso ya no existe. Devuelve cuántos."""
+        recuperados = 0
+        with self._conectar() as conn:
+            # BEGIN IMMEDIATE: ningún worker puede reclamar (y tomar su bloqueo) mientras se revisan.
+            conn.execute("BEGIN IMMEDIATE")
+            for fila in conn.execute("SELECT id, clave FROM trabajos WHERE estado = ?", (EN_PROCESO,)).fetchall():
+                if self.bloqueos is not None:
+                    titular = self.bloqueos.titular(self._clave_bloqueo(fila['id'], fila['clave']))
+                    if titular is not None and titular.endswith(f":{fila['id']}") and self._titular_vivo(titular):
+                        # Otro proceso vivo lo está procesando.
+                        continue
+                recuperados += conn.execute(
+                    "UPDATE trabajos SET estado = ?, actualizado = ? WHERE id = ? AND estado = ?",
+                    (EN_COLA, _ahora(), fila['id'], EN_PROCESO)
+                ).rowcount
+            conn.execute("COMMIT")
+        return recuperados
+
+    def _recuperar_si_toca(self):
+        """Repite _recuperar cada INTERVALO_RECUPERACION (solo con bloqueos: sin ellos no distingue los trabajos propios)."""
+        if self.bloqueos is None:
+            return
+        with self._lock:
+            if time.monotonic() < self._proxima_recuperacion:
+                return
+            self._proxima_recuperacion = time.monotonic() + self.INTERVALO_RECUPERACION
+        if self._recuperar():
+            self._hay_trabajo.set()
+
+    def iniciar(self):
+        """Recupera los trabajos interrumpidos y arranca los workers."""
+        self._recuperar()
+        self._proxima_recuperacion = time.monotonic() + self.INTERVALO_RECUPERACION
+        for i in range(self.workers):
+            hilo = threading.Thread(target=self._bucle, name=f"cola-entregas-{i}", daemon=True)
+            hilo.start()
+            self._hilos.append(hilo)
+        self._hay_trabajo.set()
+        return self
+
+    def parar(self):
+        self._parar.set()
+        self._hay_trabajo.set()
+
+    def encolar(self, datos, clave=None, idempotencia=None):
+        """Guarda un trabajo nuevo (o se une al existente, ver encolar_o_unir) y devuelve su id."""
+        return self.encolar_o_unir(datos, clave, idempotencia)[0]
+
+    def encolar_o_unir(self, datos, clave=None, idempotencia=None):
+        """
+        Como encolar, pero si ya hay un trabajo con la misma clave de
+        idempotencia devuelve ese en lugar de crear otro: en cola o en proceso,
+        se une a él; completado hace menos de VENTANA_IDEMPOTENCIA, lo devuelve
+        tal cual; en ERROR, lo vuelve a poner en cola. Devuelve (id, nuevo).
+        """
+        ahora = _ahora()
+        with self._conectar() as conn:
+            # BEGIN IMMEDIATE: dos envíos simultáneos no pueden crear dos trabajos.
+            conn.execute("BEGIN IMMEDIATE")
+            existente = None
+            if idempotencia is not None:
+                limite = (datetime.datetime.now(datetime.timezone.utc) - VENTANA_IDEMPOTENCIA).isoformat()
+                existente = conn.execute(
+                    """SELECT id, estado FROM trabajos WHERE idempotencia = ?
+                       AND (estado IN (?, ?, ?) OR actualizado >= ?) ORDER BY creado DESC LIMIT 1""",
+                    (idempotencia, EN_COLA, EN_PROCESO, ERROR, limite)
+                ).fetchone()
+            if existente is not None:
+                if existente['estado'] == ERROR:
+                    conn.execute("UPDATE trabajos SET estado = ?, etapa = NULL, error = NULL WHERE id = ?",
+                                 (EN_COLA, existente['id']))
+                conn.execute("UPDATE trabajos SET duplicados = duplicados + 1, actualizado = ? WHERE id = ?",
+                             (ahora, existente['id']))
+                conn.execute("COMMIT")
+                self._hay_trabajo.set()
+                return existente['id'], False
+            trabajo_id = uuid.uuid4().hex
+            conn.execute(
+                "INSERT INTO trabajos (id, clave, idempotencia, estado, datos, creado, actualizado) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (trabajo_id, clave, idempotencia, EN_COLA, json.dumps(datos, default=str), ahora, ahora)
+            )
+            conn.execute("COMMIT")
+        self._hay_trabajo.set()
+        return trabajo_id, True
+
+    def estado(self, trabajo_id):
+        """Estado del trabajo como diccionario, o None si no existe."""
+        with self._conectar() as conn:
+            fila = conn.execute(
+                "SELECT id, clave, estado, etapa, resultado, error, intentos, duplicados, creado, actualizado "
+                "FROM trabajos WHERE id = ?",
+                (trabajo_id,)
+            ).fetchone()
+        if fila is None:
+            return None
+        trabajo = dict(fila)
+        trabajo['resultado'] = json.loads(trabajo['resultado']) if trabajo['resultado'] else None
+        return trabajo
+
+    def reintentar(self, trabajo_id):
+        """
+        Vuelve a poner en cola un trabajo en ERROR con los mismos datos (mismo
+        token y fecha), así que el PDF sale de la caché. Devuelve si se ha encolado.
+        """
+        with self._conectar() as conn:
+            cursor = conn.execute(
+                "UPDATE trabajos SET estado = ?, etapa = NULL, error = NULL, actualizado = ? WHERE id = ? AND estado = ?",
+                (EN_COLA, _ahora(), trabajo_id, ERROR)
+            )
+        self._hay_trabajo.set()
+        return cursor.rowcount == 1
+
+    def pendientes(self):
+        with self._conectar() as conn:
+            return conn.execute("SELECT COUNT(*) FROM trabajos WHERE estado IN (?, ?)", (EN_COLA, EN_PROCESO)).fetchone()[0]
+
+    def _reclamar(self):
+        ahora = time.monotonic()
+        with self._lock:
+            for trabajo_id in [t for t, hasta in self._aplazados.items() if hasta <= ahora]:
+                del self._aplazados[trabajo_id]
+            aplazados = list(self._aplazados)
+        with self._conectar() as conn:
+            # BEGIN IMMEDIATE: dos workers no pueden reclamar el mismo trabajo.
+            conn.execute("BEGIN IMMEDIATE")
+            # Se salta los trabajos de un Rec que ya tiene otro en proceso.
+            candidatos = conn.execute(
+                f"""SELECT id, clave, datos FROM trabajos WHERE estado = ? AND (clave IS NULL OR clave NOT IN
+                    (SELECT clave FROM trabajos WHERE estado = ? AND clave IS NOT NULL))
+                    AND id NOT IN ({', '.join('?' * len(aplazados))})
+                    ORDER BY creado LIMIT ?""", (EN_COLA, EN_PROCESO, *aplazados, self.workers + 1)
+            ).fetchall()
+            for fila in candidatos:
+                bloqueo = None
+                if self.bloqueos is not None:
+                    bloqueo = self._titular(fila['id'])
+                    if not self.bloqueos.adquirir(self._clave_bloqueo(fila['id'], fila['clave']), bloqueo):
+                        # Otro proceso trabaja en este Rec: se deja en cola y, mientras, se atienden otros.
+                        with self._lock:
+                            self._aplazados[fila['id']] = time.monotonic() + self.espera
+                        continue
+                conn.execute(
+                    "UPDATE trabajos SET estado = ?, intentos = intentos + 1, actualizado = ? WHERE id = ?",
+                    (EN_PROCESO, _ahora(), fila['id'])
+                )
+                conn.execute("COMMIT")
+                return fila['id'], fila['clave'], json.loads(fila['datos']), bloqueo
+            conn.execute("COMMIT")
+        return None
+
+    def _actualizar(self, trabajo_id, **campos):
+        """Actualiza un trabajo que esta cola tiene en proceso; si ya no lo está, no toca nada."""
+        campos['actualizado'] = _ahora()
+        asignaciones = ", ".join(f"{campo} = ?" for campo in campos)
+        with self._conectar() as conn:
+            conn.execute(f"UPDATE trabajos SET {asignaciones} WHERE id = ? AND estado = ?",
+                         (*campos.values(), trabajo_id, EN_PROCESO))
+
+    def _bucle(self):
+        while not self._parar.is_set():
+            # Un proceso que murió con trabajos en proceso no vuelve a arrancar para recuperarlos.
+            self._recuperar_si_toca()
+            reclamado = self._reclamar()
+            if reclamado is None:
+                self._hay_trabajo.wait(self.espera)
+                self._hay_trabajo.clear()
+                continue
+            trabajo_id, clave, datos, bloqueo = reclamado
+            clave_bloqueo = self._clave_bloqueo(trabajo_id, clave)
+
+            def marcar_etapa(etapa, trabajo_id=trabajo_id, clave_bloqueo=clave_bloqueo, bloqueo=bloqueo):
+                if bloqueo is not None and not self.bloqueos.adquirir(clave_bloqueo, bloqueo):
+                    raise RuntimeError(f"Se ha perdido el bloqueo de {clave_bloqueo}; otro proceso trabaja en el registro.")
+                self._actualizar(trabajo_id, etapa=etapa)
+
+            try:
+                resultado = self.procesador(datos, marcar_etapa)
+            except Exception as e:
+                traceback.print_exc()
+                self._actualizar(trabajo_id, estado=ERROR, error=str(e))
+            else:
+                self._actualizar(trabajo_id, estado=COMPLETADO, resultado=json.dumps(resultado, default=str))
+            finally:
+                if bloqueo is not None:
+                    self.bloqueos.liberar(clave_bloqueo, bloqueo)
+
+
+class PipelineEntrega:
+    """
+    Etapas de una entrega, sin llamadas a la interfaz.
+
+    escritor: EscritorAirtable por el que pasan las escrituras en TABLA_ENTREGAS.
+    obtener_drive: función que devuelve el servicio de Drive del hilo actual.
+    al_actualizar: función (record_id, fields) llamada cuando Airtable confirma
+        cada escritura, p. ej. para parchear la caché de la tabla.
+    permisos: AgrupadorPermisos opcional para agrupar las concesiones públicas.
+    generar_pdf: función (fila, analista, codigo, fecha_utc=...) -> (pdf_bytes, hash);
+        por defecto crear_pdf_certificado. Los benchmarks la sustituyen para
+        medir solo las etapas de red.
+    tokens: IndiceTokens opcional donde se registra el token de la entrega.
+    buzon: BuzonSalida opcional; si se da, al terminar se encola el correo con
+        el enlace de confirmación (url_publica: por defecto ENTREGAS_URL_PUBLICA).
+    """
+
+    def __init__(self, escritor, obtener_drive, carpeta_drive, al_actualizar=None, permisos=None, generar_pdf=None,
+                 tokens=None, buzon=None, url_publica=None):
+        self.escritor = escritor
+        self.obtener_drive = obtener_drive
+        self.carpeta_drive = carpeta_drive
+        self.al_actualizar = al_actualizar
+        self.permisos = permisos
+        self.generar_pdf = generar_pdf or crear_pdf_certificado
+        self.tokens = tokens
+        self.buzon = buzon
+        self.url_publica = url_publica
+
+    def _escribir(self, record_id, fields):
+        futuro = self.escritor.escribir(record_id, fields)
+        if self.al_actualizar:
+            def parchear(f):
+                if f.exception() is None:
+                    self.al_actualizar(record_id, fields)
+            futuro.add_done_callback(parchear)
+        return futuro
+
+    def __call__(self, datos, marcar_etapa):
+        with medir('entrega', datos['fila'].get('ID-partido')):
+            return self._procesar(datos, marcar_etapa)
+
+    def _procesar(self, datos, marcar_etapa):
+        record_id = datos['rec']
+        fila = datos['fila']
+        partido = fila.get('ID-partido')
+        tiempos = {}
+
+        # No se espera a esta escritura: si el PDF y la subida terminan antes de
+        # que salga, se fusiona con la escritura final en una sola petición.
+        marcar_etapa('airtable_pendiente')
+        if self.tokens:
+            self.tokens.registrar(datos['token'], record_id)
+        pendiente = self._escribir(record_id, {
+            'Analista(Form)': datos['analista'],
+            'Mail(Form)': datos['mail'],
+            'Verificado': 'Pendiente',
+            'Codigo_unico': datos['token']
+        })
+
+        marcar_etapa('pdf')
+        inicio = time.perf_counter()
+        with medir('pdf', partido):
+            pdf_bytes, pdf_hash = self.generar_pdf(fila, datos['analista'], CODIGO_CERTIFICADO, fecha_utc=datos['fecha_utc'])
+        tiempos['pdf'] = time.perf_counter() - inicio
+
+        marcar_etapa('drive')
+        inicio = time.perf_counter()
+        file_name = f"reporte_verificado_{fila.get('ID-partido', 'sin_id')}.pdf"
+        with medir('drive', partido):
+            file_id, pdf_url = subir_pdf_a_drive(self.obtener_drive(), pdf_bytes, file_name, self.carpeta_drive, self.permisos)
+        # Huella de los bytes subidos: la referencia con la que la auditoría comprueba el fichero de Drive.
+        sha256_pdf = calcular_hash_bytes(pdf_bytes)
+        tiempos['drive'] = time.perf_counter() - inicio
+
+        marcar_etapa('airtable_final')
+        inicio = time.perf_counter()
+        with medir('airtable', partido):
+            final = self._escribir(record_id, {
+                'Verificado': 'Pendiente',
+                'PDF': [{'url': pdf_url}],
+                'Hash_PDF': pdf_hash,
+                # Sin la fecha de generación el hash no se puede volver a calcular.
+                'Fecha_UTC': datos['fecha_utc'],
+                'SHA256_PDF': sha256_pdf,
+                'Drive_ID': file_id,
+                'Codigo_unico': datos['token']
+            })
+            pendiente.result()
+            final.result()
+        tiempos['airtable'] = time.perf_counter() - inicio
+
+        resultado = {'pdf_url': pdf_url, 'drive_id': file_id, 'hash_pdf': pdf_hash, 'sha256_pdf': sha256_pdf,
+                     'tiempos': tiempos}
+        if self.buzon:
+            from correo import mensaje_enlace_confirmacion
+            marcar_etapa('correo')
+            asunto, mensaje = mensaje_enlace_confirmacion(
+                datos['mail'], fila.get('Piloto'), datos['token'], datos['analista'],
+                partido, fila.get('Fecha partido'), fila.get('Tipo', 'partido'), url_publica=self.url_publica
+            )
+            resultado['correo'] = self.buzon.encolar(datos['mail'], asunto, mensaje)
+        return resultado
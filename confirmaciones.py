@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+Enlaces de confirmación de entrega.
+
+Cada entrega escribe un token (uuid4) en 'Codigo_unico' y el correo al analista
+lleva un enlace con ese token. Para no recorrer la tabla de Airtable en cada
+clic, el token se guarda en un índice local (SQLite, clave primaria token ->
+Rec) con su caducidad: confirmar es una búsqueda por clave y un UPDATE
+condicional, que además hace que solo el primero de varios clics simultáneos
+cuente. El cambio de 'Verificado' a 'Verificado' se envía después por el
+EscritorAirtable; si no llega a confirmarse, queda marcado para reenviarlo.
+"""
+
+import os
+import time
+import sqlite3
+import datetime
+import threading
+import contextlib
+import urllib.parse
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TOKENS_PATH = os.environ.get("ENTREGAS_TOKENS", os.path.join(BASE_DIR, ".cache", "tokens_confirmacion.sqlite"))
+URL_PUBLICA = os.environ.get("ENTREGAS_URL_PUBLICA", "")
+CADUCIDAD = datetime.timedelta(days=float(os.environ.get("ENTREGAS_ENLACE_DIAS", "7")))
+# Cada cuánto registrar() aprovecha para borrar los tokens caducados.
+INTERVALO_PURGA = 3600
+
+CONFIRMADO = 'confirmado'
+YA_CONFIRMADO = 'ya_confirmado'
+CADUCADO = 'caducado'
+DESCONOCIDO = 'desconocido'
+
+# Valor de 'Codigo_unico' en los registros sin token (ver _completar_columnas).
+SIN_CODIGO = '------'
+
+
+def _ahora():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+def enlace_confirmacion(token, url_publica=None):
+    """URL que va en el correo: <ENTREGAS_URL_PUBLICA>/confirmar?token=..."""
+    url_publica = url_publica or URL_PUBLICA
+    if not url_publica:
+        raise RuntimeError("Falta ENTREGAS_URL_PUBLICA para construir el enlace de confirmación.")
+    return f"{url_publica.rstrip('/')}/confirmar?{urllib.parse.urlencode({'token': token})}"
+
+
+class IndiceTokens:
+    """
+    Índice persistente token -> Rec con caducidad y estado de confirmación.
+
+    Es un fichero SQLite para que lo compartan el formulario, el servidor y
+    los workers de gunicorn de la misma máquina. Los tokens caducados sin
+    confirmar se borran al registrar uno nuevo, como mucho cada INTERVALO_PURGA.
+    """
+
+    def __init__(self, ruta=TOKENS_PATH, caducidad=CADUCIDAD):
+        self.ruta = ruta
+        self.caducidad = caducidad
+        self._ultima_purga = 0.0
+        if os.path.dirname(ruta):
+            os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        with self._conectar() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS tokens (
+                token TEXT PRIMARY KEY, rec TEXT NOT NULL, caduca REAL NOT NULL,
+                creado TEXT, confirmado TEXT, sincronizado INTEGER DEFAULT 0)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS tokens_rec ON tokens (rec)")
+
+    @contextlib.contextmanager
+    def _conectar(self):
+        conn = sqlite3.connect(self.ruta, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def registrar(self, token, rec):
+        """
+        Da de alta el token de una entrega. Los tokens anteriores sin confirmar
+        del mismo registro dejan de valer: Airtable solo guarda el último.
+        """
+        with self._conectar() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM tokens WHERE rec = ? AND token != ? AND confirmado IS NULL", (rec, token))
+            conn.execute(
+                "INSERT OR IGNORE INTO tokens (token, rec, caduca, creado) VALUES (?, ?, ?, ?)",
+                (token, rec, time.time() + self.caducidad.total_seconds(), _ahora())
+            )
+            conn.execute("COMMIT")
+        if time.monotonic() - self._ultima_purga >= INTERVALO_PURGA:
+            self.purgar()
+
+    def reconstruir(self, df):
+        """
+        Añade los tokens 'Pendiente' de la tabla (la foto local, no Airtable) que
+        no estén ya en el índice, p. ej. los creados antes de que existiera.
+        La caducidad cuenta desde 'Fecha_UTC', la fecha en que se emitió el
+        token; sin ella (o en una base sin esa columna) no se sabe si el enlace
+        sigue vigente y no se añade.
+        Devuelve cuántos se han añadido.
+        """
+        import pandas as pd
+        if df.empty or not {'Codigo_unico', 'Rec', 'Verificado', 'Fecha_UTC'} <= set(df.columns):
+            return 0
+        emitido = pd.to_datetime(df['Fecha_UTC'], format="%Y-%m-%d %H:%M:%S UTC", utc=True, errors='coerce')
+        validos = ((df['Verificado'] == 'Pendiente') & df['Codigo_unico'].notna()
+                   & (df['Codigo_unico'] != SIN_CODIGO) & df['Rec'].notna() & emitido.notna())
+        pendientes, emitido = df[validos], emitido[validos]
+        caducidad = self.caducidad.total_seconds()
+        ahora = time.time()
+        with self._conectar() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            antes = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO tokens (token, rec, caduca, creado) VALUES (?, ?, ?, ?)",
+                [(str(token), str(rec), momento.timestamp() + caducidad, momento.isoformat())
+                 for token, rec, momento in zip(pendientes['Codigo_unico'], pendientes['Rec'], emitido)
+                 # Los ya caducados no hace falta guardarlos: consultar los da por desconocidos.
+                 if momento.timestamp() + caducidad >= ahora]
+            )
+            nuevos = conn.total_changes - antes
+            conn.execute("COMMIT")
+        return nuevos
+
+    def consultar(self, token):
+        """(estado, rec) sin modificar nada; estado es DESCONOCIDO, CADUCADO, YA_CONFIRMADO o None si es válido."""
+        with self._conectar() as conn:
+            fila = conn.execute("SELECT rec, caduca, confirmado FROM tokens WHERE token = ?", (token,)).fetchone()
+        if fila is None:
+            return DESCONOCIDO, None
+        if fila['confirmado']:
+            return YA_CONFIRMADO, fila['rec']
+        if fila['caduca'] < time.time():
+            return CADUCADO, fila['rec']
+        return None, fila['rec']
+
+    def confirmar(self, token):
+        """
+        Marca el token como confirmado si es válido. Devuelve (estado, rec):
+        CONFIRMADO solo para la primera confirmación; las siguientes, aunque
+        lleguen a la vez, ven YA_CONFIRMADO.
+        """
+        with self._conectar() as conn:
+            cursor = conn.execute(
+                "UPDATE tokens SET confirmado = ? WHERE token = ? AND confirmado IS NULL AND caduca >= ?",
+                (_ahora(), token, time.time())
+            )
+        if cursor.rowcount == 1:
+            return CONFIRMADO, self.consultar(token)[1]
+        return self.consultar(token)
+
+    def marcar_sincronizado(self, token):
+        with self._conectar() as conn:
+            conn.execute("UPDATE tokens SET sincronizado = 1 WHERE token = ?", (token,))
+
+    def sin_sincronizar(self):
+        """[(token, rec)] confirmados cuya escritura en Airtable no consta."""
+        with self._conectar() as conn:
+            return [(f['token'], f['rec']) for f in conn.execute(
+                "SELECT token, rec FROM tokens WHERE confirmado IS NOT NULL AND sincronizado = 0")]
+
+    def purgar(self):
+        """Borra los tokens caducados sin confirmar. Devuelve cuántos."""
+        self._ultima_purga = time.monotonic()
+        with self._conectar() as conn:
+            return conn.execute("DELETE FROM tokens WHERE confirmado IS NULL AND caduca < ?", (time.time(),)).rowcount
+
+
+class Confirmador:
+    """
+    Confirma entregas: anota la confirmación en el IndiceTokens y pasa
+    'Verificado' = 'Verificado' al EscritorAirtable sin esperar a Airtable.
+
+    al_actualizar: función (record_id, fields) llamada cuando Airtable confirma
+        la escritura, como en PipelineEntrega.
+    """
+
+    CAMPOS = {'Verificado': 'Verificado'}
+
+    def __init__(self, indice, escritor, al_actualizar=None):
+        self.indice = indice
+        self.escritor = escritor
+        self.al_actualizar = al_actualizar
+        self._reintentar = threading.Event()
+
+    def iniciar(self):
+        """Reenvía las confirmaciones que no llegaron a Airtable (p. ej. por un reinicio)."""
+        self.reintentar_pendientes()
+        return self
+
+    def _escribir(self, token, rec):
+        def al_terminar(futuro):
+            if futuro.exception() is not None:
+                self._reintentar.set()
+                return
+            self.indice.marcar_sincronizado(token)
+            if self.al_actualizar:
+                self.al_actualizar(rec, self.CAMPOS)
+        self.escritor.escribir(rec, dict(self.CAMPOS)).add_done_callback(al_terminar)
+
+    def reintentar_pendientes(self):
+        self._reintentar.clear()
+        pendientes = self.indice.sin_sincronizar()
+        for token, rec in pendientes:
+            self._escribir(token, rec)
+        return len(pendientes)
+
+    def confirmar(self, token):
+        """(estado, rec); ver IndiceTokens.confirmar."""
+        if self._reintentar.is_set():
+            self.reintentar_pendientes()
+        estado, rec = self.indice.confirmar(token)
+        if estado == CONFIRMADO:
+            self._escribir(token, rec)
+        return estado, rec
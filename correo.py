@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+"""
+Correos de la app y buzón de salida persistente.
+
+La interfaz ya no envía por Gmail dentro de la petición del usuario: encola el
+mensaje en el buzón (SQLite) y un hilo lo envía respetando la cuota por minuto,
+agrupando varios envíos en una petición batch de Gmail y reintentando los
+fallos transitorios con espera exponencial. Cada envío deja su acuse (id del
+mensaje de Gmail y hora) en el buzón.
+
+La app y server.py comparten el mismo fichero, así que cada buzón reclama los
+correos (estado 'enviando', con titular y caducidad) antes de mandarlos: dos
+procesos nunca envían el mismo. Si un proceso muere con correos reclamados,
+otro los vuelve a tomar cuando caduca el reclamo.
+"""
+
+import os
+import re
+import uuid
+import html
+import time
+import json
+import base64
+import random
+import sqlite3
+import datetime
+import mimetypes
+import threading
+import contextlib
+from email.mime.text import MIMEText
+from email.mime.image import MIMEImage
+from email.mime.multipart import MIMEMultipart
+from email.mime.audio import MIMEAudio
+from email.mime.base import MIMEBase
+from email import encoders
+
+from airtable_datos import CuboTokens
+from confirmaciones import enlace_confirmacion
+from metricas import medir
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BUZON_PATH = os.environ.get("ENTREGAS_BUZON", os.path.join(BASE_DIR, ".cache", "buzon_salida.sqlite"))
+
+PENDIENTE = 'pendiente'
+ENVIANDO = 'enviando'
+ENVIADO = 'enviado'
+FALLIDO = 'fallido'
+
+REGEX_MAIL = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+
+
+def es_mail_valido(email):
+    """Valida el formato de una dirección de correo."""
+    return isinstance(email, str) and REGEX_MAIL.match(email) is not None
+
+
+def crear_mensaje(remitente, destinatario, asunto, cuerpo_html, adjuntos=None):
+    """Creates and returns an email message with attachments."""
+    mensaje = MIMEMultipart()
+    mensaje['to'] = destinatario
+    mensaje['from'] = remitente
+    mensaje['subject'] = asunto
+
+    mensaje.attach(MIMEText(cuerpo_html, 'html'))
+
+    if adjuntos:
+        for adjunto_dict in adjuntos:
+            filename = adjunto_dict['nombre']
+            file_content = adjunto_dict['contenido']
+
+            content_type, encoding = mimetypes.guess_type(filename)
+            if content_type is None or encoding is not None:
+                content_type = 'application/octet-stream'
+
+            main_type, sub_type = content_type.split('/', 1)
+
+            if main_type == 'image':
+                msg = MIMEImage(file_content, _subtype=sub_type)
+            elif main_type == 'audio':
+                msg = MIMEAudio(file_content, _subtype=sub_type)
+            else:
+                msg = MIMEBase(main_type, sub_type)
+                msg.set_payload(file_content)
+                encoders.encode_base64(msg)
+
+            msg.add_header('Content-Disposition', 'attachment', filename=filename)
+            mensaje.attach(msg)
+
+    return {'raw': base64.urlsafe_b64encode(mensaje.as_bytes()).decode()}
+
+
+def mensaje_enlace_confirmacion(mail_value, nombre_completo_piloto, codigo, nombre_analista, partido_id, fecha_partido, tipo_evento, remitente='me', url_publica=None):
+    """
+    Correo al analista con el enlace de confirmación del código único y los
+    detalles legales. url_publica: por defecto ENTREGAS_URL_PUBLICA.
+    Devuelve (asunto, mensaje).
+    """
+    enlace = html.escape(enlace_confirmacion(codigo, url_publica))
+    if isinstance(tipo_evento, list) and tipo_evento:
+        tipo_evento_str = tipo_evento[0].capitalize()
+    else:
+        tipo_evento_str = str(tipo_evento).capitalize()
+
+    asunto = f'[Fly-Fut] Confirmación de entrega de tarjeta SD - {tipo_evento_str}: {partido_id}'
+
+    cuerpo_html = f"""
+    <html>
+    <head></head>
+    <body>
+        <p>Hola <b>{nombre_analista}</b>,</p>
+        <p>El piloto <b>{nombre_completo_piloto}</b> ha iniciado la entrega física de la tarjeta SD con el material del **{tipo_evento_str}** <b>{partido_id}</b>, jugado el <b>{fecha_partido}</b>.</p>
+        <hr style="border: 0; border-top: 1px solid #ccc; margin: 30px 0;">
+        <h4>Declaración de No Repudio y Validez Legal</h4>
+        <p>Al hacer clic en el siguiente enlace, usted está confirmando la recepción y aceptación de la custodia de la tarjeta SD. Esta acción genera un registro digital con fecha y hora, que certifica la entrega del material.</p>
+        <p style="text-align: center; margin-top: 20px;">
+            <a href="{enlace}" style="background-color: #007bff; color: white; padding: 10px 20px; text-decoration: none; border-radius: 5px; font-weight: bold;">Confirmar Entrega</a>
+        </p>
+        <p>Esta confirmación tiene carácter de <b>firma electrónica simple</b> y garantiza la integridad de la transacción, impidiendo que cualquiera de las partes pueda repudiar la entrega posteriormente. Este registro se almacena de forma segura en nuestra base de datos para futuras auditorías.</p>
+        <p>Si tienes alguna pregunta o incidencia, por favor, contacta con nuestro departamento legal en <a href="mailto:legal@fly-fut.com">legal@fly-fut.com</a>.</p>
+        <p>Gracias por tu colaboración.</p>
+        <p>Atentamente,<br>
+        El equipo de Fly-Fut</p>
+    </body>
+    </html>
+    """
+
+    return asunto, crear_mensaje(remitente, mail_value, asunto, cuerpo_html)
+
+
+def mensaje_pdf_confirmacion(mail_value, nombre_piloto, nombre_analista, partido_id, adjuntos=None, remitente='me'):
+    """
+    Correo final de confirmación con el PDF adjunto. Devuelve (asunto, mensaje).
+    """
+    asunto = f'Confirmación de entrega de imágenes - PDF adjunto para {partido_id}'
+
+    cuerpo_html = f"""
+    <html>
+    <body>
+        <p>Hola {nombre_analista},</p>
+        <p>Se adjunta el certificado de confirmación de entrega del material del partido <b>{partido_id}</b>, que fue validado por el piloto <b>{nombre_piloto}</b>.</p>
+        <p>Este documento certifica la correcta transferencia del material según nuestro protocolo de seguridad.</p>
+        <p>Gracias por tu colaboración.</p>
+    </body>
+    </html>
+    """
+
+    return asunto, crear_mensaje(remitente, mail_value, asunto, cuerpo_html, adjuntos)
+
+
+def _es_transitorio(excepcion):
+    """Errores de cuota, de servidor o de red: merece la pena reintentar."""
+    from googleapiclient.errors import HttpError
+    if isinstance(excepcion, HttpError):
+        return excepcion.resp.status in (429, 500, 502, 503, 504) or (
+            excepcion.resp.status == 403 and b'rateLimitExceeded' in (excepcion.content or b''))
+    return isinstance(excepcion, (OSError, TimeoutError))
+
+
+class BuzonSalida:
+    """
+    Buzón de salida persistente con un hilo que envía por Gmail.
+
+    obtener_gmail: función que devuelve el servicio de Gmail del hilo actual.
+    cuota_por_minuto: envíos máximos por minuto (ritmo sostenido).
+    lote: mensajes por petición batch de Gmail.
+    """
+
+    MAX_INTENTOS = 6
+    ESPERA_BASE = 5
+    # Mayor que la espera de cuota de un lote más la petición batch.
+    DURACION_RECLAMO = 300
+
+    def __init__(self, obtener_gmail, ruta=BUZON_PATH, cuota_por_minuto=60, lote=10, remitente='me'):
+        self.obtener_gmail = obtener_gmail
+        self.ruta = ruta
+        self.lote = lote
+        self.remitente = remitente
+        self.cuota = CuboTokens(tasa=cuota_por_minuto / 60.0, capacidad=lote)
+        self._hay_correo = threading.Event()
+        self._parar = threading.Event()
+        self._hilo = None
+        self.titular = uuid.uuid4().hex
+        if os.path.dirname(ruta):
+            os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        with self._conectar() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS correos (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, destinatario TEXT, asunto TEXT, mensaje TEXT NOT NULL,
+                estado TEXT NOT NULL, intentos INTEGER DEFAULT 0, proximo_intento REAL DEFAULT 0,
+                id_gmail TEXT, error TEXT, creado TEXT, enviado TEXT)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS correos_pendientes ON correos (estado, proximo_intento)")
+            # Buzones creados antes de los reclamos.
+            columnas = {fila['name'] for fila in conn.execute("PRAGMA table_info(correos)")}
+            if 'titular' not in columnas:
+                conn.execute("ALTER TABLE correos ADD COLUMN titular TEXT")
+            if 'reclamado_hasta' not in columnas:
+                conn.execute("ALTER TABLE correos ADD COLUMN reclamado_hasta REAL")
+
+    @contextlib.contextmanager
+    def _conectar(self):
+        conn = sqlite3.connect(self.ruta, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def iniciar(self):
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._bucle, name="buzon-salida", daemon=True)
+            self._hilo.start()
+        return self
+
+    def parar(self):
+        self._parar.set()
+        self._hay_correo.set()
+
+    def encolar(self, destinatario, asunto, mensaje):
+        """Guarda el mensaje ({'raw': ...}) para enviarlo; devuelve su id en el buzón."""
+        with self._conectar() as conn:
+            cursor = conn.execute(
+                "INSERT INTO correos (destinatario, asunto, mensaje, estado, creado) VALUES (?, ?, ?, ?, ?)",
+                (destinatario, asunto, json.dumps(mensaje), PENDIENTE, datetime.datetime.now(datetime.timezone.utc).isoformat())
+            )
+            correo_id = cursor.lastrowid
+        self._hay_correo.set()
+        return correo_id
+
+    def estado(self, correo_id):
+        """Estado y acuse de un correo, o None si no existe."""
+        with self._conectar() as conn:
+            fila = conn.execute(
+                "SELECT id, destinatario, asunto, estado, intentos, id_gmail, error, creado, enviado FROM correos WHERE id = ?",
+                (correo_id,)
+            ).fetchone()
+        return dict(fila) if fila else None
+
+    def contar(self):
+        with self._conectar() as conn:
+            return {estado: n for estado, n in conn.execute("SELECT estado, COUNT(*) FROM correos GROUP BY estado")}
+
+    def _reclamar(self, limite):
+        """Marca como 'enviando' de este buzón hasta 'limite' correos vencidos y los devuelve."""
+        ahora = time.time()
+        with self._conectar() as conn:
+            # BEGIN IMMEDIATE: otro buzón sobre el mismo fichero no puede reclamar los mismos.
+            conn.execute("BEGIN IMMEDIATE")
+            correos = conn.execute(
+                """SELECT id, mensaje, intentos FROM correos
+                   WHERE (estado = ? AND proximo_intento <= ?) OR (estado = ? AND reclamado_hasta <= ?)
+                   ORDER BY id LIMIT ?""",
+                (PENDIENTE, ahora, ENVIANDO, ahora, limite)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE correos SET estado = ?, titular = ?, reclamado_hasta = ? WHERE id = ?",
+                [(ENVIANDO, self.titular, ahora + self.DURACION_RECLAMO, correo['id']) for correo in correos]
+            )
+        return correos
+
+    def _liberar(self, correos):
+        """Devuelve a 'pendiente' los correos reclamados que no se han llegado a enviar."""
+        with self._conectar() as conn:
+            conn.executemany(
+                "UPDATE correos SET estado = ?, titular = NULL, reclamado_hasta = NULL WHERE id = ? AND estado = ? AND titular = ?",
+                [(PENDIENTE, correo['id'], ENVIANDO, self.titular) for correo in correos]
+            )
+
+    def _registrar(self, correo, respuesta, excepcion):
+        with self._conectar() as conn:
+            if excepcion is None:
+                conn.execute(
+                    """UPDATE correos SET estado = ?, intentos = intentos + 1, id_gmail = ?, error = NULL, enviado = ?,
+                       titular = NULL, reclamado_hasta = NULL WHERE id = ?""",
+                    (ENVIADO, respuesta.get('id'), datetime.datetime.now(datetime.timezone.utc).isoformat(), correo['id'])
+                )
+                return
+            intentos = correo['intentos'] + 1
+            if _es_transitorio(excepcion) and intentos < self.MAX_INTENTOS:
+                espera = self.ESPERA_BASE * 2 ** (intentos - 1) * random.uniform(0.8, 1.2)
+                conn.execute(
+                    """UPDATE correos SET estado = ?, intentos = ?, proximo_intento = ?, error = ?,
+                       titular = NULL, reclamado_hasta = NULL WHERE id = ?""",
+                    (PENDIENTE, intentos, time.time() + espera, str(excepcion), correo['id'])
+                )
+            else:
+                conn.execute(
+                    "UPDATE correos SET estado = ?, intentos = ?, error = ?, titular = NULL, reclamado_hasta = NULL WHERE id = ?",
+                    (FALLIDO, intentos, str(excepcion), correo['id'])
+                )
+
+    def enviar_pendientes(self):
+        """Envía un lote de correos vencidos en una petición batch. Devuelve cuántos se intentaron."""
+        correos = self._reclamar(self.lote)
+        if not correos:
+            return 0
+        try:
+            for _ in correos:
+                self.cuota.tomar()
+            servicio = self.obtener_gmail()
+            por_id = {str(c['id']): c for c in correos}
+            respuestas = {}
+
+            def al_responder(request_id, respuesta, excepcion):
+                respuestas[request_id] = (respuesta, excepcion)
+
+            lote = servicio.new_batch_http_request(callback=al_responder)
+            for correo in correos:
+                lote.add(servicio.users().messages().send(userId=self.remitente, body=json.loads(correo['mensaje'])),
+                         request_id=str(correo['id']))
+        except BaseException:
+            # Sin llegar a enviar (credenciales, parada): otro intento los puede tomar ya.
+            self._liberar(correos)
+            raise
+        try:
+            with medir('gmail'):
+                lote.execute()
+        except Exception as e:
+            # Falla la petición entera (red, 5xx del endpoint batch): todos se reintentan.
+            respuestas = {request_id: (None, e) for request_id in por_id}
+
+        for request_id, correo in por_id.items():
+            respuesta, excepcion = respuestas.get(request_id, (None, ConnectionError("Sin respuesta en el batch")))
+            self._registrar(correo, respuesta, excepcion)
+        return len(correos)
+
+    def _bucle(self):
+        while not self._parar.is_set():
+            try:
+                enviados = self.enviar_pendientes()
+            except Exception:
+                enviados = 0
+            if not enviados:
+                # Sin nada vencido: espera a un correo nuevo o revisa reintentos cada segundo.
+                self._hay_correo.wait(1.0)
+                self._hay_correo.clear()
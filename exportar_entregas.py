@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+Exportación del histórico de Confirmaciones_de_Entrega para auditorías.
+
+Lee la tabla página a página con el mismo cursor que usa la app
+(leer_registros_paginados) y escribe Parquet y/o CSV en bloques de
+--filas-por-grupo filas: nunca hay en memoria más de un bloque, así que el
+consumo no crece con el tamaño de la tabla. Los filtros por estado y por
+rango de 'Fecha partido' viajan a Airtable como filterByFormula.
+
+La salida es un directorio con una parte por ejecución
+(entregas-00001.parquet, entregas-00001.csv, ...) y un estado.json con la
+marca de agua. La primera ejecución (o --completo) exporta todo; las
+siguientes piden solo los registros creados o modificados desde la marca
+(LAST_MODIFIED_TIME(), como EspejoAirtable), así que cada parte añade
+versiones nuevas de registros. Para la foto actual hay que quedarse con la
+última versión de cada record_id (leer_exportacion). Las bajas en Airtable,
+y los registros que dejan de cumplir los filtros, no aparecen en una
+exportación incremental. Parquet necesita pyarrow; CSV no necesita nada.
+
+Uso:
+    AIRTABLE_BASE_ID=... AIRTABLE_API_KEY=... \\
+    python exportar_entregas.py --salida auditoria --estado Verificado --desde 2025-01-01
+"""
+
+import os
+import csv
+import json
+import argparse
+import datetime
+import tempfile
+
+from airtable_datos import EspejoAirtable, leer_registros_paginados, crear_cliente_airtable, credenciales_airtable_entorno
+
+# Columnas de la exportación, en este orden. 'PDF' es el enlace (Airtable lo guarda como adjunto).
+CAMPOS_EXPORTACION = ['ID-partido', 'Fecha partido', 'Piloto', 'Analista(Form)', 'Mail(Form)',
+                      'Verificado', 'Codigo_unico', 'Hash_PDF', 'Fecha_UTC', 'SHA256_PDF', 'Drive_ID', 'PDF']
+COLUMNAS = ['record_id', 'creado'] + CAMPOS_EXPORTACION + ['exportado']
+FILAS_POR_GRUPO = 10000
+ESTADO = "estado.json"
+FORMATOS = ('parquet', 'csv')
+
+
+def _texto_formula(valor):
+    return "'" + str(valor).replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+def formula_exportacion(estado=None, desde=None, hasta=None, modificado_desde=None):
+    """filterByFormula con los filtros pedidos (None si no hay ninguno); desde y hasta son inclusivos."""
+    condiciones = []
+    if estado is not None:
+        condiciones.append(f"{{Verificado}} = {_texto_formula(estado)}")
+    if desde is not None:
+        condiciones.append(f"NOT(IS_BEFORE({{Fecha partido}}, DATETIME_PARSE({_texto_formula(desde)})))")
+    if hasta is not None:
+        condiciones.append(f"NOT(IS_AFTER({{Fecha partido}}, DATETIME_PARSE({_texto_formula(hasta)})))")
+    if modificado_desde is not None:
+        condiciones.append(f"IS_AFTER(LAST_MODIFIED_TIME(), DATETIME_PARSE('{modificado_desde:%Y-%m-%dT%H:%M:%S.000Z}'))")
+    if not condiciones:
+        return None
+    return condiciones[0] if len(condiciones) == 1 else f"AND({', '.join(condiciones)})"
+
+
+def _valor(campo, valor):
+    if valor is None:
+        return None
+    if campo == 'PDF' and isinstance(valor, list):
+        return " ".join(adjunto.get('url', '') for adjunto in valor if isinstance(adjunto, dict)) or None
+    if isinstance(valor, list):
+        # Lookups y campos vinculados llegan como listas.
+        return ", ".join(str(v) for v in valor)
+    return str(valor)
+
+
+def fila_exportacion(registro, exportado):
+    campos = registro.get('fields', {})
+    fila = {'record_id': registro['id'], 'creado': registro.get('createdTime'), 'exportado': exportado}
+    for campo in CAMPOS_EXPORTACION:
+        fila[campo] = _valor(campo, campos.get(campo))
+    return fila
+
+
+def bloques(paginas, filas_por_grupo=FILAS_POR_GRUPO, exportado=None):
+    """Agrupa las páginas de Airtable en listas de como mucho filas_por_grupo filas."""
+    bloque = []
+    for pagina in paginas:
+        for registro in pagina:
+            bloque.append(fila_exportacion(registro, exportado))
+            if len(bloque) >= filas_por_grupo:
+                yield bloque
+                bloque = []
+    if bloque:
+        yield bloque
+
+
+class _SalidaParquet:
+
+    def __init__(self, ruta):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("La exportación a Parquet necesita pyarrow (pip install pyarrow).") from None
+        self._pa = pa
+        # Esquema fijo: todas las partes se leen juntas aunque un bloque no traiga alguna columna.
+        self.esquema = pa.schema([(columna, pa.string()) for columna in COLUMNAS])
+        self._writer = pq.ParquetWriter(ruta, self.esquema, compression='zstd')
+
+    def escribir(self, bloque):
+        # Cada write_table es un row group.
+        self._writer.write_table(self._pa.Table.from_pylist(bloque, schema=self.esquema))
+
+    def cerrar(self):
+        self._writer.close()
+
+
+class _SalidaCSV:
+
+    def __init__(self, ruta):
+        self._fichero = open(ruta, "w", encoding="utf-8", newline="")
+        self._writer = csv.DictWriter(self._fichero, fieldnames=COLUMNAS)
+        self._writer.writeheader()
+
+    def escribir(self, bloque):
+        self._writer.writerows(bloque)
+        self._fichero.flush()
+
+    def cerrar(self):
+        self._fichero.close()
+
+
+SALIDAS = {'parquet': _SalidaParquet, 'csv': _SalidaCSV}
+
+
+def leer_estado(directorio):
+    ruta = os.path.join(directorio, ESTADO)
+    if not os.path.exists(ruta):
+        return None
+    with open(ruta, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _guardar_estado(directorio, estado):
+    descriptor, temporal = tempfile.mkstemp(dir=directorio, suffix=".tmp")
+    with os.fdopen(descriptor, "w", encoding="utf-8") as f:
+        json.dump(estado, f, ensure_ascii=False, indent=2)
+    os.replace(temporal, os.path.join(directorio, ESTADO))
+
+
+def exportar(paginas_de, directorio, formatos=FORMATOS, estado=None, desde=None, hasta=None,
+             completo=False, filas_por_grupo=FILAS_POR_GRUPO):
+    """
+    Escribe una parte nueva en 'directorio' y avanza la marca de agua.
+
+    paginas_de(formula) devuelve las páginas de registros de Airtable para ese
+    filterByFormula. Los filtros deben ser los mismos que en las ejecuciones
+    anteriores salvo con completo=True, que vuelve a exportar todo.
+    Devuelve (filas, {formato: ruta}); si no hay cambios no se escribe ninguna parte.
+    """
+    os.makedirs(directorio, exist_ok=True)
+    anterior = leer_estado(directorio)
+    filtros = {'estado': estado, 'desde': desde, 'hasta': hasta}
+    if anterior and not completo and anterior['filtros'] != filtros:
+        raise ValueError(f"La exportación de {directorio} se hizo con los filtros {anterior['filtros']}; "
+                         "usa los mismos o --completo.")
+    marca = None
+    if anterior and not completo:
+        marca = datetime.datetime.fromisoformat(anterior['marca_agua'])
+    ahora = datetime.datetime.now(datetime.timezone.utc)
+    exportado = ahora.isoformat()
+
+    numero = (anterior or {}).get('partes', 0) + 1
+    rutas = {formato: os.path.join(directorio, f"entregas-{numero:05d}.{formato}") for formato in formatos}
+    temporales = {formato: ruta + ".tmp" for formato, ruta in rutas.items()}
+    salidas = {}
+    filas = 0
+    try:
+        formula = formula_exportacion(estado, desde, hasta, marca - EspejoAirtable.MARGEN if marca else None)
+        for bloque in bloques(paginas_de(formula), filas_por_grupo, exportado):
+            if not salidas:
+                salidas = {formato: SALIDAS[formato](temporales[formato]) for formato in formatos}
+            for salida in salidas.values():
+                salida.escribir(bloque)
+            filas += len(bloque)
+    except BaseException:
+        for salida in salidas.values():
+            salida.cerrar()
+        for temporal in temporales.values():
+            if os.path.exists(temporal):
+                os.remove(temporal)
+        raise
+    for salida in salidas.values():
+        salida.cerrar()
+    if filas:
+        for formato, ruta in rutas.items():
+            os.replace(temporales[formato], ruta)
+    # La marca solo avanza cuando las partes ya están en su sitio: si algo falla, se repite.
+    _guardar_estado(directorio, {
+        'marca_agua': ahora.isoformat(),
+        'filtros': filtros,
+        'partes': numero if filas else numero - 1,
+        'ultima_ejecucion': {'filas': filas, 'completa': marca is None, 'ficheros': sorted(rutas.values()) if filas else []},
+    })
+    return filas, (rutas if filas else {})
+
+
+def leer_exportacion(directorio):
+    """DataFrame con la última versión exportada de cada registro (lee todas las partes Parquet)."""
+    import pandas as pd
+    partes = sorted(f for f in os.listdir(directorio) if f.startswith("entregas-") and f.endswith(".parquet"))
+    if not partes:
+        return pd.DataFrame(columns=COLUMNAS)
+    df = pd.concat([pd.read_parquet(os.path.join(directorio, parte)) for parte in partes], ignore_index=True)
+    return df.drop_duplicates('record_id', keep='last').reset_index(drop=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Exporta Confirmaciones_de_Entrega a Parquet/CSV.")
+    parser.add_argument("--salida", default="exportacion", help="Directorio de la exportación")
+    parser.add_argument("--formato", default=",".join(FORMATOS), help="parquet, csv o ambos separados por comas")
+    parser.add_argument("--estado", help="Valor de 'Verificado' (p. ej. Verificado, Pendiente)")
+    parser.add_argument("--desde", help="Fecha partido mínima (AAAA-MM-DD)")
+    parser.add_argument("--hasta", help="Fecha partido máxima (AAAA-MM-DD)")
+    parser.add_argument("--completo", action="store_true", help="Exportar todo, ignorando la marca de agua")
+    parser.add_argument("--filas-por-grupo", type=int, default=FILAS_POR_GRUPO, help="Filas por row group / bloque")
+    args = parser.parse_args(argv)
+
+    formatos = [f.strip() for f in args.formato.split(",") if f.strip()]
+    desconocidos = set(formatos) - set(SALIDAS)
+    if not formatos or desconocidos:
+        parser.error(f"Formato no válido: {', '.join(sorted(desconocidos)) or args.formato}")
+    for fecha in (args.desde, args.hasta):
+        try:
+            fecha and datetime.date.fromisoformat(fecha)
+        except ValueError:
+            parser.error(f"Fecha no válida: {fecha} (AAAA-MM-DD)")
+
+    cliente = crear_cliente_airtable(*credenciales_airtable_entorno())
+    filas, rutas = exportar(
+        lambda formula: leer_registros_paginados(cliente, campos=CAMPOS_EXPORTACION, formula=formula),
+        args.salida, formatos, args.estado, args.desde, args.hasta, args.completo, args.filas_por_grupo
+    )
+    if filas:
+        print(f"{filas} registros -> {', '.join(rutas.values())}")
+    else:
+        print("Sin cambios desde la última exportación.")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+"""
+Credenciales y registro de clientes de las APIs de Google (Gmail y Drive).
+
+Los documentos de descubrimiento van incluidos en discovery/, así que construir
+un cliente no descarga ni vuelve a parsear nada. Como httplib2.Http no es
+seguro entre hilos y Streamlit atiende cada sesión en un hilo, el registro
+guarda un cliente (con su propio transporte HTTP keep-alive) por hilo y API.
+
+Las librerías de Google (googleapiclient, httplib2, google-auth) se importan
+al construir el primer cliente o las credenciales, no al importar el módulo.
+"""
+
+import os
+import json
+import datetime
+import threading
+from io import BytesIO
+from concurrent.futures import Future
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DISCOVERY_DIR = os.path.join(BASE_DIR, "discovery")
+TIMEOUT_HTTP = 60
+# Por debajo de este tamaño una subida resumable solo añade una ida y vuelta.
+UMBRAL_RESUMABLE = 5 * 1024 * 1024
+TROZO_DESCARGA = 1024 * 1024
+
+
+class GestorCredenciales:
+    """
+    Un único juego de credenciales para todas las APIs, compartido por todos
+    los hilos y sesiones del proceso.
+
+    Un hilo en segundo plano renueva el token MARGEN antes de que caduque, de
+    modo que las peticiones de los usuarios nunca esperan a un refresh. Si el
+    hilo no ha podido renovarlo (p. ej. sin red), credenciales() lo renueva en
+    línea como último recurso.
+    """
+
+    # Debe superar el umbral con el que google-auth da un token por caducado (~4 min).
+    MARGEN = datetime.timedelta(minutes=10)
+    REINTENTO = 30
+
+    def __init__(self, creds_info, scopes):
+        from google.oauth2.credentials import Credentials
+        self.creds = Credentials.from_authorized_user_info(info=dict(creds_info), scopes=list(scopes))
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+        self._hilo = None
+        self.renovaciones = 0
+        self.errores = 0
+
+    def _caduca_pronto(self):
+        expiry = self.creds.expiry
+        if not self.creds.token or expiry is None:
+            # Sin caducidad conocida se renueva una vez para conocerla.
+            return True
+        # google-auth guarda expiry como datetime UTC sin zona horaria.
+        return expiry - datetime.datetime.utcnow() <= self.MARGEN
+
+    def _renovar(self):
+        from google.auth.transport.requests import Request
+        with self._lock:
+            if self._caduca_pronto():
+                self.creds.refresh(Request())
+                self.renovaciones += 1
+
+    def _segundos_hasta_renovar(self):
+        if self.creds.expiry is None:
+            return None
+        restante = self.creds.expiry - datetime.datetime.utcnow() - self.MARGEN
+        return max(restante.total_seconds(), 0)
+
+    def _bucle(self):
+        while not self._parar.is_set():
+            try:
+                self._renovar()
+                espera = self._segundos_hasta_renovar()
+            except Exception:
+                self.errores += 1
+                espera = self.REINTENTO
+            if espera is None:
+                espera = self.REINTENTO
+            self._parar.wait(max(espera, 1))
+
+    def iniciar(self):
+        """Arranca el hilo de renovación (idempotente)."""
+        with self._lock:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._bucle, name="renovar-credenciales", daemon=True)
+                self._hilo.start()
+        return self
+
+    def parar(self):
+        self._parar.set()
+
+    def credenciales(self):
+        """Credenciales vigentes; solo bloquea si el hilo de fondo no pudo renovarlas."""
+        if not self.creds.valid:
+            self._renovar()
+        return self.creds
+
+
+class RegistroServicios:
+    """
+    Entrega clientes de Gmail/Drive ya construidos, uno por hilo y API.
+
+    endpoints permite sustituir la rootUrl de una API (p. ej. {'drive':
+    'http://127.0.0.1:8080/'}) para trabajar contra un servidor local.
+    """
+
+    def __init__(self, discovery_dir=DISCOVERY_DIR, endpoints=None):
+        self.discovery_dir = discovery_dir
+        self.endpoints = dict(endpoints or {})
+        self._documentos = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def documento(self, api, version):
+        """Documento de descubrimiento parseado, compartido por todos los hilos."""
+        clave = (api, version)
+        if clave not in self._documentos:
+            with self._lock:
+                if clave not in self._documentos:
+                    with open(os.path.join(self.discovery_dir, f"{api}.{version}.json"), encoding="utf-8") as f:
+                        documento = json.load(f)
+                    endpoint = self.endpoints.get(api)
+                    if endpoint:
+                        documento = dict(documento, rootUrl=endpoint, mtlsRootUrl=endpoint)
+                    self._documentos[clave] = documento
+        return self._documentos[clave]
+
+    def servicio(self, api, version, creds):
+        """Cliente de la API para el hilo actual; se reconstruye solo si cambian las credenciales."""
+        clientes = getattr(self._local, "clientes", None)
+        if clientes is None:
+            clientes = self._local.clientes = {}
+        actual = clientes.get((api, version))
+        if actual is not None and actual[0] is creds:
+            return actual[1]
+
+        import httplib2
+        import google_auth_httplib2
+        from googleapiclient.discovery import build_from_document
+        http = google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http(timeout=TIMEOUT_HTTP))
+        cliente = build_from_document(self.documento(api, version), http=http)
+        clientes[(api, version)] = (creds, cliente)
+        return cliente
+
+
+_registro = None
+_registro_lock = threading.Lock()
+
+
+def obtener_registro():
+    """Registro compartido por todo el proceso. GOOGLE_API_ENDPOINT apunta ambas APIs a un stub local."""
+    global _registro
+    if _registro is None:
+        with _registro_lock:
+            if _registro is None:
+                endpoint = os.environ.get("GOOGLE_API_ENDPOINT")
+                endpoints = {'gmail': endpoint, 'drive': endpoint} if endpoint else None
+                _registro = RegistroServicios(endpoints=endpoints)
+    return _registro
+
+
+def media_pdf(pdf_bytes, umbral=UMBRAL_RESUMABLE):
+    """
+    Subida simple (multipart, una sola petición) por debajo del umbral;
+    resumable solo para ficheros grandes, donde compensa la petición extra.
+    """
+    from googleapiclient.http import MediaIoBaseUpload
+    return MediaIoBaseUpload(BytesIO(pdf_bytes), mimetype='application/pdf', resumable=len(pdf_bytes) > umbral)
+
+
+def conceder_lectura_publica(servicio_drive, file_ids):
+    """
+    Concede lectura pública a varios ficheros en una única petición batch de
+    Drive. Devuelve {file_id: excepción o None}.
+    """
+    errores = {}
+
+    def al_responder(request_id, respuesta, excepcion):
+        errores[request_id] = excepcion
+
+    lote = servicio_drive.new_batch_http_request(callback=al_responder)
+    for file_id in file_ids:
+        lote.add(servicio_drive.permissions().create(
+            fileId=file_id,
+            body={'type': 'anyone', 'role': 'reader'},
+            fields='id'
+        ), request_id=file_id)
+    lote.execute()
+    return errores
+
+
+class AgrupadorPermisos:
+    """
+    Junta las concesiones de lectura pública de varias subidas concurrentes y
+    las envía en peticiones batch de Drive (hasta MAX_LOTE por petición).
+
+    Sin intervalo de espera, el lote lo forman las concesiones que llegan
+    mientras la petición anterior está en vuelo, así que una subida aislada no
+    paga latencia extra y con carga las peticiones se agrupan solas.
+    """
+
+    MAX_LOTE = 100
+
+    def __init__(self, obtener_drive, intervalo=0.0):
+        self.obtener_drive = obtener_drive
+        self.intervalo = intervalo
+        self._pendientes = []
+        self._lock = threading.Lock()
+        self._hay_datos = threading.Event()
+        self._parar = threading.Event()
+        self._hilo = None
+        self.metricas = {'peticiones': 0, 'permisos': 0, 'errores': 0}
+
+    def iniciar(self):
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._bucle, name="permisos-drive", daemon=True)
+            self._hilo.start()
+        return self
+
+    def parar(self):
+        self._parar.set()
+        self._hay_datos.set()
+
+    def conceder(self, file_id):
+        """Encola la concesión; el Future se resuelve cuando Drive la confirma."""
+        futuro = Future()
+        with self._lock:
+            self._pendientes.append((file_id, futuro))
+        self._hay_datos.set()
+        return futuro
+
+    def vaciar(self):
+        with self._lock:
+            pendientes, self._pendientes = self._pendientes, []
+        for i in range(0, len(pendientes), self.MAX_LOTE):
+            lote = pendientes[i:i + self.MAX_LOTE]
+            try:
+                errores = conceder_lectura_publica(self.obtener_drive(), [file_id for file_id, _ in lote])
+            except Exception as e:
+                errores = {file_id: e for file_id, _ in lote}
+            self.metricas['peticiones'] += 1
+            for file_id, futuro in lote:
+                error = errores.get(file_id)
+                if error is None:
+                    self.metricas['permisos'] += 1
+                    futuro.set_result(True)
+                else:
+                    self.metricas['errores'] += 1
+                    futuro.set_exception(error)
+
+    def _bucle(self):
+        while not self._parar.is_set():
+            self._hay_datos.wait()
+            self._hay_datos.clear()
+            if self.intervalo:
+                self._parar.wait(self.intervalo)
+            self.vaciar()
+
+
+def subir_pdf_a_drive(servicio_drive, pdf_bytes, file_name, folder_id, permisos=None):
+    """
+    Sube un PDF a Drive desde bytes, lo hace público y devuelve (id, webContentLink).
+    Con un AgrupadorPermisos, la concesión pública viaja en un batch compartido.
+    No muestra nada en pantalla; los errores se propagan al llamador.
+    """
+    file_metadata = {'name': file_name, 'parents': [folder_id]}
+
+    archivo = servicio_drive.files().create(body=file_metadata, media_body=media_pdf(pdf_bytes), fields='id, webContentLink').execute()
+
+    if permisos is not None:
+        permisos.conceder(archivo.get('id')).result()
+    else:
+        servicio_drive.permissions().create(
+            fileId=archivo.get('id'),
+            body={'type': 'anyone', 'role': 'reader'},
+            fields='id'
+        ).execute()
+
+    return archivo.get('id'), archivo.get('webContentLink')
+
+
+def descargar_de_drive(servicio_drive, file_id):
+    """Contenido de un fichero de Drive como bytes."""
+    return servicio_drive.files().get_media(fileId=file_id).execute()
+
+
+def descargar_por_trozos(servicio_drive, file_id, destino, trozo=TROZO_DESCARGA):
+    """
+    Descarga un fichero de Drive en trozos de 'trozo' bytes (peticiones con
+    Range), pasándolos a destino.write() sin juntarlos en memoria.
+    """
+    from googleapiclient.http import MediaIoBaseDownload
+    descarga = MediaIoBaseDownload(destino, servicio_drive.files().get_media(fileId=file_id), chunksize=trozo)
+    terminado = False
+    while not terminado:
+        _, terminado = descarga.next_chunk(num_retries=3)
+
+
+def listar_carpeta(servicio_drive, carpeta, campos="id, name, size, createdTime"):
+    """Recorre los ficheros (no borrados) de una carpeta de Drive, página a página."""
+    token = None
+    while True:
+        respuesta = servicio_drive.files().list(
+            q=f"'{carpeta}' in parents and trashed = false",
+            fields=f"nextPageToken, files({campos})",
+            orderBy="createdTime",
+            pageSize=1000,
+            pageToken=token,
+        ).execute()
+        yield from respuesta.get('files', [])
+        token = respuesta.get('nextPageToken')
+        if not token:
+            return
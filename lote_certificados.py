@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Generación por lotes de certificados de entrega, sin la interfaz de Streamlit.
+
+Selecciona registros de Confirmaciones_de_Entrega por estado y/o rango de
+fechas, renderiza los PDF en paralelo con un pool de procesos y los guarda en
+un directorio local junto con un manifiesto (manifest.jsonl) de hashes.
+El manifiesto se escribe a medida que termina cada PDF, así que si el proceso
+se interrumpe basta con relanzarlo: los certificados ya generados se saltan.
+
+Uso:
+    AIRTABLE_BASE_ID=... AIRTABLE_API_KEY=... \\
+    python lote_certificados.py --estado Pendiente --desde 2025-08-01 --salida certificados
+"""
+
+import os
+import json
+import time
+import argparse
+import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from airtable_datos import cargar_tabla_entregas, credenciales_airtable_entorno
+from certificado import crear_pdf_certificado, calcular_hash_bytes, obtener_renderizador
+
+MANIFIESTO = "manifest.jsonl"
+
+
+def seleccionar_filas(df, estado=None, desde=None, hasta=None):
+    """Filtra la tabla de entregas por 'Verificado' y por rango de 'Fecha partido'."""
+    mascara = pd.Series(True, index=df.index)
+    if estado is not None:
+        mascara &= df.get('Verificado', pd.Series(index=df.index, dtype=object)) == estado
+    if desde is not None or hasta is not None:
+        fechas = pd.to_datetime(df.get('Fecha partido', pd.Series(index=df.index, dtype=object)), errors='coerce')
+        if desde is not None:
+            mascara &= fechas >= pd.Timestamp(desde)
+        if hasta is not None:
+            mascara &= fechas <= pd.Timestamp(hasta)
+    return df[mascara]
+
+
+def nombre_analista(fila):
+    """Analista del formulario si existe; si no, el primer analista vinculado."""
+    analista = fila.get('Analista(Form)')
+    if analista:
+        return analista
+    # cargar_tabla_entregas ya deja los campos vinculados como texto.
+    return fila.get('Analista') or ''
+
+
+def nombre_fichero(partido_id):
+    return f"reporte_verificado_{str(partido_id).replace(os.sep, '_')}.pdf"
+
+
+def leer_manifiesto(directorio):
+    """Devuelve {ID-partido: entrada} de los certificados ya generados y presentes en disco."""
+    ruta = os.path.join(directorio, MANIFIESTO)
+    hechos = {}
+    if not os.path.exists(ruta):
+        return hechos
+    with open(ruta, encoding="utf-8") as f:
+        for linea in f:
+            try:
+                entrada = json.loads(linea)
+            except json.JSONDecodeError:
+                # Última línea truncada por una caída a mitad de escritura.
+                continue
+            if os.path.exists(os.path.join(directorio, entrada['fichero'])):
+                hechos[entrada['id_partido']] = entrada
+    return hechos
+
+
+def _inicializar_worker():
+    # Carga plantilla, CSS y fuentes una vez por proceso.
+    obtener_renderizador()
+
+
+def _generar_certificado(fila, directorio, fecha_utc):
+    """Renderiza un certificado y lo escribe de forma atómica. Se ejecuta en un worker."""
+    partido_id = fila.get('ID-partido', 'sin_id')
+    pdf_bytes, pdf_hash = crear_pdf_certificado(fila, nombre_analista(fila), "N/A", fecha_utc=fecha_utc)
+
+    fichero = nombre_fichero(partido_id)
+    ruta = os.path.join(directorio, fichero)
+    with open(ruta + ".tmp", "wb") as f:
+        f.write(pdf_bytes)
+    os.replace(ruta + ".tmp", ruta)
+
+    return {
+        'id_partido': partido_id,
+        'rec': fila.get('Rec'),
+        'fichero': fichero,
+        'hash_pdf': pdf_hash,
+        'sha256_fichero': calcular_hash_bytes(pdf_bytes),
+        'bytes': len(pdf_bytes),
+        'fecha_utc': fecha_utc,
+    }
+
+
+def generar_lote(df, directorio, procesos=None):
+    """
+    Genera los certificados de df que no estén ya en el manifiesto.
+    Devuelve (generados, fallidos, segundos).
+    """
+    os.makedirs(directorio, exist_ok=True)
+    hechos = leer_manifiesto(directorio)
+    # Un fichero por ID-partido: con filas repetidas, dos workers escribirían el mismo .tmp.
+    df = df.drop_duplicates('ID-partido', keep='last') if 'ID-partido' in df.columns else df
+    filas = [fila.dropna().to_dict() for _, fila in df.iterrows()
+             if fila.get('ID-partido') not in hechos]
+    fecha_utc = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
+
+    generados, fallidos = 0, 0
+    inicio = time.perf_counter()
+    with open(os.path.join(directorio, MANIFIESTO), "a", encoding="utf-8") as manifiesto, \
+            ProcessPoolExecutor(max_workers=procesos, initializer=_inicializar_worker) as pool:
+        futuros = {pool.submit(_generar_certificado, fila, directorio, fecha_utc): fila for fila in filas}
+        for futuro in as_completed(futuros):
+            try:
+                entrada = futuro.result()
+            except Exception as e:
+                fallidos += 1
+                print(f"Error en {futuros[futuro].get('ID-partido')}: {e}")
+                continue
+            manifiesto.write(json.dumps(entrada, ensure_ascii=False) + "\n")
+            manifiesto.flush()
+            os.fsync(manifiesto.fileno())
+            generados += 1
+    return generados, fallidos, time.perf_counter() - inicio
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera certificados de entrega por lotes.")
+    parser.add_argument("--estado", help="Valor de 'Verificado' a seleccionar (p. ej. Pendiente)")
+    parser.add_argument("--desde", help="Fecha partido mínima (AAAA-MM-DD)")
+    parser.add_argument("--hasta", help="Fecha partido máxima (AAAA-MM-DD)")
+    parser.add_argument("--salida", default="certificados", help="Directorio de salida")
+    parser.add_argument("--procesos", type=int, default=None, help="Procesos del pool (por defecto, núcleos de CPU)")
+    args = parser.parse_args(argv)
+
+    df = cargar_tabla_entregas(*credenciales_airtable_entorno())
+    seleccion = seleccionar_filas(df, estado=args.estado, desde=args.desde, hasta=args.hasta)
+    print(f"{len(seleccion)} registros seleccionados.")
+
+    generados, fallidos, segundos = generar_lote(seleccion, args.salida, procesos=args.procesos)
+    ritmo = generados / segundos if segundos > 0 else 0.0
+    print(f"{generados} PDF generados, {fallidos} fallidos en {segundos:.1f} s ({ritmo:.2f} PDF/s).")
+    return 1 if fallidos else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Tiempos por etapa de la entrega (carga de Airtable, PDF, Drive, escrituras en
+Airtable, Gmail) como histogramas en formato de texto de Prometheus.
+
+Cada medida es un intervalo con su etapa, el ID-partido y el resultado (ok o
+el nombre de la excepción). Los histogramas solo se etiquetan con etapa y
+resultado para no crear una serie por partido; el ID-partido se conserva en
+los últimos intervalos, que muestra el panel de diagnóstico.
+
+Otros componentes pueden registrar sus contadores (p. ej. la caché de PDF) con
+registrar_fuente(); se exportan como gauges junto a los histogramas.
+
+Con ENTREGAS_METRICAS=0 medir() devuelve un contexto vacío y no se registra nada.
+"""
+
+import os
+import json
+import time
+import bisect
+import threading
+import contextlib
+from collections import deque
+
+ACTIVADO = os.environ.get("ENTREGAS_METRICAS", "1") != "0"
+PREFIJO = "entregas"
+# Límites superiores de los cubos, en segundos.
+CUBOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+RECIENTES = 200
+
+_NULO = contextlib.nullcontext()
+
+
+class Histograma:
+    """Contadores acumulados por cubo, suma y total, como un histograma de Prometheus."""
+
+    __slots__ = ('cuentas', 'suma', 'total')
+
+    def __init__(self):
+        self.cuentas = [0] * (len(CUBOS) + 1)
+        self.suma = 0.0
+        self.total = 0
+
+    def observar(self, segundos):
+        self.cuentas[bisect.bisect_left(CUBOS, segundos)] += 1
+        self.suma += segundos
+        self.total += 1
+
+    def percentil(self, p):
+        """Límite superior del cubo donde cae el percentil p (aproximado)."""
+        if not self.total:
+            return None
+        objetivo = p / 100 * self.total
+        acumulado = 0
+        for limite, cuenta in zip(CUBOS + (float('inf'),), self.cuentas):
+            acumulado += cuenta
+            if acumulado >= objetivo:
+                return limite
+        return float('inf')
+
+
+class RegistroMetricas:
+    """Histogramas por (etapa, resultado) y los últimos intervalos medidos."""
+
+    def __init__(self, activado=ACTIVADO, recientes=RECIENTES):
+        self.activado = activado
+        self._histogramas = {}
+        self._recientes = deque(maxlen=recientes)
+        self._fuentes = {}
+        self._lock = threading.Lock()
+
+    def observar(self, etapa, segundos, partido=None, resultado='ok'):
+        with self._lock:
+            histograma = self._histogramas.get((etapa, resultado))
+            if histograma is None:
+                histograma = self._histogramas[(etapa, resultado)] = Histograma()
+            histograma.observar(segundos)
+            self._recientes.append({
+                'etapa': etapa, 'partido': partido, 'resultado': resultado,
+                'segundos': segundos, 'fin': time.time(),
+            })
+
+    @contextlib.contextmanager
+    def _medir(self, etapa, partido):
+        inicio = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            self.observar(etapa, time.perf_counter() - inicio, partido, type(e).__name__)
+            raise
+        self.observar(etapa, time.perf_counter() - inicio, partido)
+
+    def medir(self, etapa, partido=None):
+        """Contexto que mide el bloque: with metricas.medir('drive', partido_id): ..."""
+        if not self.activado:
+            return _NULO
+        return self._medir(etapa, partido)
+
+    def registrar_fuente(self, nombre, funcion):
+        """funcion() devuelve {clave: número}; cada clave se exporta como entregas_<nombre>_<clave>."""
+        with self._lock:
+            self._fuentes[nombre] = funcion
+
+    def fuentes(self):
+        """{nombre: {clave: número}} de las fuentes registradas."""
+        with self._lock:
+            fuentes = dict(self._fuentes)
+        return {nombre: funcion() for nombre, funcion in sorted(fuentes.items())}
+
+    def recientes(self, n=50):
+        with self._lock:
+            return list(self._recientes)[-n:][::-1]
+
+    def resumen(self):
+        """{(etapa, resultado): {'n', 'media', 'p50', 'p95', 'p99'}} con tiempos en segundos."""
+        with self._lock:
+            return {
+                clave: {
+                    'n': h.total, 'media': h.suma / h.total,
+                    'p50': h.percentil(50), 'p95': h.percentil(95), 'p99': h.percentil(99),
+                }
+                for clave, h in sorted(self._histogramas.items())
+            }
+
+    def exportar(self):
+        """Texto en formato de exposición de Prometheus (version 0.0.4)."""
+        nombre = f"{PREFIJO}_etapa_segundos"
+        lineas = [
+            f"# HELP {nombre} Duración de cada etapa de la entrega.",
+            f"# TYPE {nombre} histogram",
+        ]
+        with self._lock:
+            for (etapa, resultado), h in sorted(self._histogramas.items()):
+                etiquetas = f'etapa="{etapa}",resultado="{resultado}"'
+                acumulado = 0
+                for limite, cuenta in zip(CUBOS, h.cuentas):
+                    acumulado += cuenta
+                    lineas.append(f'{nombre}_bucket{{{etiquetas},le="{limite:g}"}} {acumulado}')
+                lineas.append(f'{nombre}_bucket{{{etiquetas},le="+Inf"}} {h.total}')
+                lineas.append(f'{nombre}_sum{{{etiquetas}}} {h.suma:.6f}')
+                lineas.append(f'{nombre}_count{{{etiquetas}}} {h.total}')
+        for fuente, valores in self.fuentes().items():
+            for clave, valor in sorted(valores.items()):
+                if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+                    lineas.append(f"# TYPE {PREFIJO}_{fuente}_{clave} gauge")
+                    lineas.append(f"{PREFIJO}_{fuente}_{clave} {valor}")
+        return "\n".join(lineas) + "\n"
+
+
+metricas = RegistroMetricas()
+
+
+def medir(etapa, partido=None):
+    """Atajo sobre el registro global."""
+    return metricas.medir(etapa, partido)
+
+
+def iniciar_servidor_metricas(puerto, host="0.0.0.0", disponibilidad=None):
+    """
+    Sirve /metrics en un hilo aparte (Streamlit no permite rutas propias).
+    disponibilidad: función opcional que devuelve un dict con 'listo'; se sirve
+    en /ready con 200 si está listo y 503 si no.
+    """
+    # http.server arrastra email y html: solo se importa si se sirve el endpoint.
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class ManejadorMetricas(BaseHTTPRequestHandler):
+
+        def log_message(self, *args):
+            pass
+
+        def _enviar(self, estado, datos, tipo):
+            self.send_response(estado)
+            self.send_header("Content-Type", tipo)
+            self.send_header("Content-Length", str(len(datos)))
+            self.end_headers()
+            self.wfile.write(datos)
+
+        def do_GET(self):
+            ruta = self.path.split("?")[0]
+            if ruta == "/metrics":
+                self._enviar(200, metricas.exportar().encode(), "text/plain; version=0.0.4; charset=utf-8")
+            elif ruta == "/ready" and disponibilidad is not None:
+                estado = disponibilidad()
+                self._enviar(200 if estado.get('listo') else 503, json.dumps(estado).encode(), "application/json")
+            else:
+                self.send_error(404)
+
+    servidor = ThreadingHTTPServer((host, puerto), ManejadorMetricas)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name="metricas-http", daemon=True).start()
+    return servidor
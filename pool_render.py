@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""
+Pool de procesos renderizadores de certificados.
+
+WeasyPrint es CPU puro y, dentro del proceso de Streamlit, todos los
+operadores compiten por el mismo GIL (y por el lock del renderizador). El pool
+arranca N procesos de larga vida; cada uno carga al arrancar las fuentes, el
+CSS y la plantilla (RenderizadorCertificado.precalentar) y se queda esperando
+HTML que convertir. El HTML se sigue generando en el proceso principal (Jinja,
+barato); al worker solo viaja la cadena, y el PDF vuelve por memoria
+compartida: por la tubería de cada worker solo pasan su nombre y su tamaño.
+
+La cola está acotada: con max_cola renders pendientes, renderizar() espera
+hasta 'espera' segundos y después lanza PoolOcupado, así que la interfaz puede
+avisar en lugar de quedarse colgada. Si un worker muere, sus renders fallan y
+se arranca otro en su lugar.
+
+Memoria: cada worker es un intérprete completo con WeasyPrint, Pango,
+fontconfig y las fuentes cargadas, más el documento que esté renderizando, y
+la app y server.py arrancan cada uno su propio pool. Por eso PROCESOS se
+limita a los núcleos que el contenedor deja usar (afinidad y cuota de cgroup)
+y como mucho a PROCESOS_MAXIMO; estadisticas() da el RSS real de los workers
+(memoria_mb) para dimensionar ENTREGAS_RENDER_PROCESOS.
+"""
+
+import os
+import math
+import itertools
+import threading
+import multiprocessing
+from multiprocessing import connection, shared_memory
+from concurrent.futures import Future
+
+from metricas import medir
+
+# spawn también en Linux: el proceso principal tiene hilos (Streamlit, colas)
+# y hacer fork con hilos vivos puede dejar locks tomados en el hijo.
+CONTEXTO = multiprocessing.get_context("spawn")
+ARRANQUE_MAXIMO = 120
+# Por defecto, pocos workers aunque haya muchos núcleos: hay un pool por proceso (app y server.py).
+PROCESOS_MAXIMO = 2
+
+
+def nucleos_disponibles():
+    """Núcleos que puede usar este proceso: afinidad (cpuset) y, si la hay, la cuota de CPU de cgroup v2."""
+    try:
+        nucleos = len(os.sched_getaffinity(0))
+    except AttributeError:
+        nucleos = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            cuota, periodo = f.read().split()
+        if cuota != "max":
+            nucleos = min(nucleos, math.ceil(int(cuota) / int(periodo)))
+    except (OSError, ValueError):
+        pass
+    return max(nucleos, 1)
+
+
+# Workers del pool; 0 renderiza en el propio proceso, como antes.
+PROCESOS = int(os.environ.get("ENTREGAS_RENDER_PROCESOS", min(nucleos_disponibles(), PROCESOS_MAXIMO)))
+
+
+class PoolOcupado(RuntimeError):
+    """La cola de renders está llena."""
+
+
+def crear_pool(procesos=PROCESOS):
+    """PoolRenderizado ya arrancado, o None si la configuración pide renderizar en el propio proceso."""
+    if procesos <= 0:
+        return None
+    return PoolRenderizado(procesos).iniciar()
+
+
+def _worker(tareas, conexion):
+    # Los resultados van por una tubería propia y send() es síncrono: si el
+    # proceso muere a mitad de un render, el aviso de 'tomada' ya ha llegado.
+    from certificado import obtener_renderizador
+    renderizador = obtener_renderizador()
+    renderizador.cache = None  # la caché se consulta en el proceso principal
+    try:
+        renderizador.precalentar()
+    except Exception as e:
+        conexion.send(('arranque_fallido', None, f"{type(e).__name__}: {e}"))
+        return
+    conexion.send(('listo', None, None))
+    for tarea_id, html_out in iter(tareas.get, None):
+        conexion.send(('tomada', tarea_id, None))
+        try:
+            pdf = renderizador.html_a_pdf(html_out, usar_cache=False)
+            memoria = shared_memory.SharedMemory(create=True, size=len(pdf))
+            memoria.buf[:len(pdf)] = pdf
+            nombre = memoria.name
+            # Se cierra sin unlink: el proceso principal la lee y la libera.
+            memoria.close()
+        except Exception as e:
+            conexion.send(('error', tarea_id, f"{type(e).__name__}: {e}"))
+        else:
+            conexion.send(('hecho', tarea_id, (nombre, len(pdf))))
+
+
+class PoolRenderizado:
+    """
+    procesos: workers (por defecto PROCESOS: ENTREGAS_RENDER_PROCESOS, o los núcleos
+        disponibles hasta PROCESOS_MAXIMO).
+    max_cola: renders admitidos a la vez entre en cola y en curso (por defecto 2 por worker).
+    """
+
+    def __init__(self, procesos=None, max_cola=None):
+        self.procesos = procesos or PROCESOS or 1
+        self.max_cola = max_cola or 2 * self.procesos
+        self._tareas = CONTEXTO.Queue()
+        self._huecos = threading.BoundedSemaphore(self.max_cola)
+        self._futuros = {}
+        self._en_curso = {}
+        self._workers = {}
+        self._listos = set()
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._todos_listos = threading.Event()
+        self._parar = threading.Event()
+        self._hilo = None
+        self.error_arranque = None
+        self.metricas = {'renders': 0, 'errores': 0, 'rechazados': 0, 'reinicios': 0}
+
+    def _arrancar_worker(self):
+        lectura, escritura = CONTEXTO.Pipe(duplex=False)
+        proceso = CONTEXTO.Process(target=_worker, args=(self._tareas, escritura),
+                                   name="renderizador", daemon=True)
+        proceso.start()
+        escritura.close()
+        self._workers[proceso.pid] = (proceso, lectura)
+
+    def iniciar(self):
+        if self._hilo is None:
+            for _ in range(self.procesos):
+                self._arrancar_worker()
+            self._hilo = threading.Thread(target=self._bucle, name="pool-render", daemon=True)
+            self._hilo.start()
+        return self
+
+    def esperar_listo(self, timeout=ARRANQUE_MAXIMO):
+        """Espera a que todos los workers hayan cargado fuentes y plantilla."""
+        return self._todos_listos.wait(timeout)
+
+    def parar(self):
+        self._parar.set()
+        for _ in self._workers:
+            self._tareas.put(None)
+
+    def renderizar(self, html_out, espera=30):
+        """
+        Encola el HTML y devuelve un Future con los bytes del PDF.
+        Lanza PoolOcupado si en 'espera' segundos no queda hueco en la cola.
+        """
+        if self.error_arranque:
+            raise RuntimeError(f"El renderizador no pudo arrancar: {self.error_arranque}")
+        if not self._huecos.acquire(timeout=espera):
+            with self._lock:
+                self.metricas['rechazados'] += 1
+            raise PoolOcupado(f"Hay {self.max_cola} certificados en cola; inténtalo en unos segundos.")
+        futuro = Future()
+        tarea_id = next(self._ids)
+        with self._lock:
+            self._futuros[tarea_id] = futuro
+        self._tareas.put((tarea_id, html_out))
+        return futuro
+
+    def html_a_pdf(self, html_out, espera=30):
+        with medir('pdf_pool'):
+            return self.renderizar(html_out, espera).result()
+
+    def _terminar(self, tarea_id, resultado=None, error=None):
+        with self._lock:
+            futuro = self._futuros.pop(tarea_id, None)
+            if futuro is None:
+                return
+            self.metricas['errores' if error else 'renders'] += 1
+        self._huecos.release()
+        if error:
+            futuro.set_exception(RuntimeError(error))
+        else:
+            futuro.set_result(resultado)
+
+    @staticmethod
+    def _leer_memoria(nombre, tamano):
+        memoria = shared_memory.SharedMemory(name=nombre)
+        try:
+            return bytes(memoria.buf[:tamano])
+        finally:
+            memoria.close()
+            memoria.unlink()
+
+    def _atender(self, pid, tipo, clave, datos):
+        if tipo == 'listo':
+            self._listos.add(pid)
+            if len(self._listos) >= self.procesos:
+                self._todos_listos.set()
+        elif tipo == 'arranque_fallido':
+            # Sin WeasyPrint no hay nada que hacer: se deja de esperar y cada render fallará.
+            self.error_arranque = datos
+            self._todos_listos.set()
+            self.parar()
+            with self._lock:
+                pendientes = list(self._futuros)
+            for tarea_id in pendientes:
+                self._terminar(tarea_id, error=f"El renderizador no pudo arrancar: {datos}")
+        elif tipo == 'tomada':
+            self._en_curso[pid] = clave
+        elif tipo == 'hecho':
+            self._en_curso.pop(pid, None)
+            try:
+                pdf = self._leer_memoria(*datos)
+            except Exception as e:
+                self._terminar(clave, error=f"{type(e).__name__}: {e}")
+            else:
+                self._terminar(clave, resultado=pdf)
+        elif tipo == 'error':
+            self._en_curso.pop(pid, None)
+            self._terminar(clave, error=datos)
+
+    def _retirar(self, pid):
+        """Falla el render del worker muerto y arranca otro en su lugar."""
+        proceso, lectura = self._workers.pop(pid)
+        proceso.join(1)
+        lectura.close()
+        self._listos.discard(pid)
+        tarea_id = self._en_curso.pop(pid, None)
+        if tarea_id is not None:
+            self._terminar(tarea_id, error=f"El renderizador {pid} terminó (código {proceso.exitcode})")
+        if not self._parar.is_set():
+            with self._lock:
+                self.metricas['reinicios'] += 1
+            self._arrancar_worker()
+
+    def _bucle(self):
+        while not self._parar.is_set():
+            esperas = {}
+            for pid, (proceso, lectura) in self._workers.items():
+                esperas[lectura] = pid
+                esperas[proceso.sentinel] = pid
+            muertos = set()
+            for listo in connection.wait(list(esperas), timeout=1):
+                pid = esperas[listo]
+                lectura = self._workers[pid][1]
+                # Se vacía la tubería antes de dar el worker por muerto: puede haber
+                # terminado un render justo antes de caerse.
+                try:
+                    while lectura.poll():
+                        self._atender(pid, *lectura.recv())
+                except (EOFError, OSError):
+                    muertos.add(pid)
+                if listo is not lectura:
+                    muertos.add(pid)
+            for pid in muertos:
+                if pid in self._workers:
+                    self._retirar(pid)
+
+    @staticmethod
+    def _memoria_mb(pid):
+        # RSS de /proc (Linux); en otros sistemas no se informa.
+        try:
+            with open(f"/proc/{pid}/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def estadisticas(self):
+        with self._lock:
+            datos = dict(self.metricas, procesos=len(self._workers), en_cola=len(self._futuros),
+                         max_cola=self.max_cola, listos=len(self._listos))
+        memoria = [self._memoria_mb(pid) for pid in list(self._workers)]
+        if memoria and None not in memoria:
+            datos['memoria_mb'] = round(sum(memoria), 1)
+        return datos
@@ -0,0 +1,438 @@
+# -*- coding: utf-8 -*-
+"""
+API HTTP (WSGI) de entregas para clientes que no pasan por Streamlit, como la
+app de las tabletas. Es la app que arranca el Procfile (server:app).
+
+    POST /entregas                     {"partido" o "rec", "analista", "mail"}
+                                       -> 202 {"id", "estado", "url"}, o 200 con
+                                          "duplicado": true si ya estaba pedida
+    GET  /entregas/<id>                estado del trabajo y resultado
+    GET  /entregas/<id>/certificado    PDF del certificado (desde Drive)
+    POST /entregas/<id>/reintentar     vuelve a encolar una entrega en error
+    GET  /confirmar?token=...          página con el botón de confirmación
+    POST /confirmar                    confirma la entrega (token=... en el formulario)
+    GET  /ready                        200 cuando el calentamiento ha terminado
+    GET  /metrics                      histogramas en formato Prometheus
+
+Las rutas de /entregas exigen "Authorization: Bearer <ENTREGAS_API_TOKEN>";
+las de /confirmar no, el token del enlace hace de credencial. La confirmación
+va por POST porque los filtros de correo abren los enlaces (GET) por su cuenta.
+Usa la misma cola, el mismo pipeline y los mismos clientes que el formulario,
+sin ninguna llamada st.*. Los secretos se leen de variables de entorno o, si
+faltan, de .streamlit/secrets.toml (los mismos que usa la app de Streamlit).
+"""
+
+import os
+import re
+import json
+import hmac
+import html
+import threading
+import traceback
+import urllib.parse
+
+from metricas import metricas, medir
+from arranque import Calentamiento
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SECRETS_PATH = os.path.join(BASE_DIR, ".streamlit", "secrets.toml")
+SCOPES = ['https://www.googleapis.com/auth/gmail.send', 'https://www.googleapis.com/auth/drive']
+DRIVE_FOLDER_ID = os.environ.get("DRIVE_FOLDER_ID", "1yNFgOvRclge1SY9QtvnD980f3-4In_hs")
+MAX_CUERPO = 64 * 1024
+
+RUTA_TRABAJO = re.compile(r'^/entregas/([0-9a-f]{32})$')
+RUTA_CERTIFICADO = re.compile(r'^/entregas/([0-9a-f]{32})/certificado$')
+RUTA_REINTENTAR = re.compile(r'^/entregas/([0-9a-f]{32})/reintentar$')
+
+
+class ErrorApi(Exception):
+    def __init__(self, estado, mensaje):
+        super().__init__(mensaje)
+        self.estado = estado
+        self.mensaje = mensaje
+
+
+def leer_secretos(ruta=SECRETS_PATH):
+    """
+    Secretos de la app: AIRTABLE_API_KEY, AIRTABLE_BASE_ID, google_creds,
+    ENTREGAS_API_TOKEN y ENTREGAS_URL_PUBLICA. Las variables de entorno mandan sobre secrets.toml;
+    google_creds va en GOOGLE_CREDS como JSON.
+    """
+    secretos = {}
+    if os.path.exists(ruta):
+        try:
+            import tomllib
+        except ModuleNotFoundError:  # Python < 3.11: toml llega con streamlit
+            import toml
+            secretos.update(toml.load(ruta))
+        else:
+            with open(ruta, "rb") as f:
+                secretos.update(tomllib.load(f))
+    for clave in ("AIRTABLE_API_KEY", "AIRTABLE_BASE_ID", "ENTREGAS_API_TOKEN", "ENTREGAS_URL_PUBLICA"):
+        if os.environ.get(clave):
+            secretos[clave] = os.environ[clave]
+    if os.environ.get("GOOGLE_CREDS"):
+        secretos["google_creds"] = json.loads(os.environ["GOOGLE_CREDS"])
+    return secretos
+
+
+class Servicios:
+    """
+    Cola, pipeline y clientes compartidos por todas las peticiones del proceso,
+    creados la primera vez que se piden (como los st.cache_resource de la app).
+    """
+
+    def __init__(self, secretos):
+        self.secretos = secretos
+        self._lock = threading.RLock()
+        self._gestor = None
+        self._cache = None
+        self._escritor = None
+        self._tokens = None
+        self._confirmador = None
+        self._cola = None
+        self._buzon = None
+        self._pool = None
+        self._pool_creado = False
+
+    def gestor(self):
+        with self._lock:
+            if self._gestor is None:
+                from google_servicios import GestorCredenciales
+                creds_info = self.secretos.get("google_creds")
+                if not creds_info or "refresh_token" not in creds_info:
+                    raise RuntimeError("Faltan las credenciales de Google (google_creds / GOOGLE_CREDS).")
+                self._gestor = GestorCredenciales(creds_info, SCOPES).iniciar()
+            return self._gestor
+
+    def servicio(self, api, version):
+        from google_servicios import obtener_registro
+        return obtener_registro().servicio(api, version, self.gestor().credenciales())
+
+    def _cliente_airtable(self):
+        from airtable_datos import crear_cliente_airtable
+        return crear_cliente_airtable(self.secretos["AIRTABLE_BASE_ID"], self.secretos["AIRTABLE_API_KEY"])
+
+    def cache(self):
+        with self._lock:
+            if self._cache is None:
+                from airtable_datos import CAMPOS_FORMULARIO, EspejoAirtable, CacheEntregas
+                self._cache = CacheEntregas(EspejoAirtable(self._cliente_airtable(), campos=CAMPOS_FORMULARIO), ttl=600)
+                metricas.registrar_fuente('cache_entregas', self._cache.estadisticas)
+            return self._cache
+
+    def escritor(self):
+        with self._lock:
+            if self._escritor is None:
+                from airtable_datos import EscritorAirtable
+                self._escritor = EscritorAirtable(self._cliente_airtable()).iniciar()
+                metricas.registrar_fuente('escritor_airtable', self._escritor.estadisticas)
+            return self._escritor
+
+    def tokens(self):
+        with self._lock:
+            if self._tokens is None:
+                from confirmaciones import IndiceTokens
+                self._tokens = IndiceTokens()
+            return self._tokens
+
+    def confirmador(self):
+        with self._lock:
+            if self._confirmador is None:
+                from confirmaciones import Confirmador
+                self._confirmador = Confirmador(self.tokens(), self.escritor(),
+                                                al_actualizar=self.cache().aplicar_actualizacion).iniciar()
+            return self._confirmador
+
+    def cola(self):
+        with self._lock:
+            if self._cola is None:
+                from google_servicios import AgrupadorPermisos
+                from cola_entregas import ColaTrabajos, PipelineEntrega
+                obtener_drive = lambda: self.servicio('drive', 'v3')
+                url_publica = self.secretos.get("ENTREGAS_URL_PUBLICA")
+                pipeline = PipelineEntrega(
+                    self.escritor(),
+                    obtener_drive,
+                    DRIVE_FOLDER_ID,
+                    al_actualizar=self.cache().aplicar_actualizacion,
+                    permisos=AgrupadorPermisos(obtener_drive).iniciar(),
+                    tokens=self.tokens(),
+                    buzon=self.buzon() if url_publica else None,
+                    url_publica=url_publica
+                )
+                from bloqueos import crear_bloqueos
+                workers = int(os.environ.get("ENTREGAS_WORKERS", "4"))
+                self._cola = ColaTrabajos(pipeline, workers=workers, bloqueos=crear_bloqueos()).iniciar()
+            return self._cola
+
+    def buzon(self):
+        with self._lock:
+            if self._buzon is None:
+                from correo import BuzonSalida
+                cuota = int(os.environ.get("GMAIL_CUOTA_MINUTO", "60"))
+                self._buzon = BuzonSalida(lambda: self.servicio('gmail', 'v1'), cuota_por_minuto=cuota).iniciar()
+            return self._buzon
+
+    def pool(self):
+        with self._lock:
+            if not self._pool_creado:
+                from pool_render import crear_pool
+                self._pool = crear_pool()
+                self._pool_creado = True
+            return self._pool
+
+    def calentar(self):
+        from certificado import usar_pool
+        from google_servicios import obtener_registro
+
+        def google():
+            obtener_registro().documento('gmail', 'v1')
+            obtener_registro().documento('drive', 'v3')
+            self.gestor().credenciales()
+
+        return Calentamiento([
+            ('pdf', lambda: usar_pool(self.pool()).precalentar()),
+            ('google', google),
+            ('datos', lambda: self.cache().tabla()),
+            ('servicios', lambda: (self.cola(), self.buzon())),
+            # Tokens 'Pendiente' que aún no estén en el índice (sale de la foto local) y purga de los caducados.
+            ('tokens', lambda: (self.tokens().reconstruir(self.cache().tabla().df), self.tokens().purgar(),
+                                self.confirmador())),
+        ]).iniciar()
+
+
+class ApiEntregas:
+    """Aplicación WSGI."""
+
+    def __init__(self, servicios, token=None, calentar=True):
+        self.servicios = servicios
+        self.token = token
+        self.calentamiento = servicios.calentar() if calentar else None
+
+    # --- Utilidades HTTP ---
+
+    def _json(self, start_response, estado, cuerpo, cabeceras=()):
+        datos = json.dumps(cuerpo, default=str, ensure_ascii=False).encode()
+        start_response(ESTADOS[estado], [("Content-Type", "application/json; charset=utf-8"),
+                                         ("Content-Length", str(len(datos))), *cabeceras])
+        return [datos]
+
+    def _autorizar(self, environ):
+        if not self.token:
+            raise ErrorApi(503, "La API no tiene token configurado (ENTREGAS_API_TOKEN).")
+        cabecera = environ.get("HTTP_AUTHORIZATION", "")
+        if not hmac.compare_digest(cabecera.encode(), f"Bearer {self.token}".encode()):
+            raise ErrorApi(401, "Token no válido.")
+
+    def _leer_json(self, environ):
+        try:
+            longitud = int(environ.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            longitud = 0
+        if longitud <= 0:
+            raise ErrorApi(400, "Falta el cuerpo JSON.")
+        if longitud > MAX_CUERPO:
+            raise ErrorApi(413, "Cuerpo demasiado grande.")
+        try:
+            datos = json.loads(environ["wsgi.input"].read(longitud))
+        except ValueError:
+            raise ErrorApi(400, "El cuerpo no es JSON válido.")
+        if not isinstance(datos, dict):
+            raise ErrorApi(400, "El cuerpo debe ser un objeto JSON.")
+        return datos
+
+    # --- Rutas ---
+
+    def crear_entrega(self, environ):
+        from cola_entregas import datos_entrega, clave_idempotencia
+        from correo import es_mail_valido
+
+        datos = self._leer_json(environ)
+        tabla = self.servicios.cache().tabla()
+        if datos.get("partido"):
+            fila = tabla.fila(datos["partido"])
+        elif datos.get("rec") and 'Rec' in tabla.df.columns:
+            filas = tabla.df[tabla.df['Rec'] == datos["rec"]]
+            fila = filas.iloc[0] if len(filas) else None
+        else:
+            raise ErrorApi(400, "Indica 'partido' (ID-partido) o 'rec'.")
+        if fila is None:
+            raise ErrorApi(404, "No existe el partido o registro indicado.")
+
+        # Como en el formulario: por defecto, el analista y el mail de la fila.
+        analista = datos.get("analista") or fila.get('Analista', '')
+        mail = datos.get("mail") or fila.get('Mail', '')
+        if not analista or not mail:
+            raise ErrorApi(400, "El nombre del analista y el correo son obligatorios.")
+        if not es_mail_valido(mail):
+            raise ErrorApi(400, "La dirección de correo no es válida.")
+        if not fila.get('Rec'):
+            raise ErrorApi(422, "El registro no tiene 'Rec'.")
+
+        cola = self.servicios.cola()
+        trabajo_id, nuevo = cola.encolar_o_unir(datos_entrega(fila, analista, mail), clave=fila.get('Rec'),
+                                                idempotencia=clave_idempotencia(fila.get('Rec'), analista, mail))
+        if nuevo:
+            return 202, {"id": trabajo_id, "estado": "en_cola", "url": f"/entregas/{trabajo_id}"}
+        # La misma entrega ya estaba pedida: se devuelve ese trabajo, no se repite.
+        return 200, {"id": trabajo_id, "estado": cola.estado(trabajo_id)['estado'], "url": f"/entregas/{trabajo_id}",
+                     "duplicado": True}
+
+    def estado_entrega(self, trabajo_id):
+        trabajo = self.servicios.cola().estado(trabajo_id)
+        if trabajo is None:
+            raise ErrorApi(404, "Trabajo no encontrado.")
+        return 200, trabajo
+
+    def reintentar(self, trabajo_id):
+        cola = self.servicios.cola()
+        trabajo = cola.estado(trabajo_id)
+        if trabajo is None:
+            raise ErrorApi(404, "Trabajo no encontrado.")
+        if not cola.reintentar(trabajo_id):
+            raise ErrorApi(409, f"Solo se reintentan entregas en error (estado: {trabajo['estado']}).")
+        return 202, {"id": trabajo_id, "estado": "en_cola", "url": f"/entregas/{trabajo_id}"}
+
+    def certificado(self, trabajo_id):
+        from cola_entregas import COMPLETADO
+        from google_servicios import descargar_de_drive
+
+        trabajo = self.servicios.cola().estado(trabajo_id)
+        if trabajo is None:
+            raise ErrorApi(404, "Trabajo no encontrado.")
+        if trabajo['estado'] != COMPLETADO:
+            raise ErrorApi(409, f"La entrega todavía no tiene certificado (estado: {trabajo['estado']}).")
+        with medir('api_certificado'):
+            return descargar_de_drive(self.servicios.servicio('drive', 'v3'), trabajo['resultado']['drive_id'])
+
+    def _pagina(self, start_response, estado, titulo, mensaje, token=None):
+        """Página HTML mínima para quien abre el enlace del correo; con token, lleva el botón de confirmar."""
+        formulario = ""
+        if token:
+            formulario = (
+                '<form method="post" action="/confirmar">'
+                f'<input type="hidden" name="token" value="{html.escape(token)}">'
+                '<button type="submit">Confirmar entrega</button></form>'
+            )
+        datos = (
+            '<!DOCTYPE html><html lang="es"><head><meta charset="utf-8">'
+            f'<meta name="viewport" content="width=device-width, initial-scale=1"><title>{html.escape(titulo)}</title></head>'
+            f'<body><h1>{html.escape(titulo)}</h1><p>{html.escape(mensaje)}</p>{formulario}</body></html>'
+        ).encode()
+        start_response(ESTADOS[estado], [("Content-Type", "text/html; charset=utf-8"),
+                                         ("Content-Length", str(len(datos))), ("Cache-Control", "no-store")])
+        return [datos]
+
+    def _token_confirmacion(self, environ):
+        consulta = urllib.parse.parse_qs(environ.get("QUERY_STRING", ""))
+        if environ.get("REQUEST_METHOD") == "POST":
+            try:
+                longitud = min(int(environ.get("CONTENT_LENGTH") or 0), MAX_CUERPO)
+            except ValueError:
+                longitud = 0
+            if longitud > 0:
+                consulta.update(urllib.parse.parse_qs(environ["wsgi.input"].read(longitud).decode("utf-8", "replace")))
+        return (consulta.get("token") or [""])[0].strip()
+
+    def confirmar(self, environ, start_response):
+        from confirmaciones import CONFIRMADO, YA_CONFIRMADO, CADUCADO
+
+        token = self._token_confirmacion(environ)
+        if not token:
+            return self._pagina(start_response, 400, "Enlace incompleto", "Falta el código de confirmación.")
+        if environ.get("REQUEST_METHOD") == "POST":
+            with medir('confirmacion'):
+                estado, _ = self.servicios.confirmador().confirmar(token)
+        else:
+            estado, _ = self.servicios.tokens().consultar(token)
+            if estado is None:
+                return self._pagina(start_response, 200, "Confirmar entrega",
+                                    "Pulsa el botón para confirmar la recepción de la tarjeta SD.", token)
+        if estado in (CONFIRMADO, YA_CONFIRMADO):
+            return self._pagina(start_response, 200, "Entrega confirmada",
+                                "La recepción de la tarjeta SD ha quedado registrada. Gracias.")
+        if estado == CADUCADO:
+            return self._pagina(start_response, 410, "Enlace caducado",
+                                "El enlace ha caducado; pide al piloto que vuelva a enviarlo.")
+        return self._pagina(start_response, 404, "Enlace no válido", "El código de confirmación no existe.")
+
+    # --- Despacho ---
+
+    def __call__(self, environ, start_response):
+        metodo = environ.get("REQUEST_METHOD", "GET")
+        ruta = environ.get("PATH_INFO", "/").rstrip("/") or "/"
+        try:
+            if ruta == "/ready" and metodo == "GET":
+                estado = self.calentamiento.estado() if self.calentamiento else {'listo': True}
+                return self._json(start_response, 200 if estado['listo'] else 503, estado)
+            if ruta == "/metrics" and metodo == "GET":
+                datos = metricas.exportar().encode()
+                start_response(ESTADOS[200], [("Content-Type", "text/plain; version=0.0.4; charset=utf-8"),
+                                              ("Content-Length", str(len(datos)))])
+                return [datos]
+
+            if ruta == "/confirmar":
+                if metodo not in ("GET", "POST"):
+                    raise ErrorApi(405, "Usa GET o POST.")
+                return self.confirmar(environ, start_response)
+
+            if ruta == "/entregas":
+                if metodo != "POST":
+                    raise ErrorApi(405, "Usa POST para crear una entrega.")
+                self._autorizar(environ)
+                with medir('api_crear'):
+                    estado, cuerpo = self.crear_entrega(environ)
+                return self._json(start_response, estado, cuerpo, [("Location", cuerpo["url"])])
+
+            coincidencia = RUTA_TRABAJO.match(ruta)
+            if coincidencia:
+                if metodo != "GET":
+                    raise ErrorApi(405, "Usa GET.")
+                self._autorizar(environ)
+                return self._json(start_response, *self.estado_entrega(coincidencia.group(1)))
+
+            coincidencia = RUTA_REINTENTAR.match(ruta)
+            if coincidencia:
+                if metodo != "POST":
+                    raise ErrorApi(405, "Usa POST.")
+                self._autorizar(environ)
+                return self._json(start_response, *self.reintentar(coincidencia.group(1)))
+
+            coincidencia = RUTA_CERTIFICADO.match(ruta)
+            if coincidencia:
+                if metodo != "GET":
+                    raise ErrorApi(405, "Usa GET.")
+                self._autorizar(environ)
+                trabajo_id = coincidencia.group(1)
+                pdf = self.certificado(trabajo_id)
+                start_response(ESTADOS[200], [
+                    ("Content-Type", "application/pdf"),
+                    ("Content-Length", str(len(pdf))),
+                    ("Content-Disposition", f'attachment; filename="certificado_{trabajo_id}.pdf"'),
+                ])
+                return [pdf]
+
+            raise ErrorApi(404, "Ruta no encontrada.")
+        except ErrorApi as e:
+            return self._json(start_response, e.estado, {"error": e.mensaje})
+        except Exception:
+            # El detalle (rutas, ids, respuestas de Google o Airtable) va al log del servidor, no al cliente.
+            traceback.print_exc(file=environ.get('wsgi.errors'))
+            return self._json(start_response, 500, {"error": "Error interno del servidor."})
+
+
+ESTADOS = {
+    200: "200 OK", 202: "202 Accepted", 400: "400 Bad Request", 401: "401 Unauthorized",
+    404: "404 Not Found", 405: "405 Method Not Allowed", 409: "409 Conflict", 410: "410 Gone",
+    413: "413 Payload Too Large", 422: "422 Unprocessable Entity", 500: "500 Internal Server Error",
+    503: "503 Service Unavailable",
+}
+
+
+def crear_app(secretos=None, calentar=True):
+    secretos = leer_secretos() if secretos is None else secretos
+    return ApiEntregas(Servicios(secretos), token=secretos.get("ENTREGAS_API_TOKEN"), calentar=calentar)
+
+
+app = crear_app()
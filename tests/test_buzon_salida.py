@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Dos BuzonSalida sobre el mismo fichero (la app y server.py): ningún correo
+se envía dos veces y los reclamos se liberan o caducan.
+
+Uso: python -m unittest discover tests
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from correo import BuzonSalida, PENDIENTE, ENVIANDO, ENVIADO
+
+
+class GmailFalso:
+    """Lo justo de la API de Gmail para BuzonSalida: batch con send por mensaje."""
+
+    def __init__(self, enviados, lock, latencia=0.01):
+        self.enviados = enviados
+        self.lock = lock
+        self.latencia = latencia
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def send(self, userId, body):
+        return body
+
+    def new_batch_http_request(self, callback):
+        gmail = self
+
+        class Lote:
+            def __init__(self):
+                self.peticiones = []
+
+            def add(self, peticion, request_id):
+                self.peticiones.append(request_id)
+
+            def execute(self):
+                time.sleep(gmail.latencia)
+                for request_id in self.peticiones:
+                    with gmail.lock:
+                        gmail.enviados.append(request_id)
+                    callback(request_id, {'id': f"gmail-{request_id}"}, None)
+
+        return Lote()
+
+
+class TestBuzonCompartido(unittest.TestCase):
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp(prefix="test_buzon_")
+        self.ruta = os.path.join(self.directorio, "buzon.sqlite")
+        self.enviados = []
+        self.lock = threading.Lock()
+
+    def tearDown(self):
+        shutil.rmtree(self.directorio, ignore_errors=True)
+
+    def _buzon(self, obtener_gmail=None):
+        gmail = GmailFalso(self.enviados, self.lock)
+        return BuzonSalida(obtener_gmail or (lambda: gmail), ruta=self.ruta, cuota_por_minuto=600000, lote=5)
+
+    def test_dos_buzones_no_envian_el_mismo_correo(self):
+        buzones = [self._buzon(), self._buzon()]
+        ids = [buzones[i % 2].encolar(f"a{i}@example.com", "asunto", {'raw': str(i)}) for i in range(40)]
+        barrera = threading.Barrier(len(buzones))
+
+        def vaciar(buzon):
+            barrera.wait()
+            while buzon.enviar_pendientes():
+                pass
+
+        hilos = [threading.Thread(target=vaciar, args=(buzon,)) for buzon in buzones]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join(30)
+
+        repetidos = {correo_id: n for correo_id, n in Counter(self.enviados).items() if n > 1}
+        self.assertEqual(repetidos, {})
+        self.assertEqual(sorted(self.enviados, key=int), [str(i) for i in ids])
+        self.assertEqual(buzones[0].contar(), {ENVIADO: len(ids)})
+
+    def test_fallo_antes_de_enviar_libera_el_reclamo(self):
+        def sin_credenciales():
+            raise RuntimeError("sin credenciales")
+
+        roto = self._buzon(sin_credenciales)
+        correo_id = roto.encolar("a@example.com", "asunto", {'raw': 'x'})
+        with self.assertRaises(RuntimeError):
+            roto.enviar_pendientes()
+        self.assertEqual(roto.estado(correo_id)['estado'], PENDIENTE)
+
+        self.assertEqual(self._buzon().enviar_pendientes(), 1)
+        self.assertEqual(self.enviados, [str(correo_id)])
+
+    def test_reclamo_caducado_lo_toma_otro_buzon(self):
+        caido = self._buzon()
+        correo_id = caido.encolar("a@example.com", "asunto", {'raw': 'x'})
+        # Un proceso que reclama y muere sin registrar el envío.
+        self.assertEqual(len(caido._reclamar(caido.lote)), 1)
+        self.assertEqual(caido.estado(correo_id)['estado'], ENVIANDO)
+
+        otro = self._buzon()
+        self.assertEqual(otro.enviar_pendientes(), 0)
+        with caido._conectar() as conn:
+            conn.execute("UPDATE correos SET reclamado_hasta = 0 WHERE id = ?", (correo_id,))
+        self.assertEqual(otro.enviar_pendientes(), 1)
+        self.assertEqual(otro.estado(correo_id)['estado'], ENVIADO)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Una base creada antes de 'Fecha_UTC', 'SHA256_PDF' y 'Drive_ID': la carga del
+formulario, las escrituras de la entrega, la exportación y la auditoría siguen
+funcionando sin esas columnas.
+
+Uso: python -m unittest discover tests
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.join(RAIZ, "benchmarks"))
+
+from airtable_datos import (TABLA_ENTREGAS, CAMPOS_FORMULARIO, CAMPOS_OPCIONALES, EspejoAirtable, EscritorAirtable,
+                            crear_cliente_airtable, dataframe_desde_paginas, leer_registros_paginados)
+from confirmaciones import IndiceTokens
+from exportar_entregas import CAMPOS_EXPORTACION
+from verificar_certificados import CAMPOS_AUDITORIA, registros_auditables
+from fixtures_entregas import registros_entregas
+from servidores_falsos import ServidorAirtableFalso
+
+
+class TestBaseSinCamposOpcionales(unittest.TestCase):
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp(prefix="test_campos_")
+        self.registros = registros_entregas(15)
+        columnas = set(CAMPOS_FORMULARIO + CAMPOS_EXPORTACION + CAMPOS_AUDITORIA) - set(CAMPOS_OPCIONALES)
+        self.servidor = ServidorAirtableFalso({TABLA_ENTREGAS: self.registros}, campos=columnas).arrancar()
+        # Un id de base por prueba: las columnas ausentes se recuerdan por URL de tabla.
+        self.cliente = crear_cliente_airtable(f"app{self.id().rsplit('.', 1)[-1]}", "key-local",
+                                              api_url=self.servidor.api_url)
+
+    def tearDown(self):
+        self.servidor.shutdown()
+        self.servidor.server_close()
+        shutil.rmtree(self.directorio, ignore_errors=True)
+
+    def test_la_carga_del_formulario_no_pide_las_columnas_que_faltan(self):
+        espejo = EspejoAirtable(self.cliente, ruta=os.path.join(self.directorio, "espejo.sqlite"), campos=CAMPOS_FORMULARIO)
+        self.assertEqual(espejo.sincronizar(), len(self.registros))
+        df = espejo.tabla_entregas()
+        self.assertEqual(len(df), len(self.registros))
+        self.assertNotIn('Fecha_UTC', df.columns)
+
+        # La siguiente sincronización ya no vuelve a preguntar por 'Fecha_UTC'.
+        peticiones = len(self.servidor.peticiones)
+        espejo.sincronizar()
+        self.assertEqual(len(self.servidor.peticiones), peticiones + 1)
+        self.assertEqual(IndiceTokens(os.path.join(self.directorio, "tokens.sqlite")).reconstruir(df), 0)
+
+    def test_la_entrega_escribe_sin_las_columnas_que_faltan(self):
+        escritor = EscritorAirtable(self.cliente, intervalo=0).iniciar()
+        try:
+            futuros = [escritor.escribir(r['id'], {
+                'Verificado': 'Pendiente', 'Hash_PDF': f"hash{i}", 'Fecha_UTC': "2025-08-10 10:00:00 UTC",
+                'SHA256_PDF': f"sha{i}", 'Drive_ID': f"drive{i}",
+            }) for i, r in enumerate(self.registros)]
+            for futuro in futuros:
+                self.assertTrue(futuro.result(10))
+        finally:
+            escritor.parar()
+
+        self.assertEqual(escritor.ausentes, set(CAMPOS_OPCIONALES))
+        self.assertEqual(escritor.estadisticas()['errores'], 0)
+        guardados = self.servidor.listar(TABLA_ENTREGAS)
+        self.assertEqual([r['fields']['Hash_PDF'] for r in guardados], [f"hash{i}" for i in range(len(self.registros))])
+        self.assertFalse(any(campo in r['fields'] for r in guardados for campo in CAMPOS_OPCIONALES))
+
+    def test_exportacion_y_auditoria_leen_sin_las_columnas_que_faltan(self):
+        for r in self.registros:
+            r['fields']['Hash_PDF'] = "hash"
+        filas = [f for pagina in leer_registros_paginados(self.cliente, campos=CAMPOS_EXPORTACION) for f in pagina]
+        self.assertEqual(len(filas), len(self.registros))
+        df = dataframe_desde_paginas(leer_registros_paginados(self.cliente, campos=CAMPOS_AUDITORIA))
+        auditables = registros_auditables(df)
+        self.assertEqual(len(auditables), len(self.registros))
+        self.assertTrue(all(r['sha256_pdf'] is None and r['fecha_utc'] is None for r in auditables))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Dos ColaTrabajos sobre el mismo fichero (la app y server.py) con bloqueos
+compartidos: ningún trabajo se procesa dos veces, y solo se recuperan (al
+arrancar o al caducar su bloqueo) los trabajos de procesos que ya no existen.
+
+Uso: python -m unittest discover tests
+"""
+
+import os
+import sys
+import time
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bloqueos import BloqueosSQLite
+from cola_entregas import ColaTrabajos, EN_COLA, EN_PROCESO, COMPLETADO
+
+
+class TestColaCompartida(unittest.TestCase):
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp(prefix="test_cola_")
+        self.ruta = os.path.join(self.directorio, "cola.sqlite")
+        self.bloqueos = BloqueosSQLite(os.path.join(self.directorio, "bloqueos.sqlite"))
+        self.ejecuciones = []
+        self.lock = threading.Lock()
+        self.colas = []
+
+    def tearDown(self):
+        for cola in self.colas:
+            cola.parar()
+        shutil.rmtree(self.directorio, ignore_errors=True)
+
+    def _cola(self, nombre, duracion=0.0, iniciar=True):
+        def procesar(datos, marcar_etapa):
+            with self.lock:
+                self.ejecuciones.append((nombre, datos['n']))
+            marcar_etapa('pdf')
+            time.sleep(duracion)
+            return {'n': datos['n']}
+
+        cola = ColaTrabajos(procesar, ruta=self.ruta, workers=2, espera=0.02, bloqueos=self.bloqueos)
+        self.colas.append(cola)
+        return cola.iniciar() if iniciar else cola
+
+    def _esperar(self, cola, limite=10):
+        fin = time.time() + limite
+        while cola.pendientes() and time.time() < fin:
+            time.sleep(0.02)
+
+    def test_arrancar_otra_cola_no_repite_un_trabajo_en_proceso(self):
+        a = self._cola('A', duracion=0.5)
+        trabajo_id = a.encolar({'n': 1}, clave='recA')
+        fin = time.time() + 5
+        while a.estado(trabajo_id)['estado'] != EN_PROCESO and time.time() < fin:
+            time.sleep(0.01)
+
+        # B arranca mientras A procesa el trabajo: no debe devolverlo a la cola.
+        self._cola('B', duracion=0.5)
+        self.assertEqual(a.estado(trabajo_id)['estado'], EN_PROCESO)
+        self._esperar(a)
+        time.sleep(0.2)
+
+        trabajo = a.estado(trabajo_id)
+        self.assertEqual(trabajo['estado'], COMPLETADO)
+        self.assertEqual(trabajo['intentos'], 1)
+        self.assertEqual(self.ejecuciones, [('A', 1)])
+
+    def test_dos_colas_procesan_cada_trabajo_una_vez(self):
+        a, b = self._cola('A', duracion=0.01), self._cola('B', duracion=0.01)
+        ids = [(a, b)[i % 2].encolar({'n': i}, clave=f"rec{i % 5}") for i in range(40)]
+        self._esperar(a)
+        time.sleep(0.2)
+
+        veces = Counter(n for _, n in self.ejecuciones)
+        self.assertEqual({n: v for n, v in veces.items() if v > 1}, {})
+        self.assertEqual(sorted(veces), list(range(40)))
+        self.assertTrue(all(a.estado(t)['estado'] == COMPLETADO and a.estado(t)['intentos'] == 1 for t in ids))
+
+    def test_recupera_los_trabajos_de_procesos_muertos(self):
+        a = self._cola('A', iniciar=False)
+        sin_bloqueo = a.encolar({'n': 1}, clave='rec1')
+        pid_reutilizado = a.encolar({'n': 2}, clave='rec2')
+        vivo = a.encolar({'n': 3}, clave='rec3')
+        with a._conectar() as conn:
+            conn.execute("UPDATE trabajos SET estado = ?", (EN_PROCESO,))
+        # rec1: el proceso murió y su bloqueo caducó. rec2: bloqueo vigente con el
+        # host y pid de este proceso pero de una cola que ya no existe. rec3: otro proceso vivo.
+        self.bloqueos.adquirir('rec2', f"{socket.gethostname()}:{os.getpid()}:colamuerta:{pid_reutilizado}")
+        self.bloqueos.adquirir('rec3', f"otro-host:1:cola:{vivo}")
+
+        self.assertEqual(a._recuperar(), 2)
+        self.assertEqual(a.estado(sin_bloqueo)['estado'], EN_COLA)
+        self.assertEqual(a.estado(pid_reutilizado)['estado'], EN_COLA)
+        self.assertEqual(a.estado(vivo)['estado'], EN_PROCESO)
+
+    def test_recupera_el_trabajo_de_un_proceso_caido_al_caducar_su_bloqueo(self):
+        a = self._cola('A', iniciar=False)
+        a.INTERVALO_RECUPERACION = 0.05
+        trabajo_id = a.encolar({'n': 1}, clave='rec1')
+        with a._conectar() as conn:
+            conn.execute("UPDATE trabajos SET estado = ?", (EN_PROCESO,))
+        # Otro proceso del mismo host que murió con el bloqueo todavía vigente.
+        self.bloqueos.adquirir('rec1', f"{socket.gethostname()}:{os.getpid() + 1}:cola:{trabajo_id}", duracion=0.5)
+
+        a.iniciar()
+        time.sleep(0.2)
+        self.assertEqual(a.estado(trabajo_id)['estado'], EN_PROCESO)
+        self.assertEqual(self.ejecuciones, [])
+
+        self._esperar(a)
+        self.assertEqual(a.estado(trabajo_id)['estado'], COMPLETADO)
+        self.assertEqual(self.ejecuciones, [('A', 1)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+EscritorAirtable frente a fallos de red y respuestas que no son de Airtable,
+y sin esperas cuando el limitador tiene capacidad.
+
+Uso: python -m unittest discover tests
+"""
+
+import os
+import sys
+import time
+import unittest
+
+import requests
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.join(RAIZ, "benchmarks"))
+
+from airtable_datos import TABLA_ENTREGAS, EscritorAirtable, crear_cliente_airtable
+from fixtures_entregas import registros_entregas
+from servidores_falsos import ServidorAirtableFalso
+
+
+class SesionConFallos:
+    """Envuelve la sesión real: las primeras peticiones fallan como se indique."""
+
+    def __init__(self, sesion, fallos):
+        self.sesion = sesion
+        self.fallos = list(fallos)
+
+    def patch(self, *args, **kwargs):
+        if self.fallos:
+            fallo = self.fallos.pop(0)
+            if isinstance(fallo, Exception):
+                raise fallo
+            return fallo
+        return self.sesion.patch(*args, **kwargs)
+
+
+def respuesta_html(estado):
+    """Respuesta de error con cuerpo HTML, como la de un proxy delante de Airtable."""
+    respuesta = requests.Response()
+    respuesta.status_code = estado
+    respuesta._content = b"<html><body>Bad Request</body></html>"
+    return respuesta
+
+
+class TestEscritorAirtable(unittest.TestCase):
+
+    def setUp(self):
+        self.registros = registros_entregas(12)
+        self.servidor = ServidorAirtableFalso({TABLA_ENTREGAS: self.registros}).arrancar()
+        self.cliente = crear_cliente_airtable("appESCRITOR", "key-local", api_url=self.servidor.api_url)
+
+    def tearDown(self):
+        self.servidor.shutdown()
+        self.servidor.server_close()
+
+    def _escritor(self, fallos=(), intervalo=0.2):
+        escritor = EscritorAirtable(self.cliente, intervalo=intervalo)
+        escritor._sesion = SesionConFallos(escritor._sesion, fallos)
+        self.addCleanup(escritor.parar)
+        return escritor
+
+    def test_reintenta_los_errores_de_conexion(self):
+        escritor = self._escritor([requests.ConnectionError("reset"), requests.Timeout("lento")])
+        escritor.REINTENTOS = 3
+        futuro = escritor.escribir(self.registros[0]['id'], {'Verificado': 'Pendiente'})
+        escritor.vaciar()
+        self.assertTrue(futuro.result(0))
+        self.assertEqual(escritor.metricas['reintentos'], 2)
+        self.assertEqual(self.servidor.listar(TABLA_ENTREGAS)[0]['fields']['Verificado'], 'Pendiente')
+
+    def test_error_sin_json_conserva_el_codigo_y_separa_el_lote(self):
+        escritor = self._escritor([respuesta_html(400), respuesta_html(400)])
+        futuros = [escritor.escribir(r['id'], {'Verificado': 'Pendiente'}) for r in self.registros[:3]]
+        escritor.vaciar()
+        # El lote de 3 falla, se separa y solo el primer registro vuelve a fallar.
+        self.assertEqual(escritor.metricas['lotes_separados'], 1)
+        self.assertEqual(getattr(futuros[0].exception(0), 'status_code', None), 400)
+        self.assertTrue(futuros[1].result(0) and futuros[2].result(0))
+
+    def test_con_capacidad_en_el_limitador_no_espera_el_intervalo(self):
+        escritor = self._escritor(intervalo=5).iniciar()
+        inicio = time.perf_counter()
+        escritor.escribir(self.registros[0]['id'], {'Verificado': 'Pendiente'}).result(2)
+        self.assertLess(time.perf_counter() - inicio, 1)
+
+    def test_un_lote_lleno_sale_sin_esperar_el_intervalo(self):
+        escritor = self._escritor(intervalo=5)
+        # Sin tokens, cada envío esperaría la ventana de intervalo.
+        escritor.limitador._tokens = -escritor.limitador.tasa * 0.2
+        escritor.iniciar()
+        inicio = time.perf_counter()
+        futuros = [escritor.escribir(r['id'], {'Verificado': 'Pendiente'}) for r in self.registros[:escritor.MAX_REGISTROS]]
+        for futuro in futuros:
+            futuro.result(3)
+        self.assertLess(time.perf_counter() - inicio, 2)
+        self.assertEqual(escritor.metricas['peticiones'], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
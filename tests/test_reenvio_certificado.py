@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Reenviar la entrega de un registro sin cambios conserva la fecha del
+certificado, así que el PDF sale de la CachePDF en lugar de volver a
+renderizarse.
+
+Uso: python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import certificado
+from cache_pdf import CachePDF
+from certificado import RenderizadorCertificado, crear_pdf_certificado
+from cola_entregas import CODIGO_CERTIFICADO, datos_entrega
+
+
+class PoolFalso:
+    """Sustituye a PoolRenderizado: cuenta los renders y devuelve el HTML como 'PDF'."""
+
+    def __init__(self):
+        self.renders = 0
+
+    def html_a_pdf(self, html_out):
+        self.renders += 1
+        return html_out.encode('utf-8')
+
+
+class TestReenvioCertificado(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = CachePDF(directorio=None)
+        self.pool = PoolFalso()
+        renderizador = RenderizadorCertificado(cache=self.cache)
+        renderizador.pool = self.pool
+        self._anterior, certificado._renderizador = certificado._renderizador, renderizador
+        self.fila = pd.Series({'ID-partido': 'J01-ATM-BAR-00001', 'Rec': 'rec00000000000001',
+                               'Piloto': 'Lucía García', 'Fecha partido': '2025-08-10'})
+
+    def tearDown(self):
+        certificado._renderizador = self._anterior
+
+    def _entregar(self, analista):
+        """Lo que hacen el formulario y PipelineEntrega: datos del trabajo, PDF y campos escritos en la fila."""
+        datos = datos_entrega(self.fila, analista, "a@club.local")
+        pdf_bytes, pdf_hash = crear_pdf_certificado(datos['fila'], analista, CODIGO_CERTIFICADO, fecha_utc=datos['fecha_utc'])
+        self.fila['Hash_PDF'], self.fila['Fecha_UTC'] = pdf_hash, datos['fecha_utc']
+        return datos, pdf_bytes
+
+    def _entregado_antes(self, analista, fecha_utc="2025-08-10 10:00:00 UTC"):
+        self.fila['Fecha_UTC'] = fecha_utc
+        self.fila['Hash_PDF'] = certificado.calcular_hash_certificado(self.fila, analista, CODIGO_CERTIFICADO, fecha_utc)
+
+    def test_reenvio_del_mismo_registro_sale_de_la_cache(self):
+        self._entregado_antes("Hugo Pérez")
+        primero, pdf_primero = self._entregar("Hugo Pérez")
+        segundo, pdf_segundo = self._entregar("Hugo Pérez")
+
+        self.assertEqual(primero['fecha_utc'], "2025-08-10 10:00:00 UTC")
+        self.assertEqual(segundo['fecha_utc'], primero['fecha_utc'])
+        self.assertNotEqual(segundo['token'], primero['token'])
+        self.assertEqual(pdf_segundo, pdf_primero)
+        self.assertEqual(self.pool.renders, 1)
+        self.assertEqual(self.cache.metricas['aciertos_memoria'], 1)
+
+    def test_con_otro_analista_el_certificado_lleva_fecha_nueva(self):
+        self._entregado_antes("Hugo Pérez")
+        datos, _ = self._entregar("Martina López")
+        self.assertNotEqual(datos['fecha_utc'], "2025-08-10 10:00:00 UTC")
+        self.assertEqual(self.cache.metricas['aciertos_memoria'], 0)
+
+if __name__ == "__main__":
+    unittest.main()
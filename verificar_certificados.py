@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""
+Auditoría del archivo de certificados: comprueba que los PDF guardados en la
+carpeta de Drive (o en un directorio local) siguen siendo los que se generaron.
+
+Cada certificado se descarga en trozos y se va calculando su SHA-256 (el mismo
+que calcular_hash_bytes) sin tener nunca el fichero entero en memoria; varias
+descargas van en paralelo, con un máximo de --workers a la vez. El resultado
+de cada registro se escribe en el informe (JSONL) en cuanto termina.
+
+Referencia de cada fichero: la entrega guarda en 'SHA256_PDF' el SHA-256 de
+los bytes que sube a Drive (y en 'Drive_ID' el id del fichero), y esa es la
+referencia. 'Hash_PDF' es el hash del documento canónico (los datos del
+certificado, ver certificado.documento_canonico), no el de los bytes, así que
+para los registros anteriores a 'SHA256_PDF' se usa el 'sha256_fichero' de un
+manifiesto (el de lote_certificados.py o el que deja esta misma auditoría con
+--guardar-huellas) y, si no hay, 'Hash_PDF' por si coincide. Sin ninguna
+referencia el registro queda como 'sin_referencia'; guardar sus huellas deja
+la base para la siguiente auditoría.
+
+Además, si el registro tiene 'Fecha_UTC', se recalcula 'Hash_PDF' a partir de
+sus campos: si no coincide, los datos del registro ya no son los del
+certificado y el registro queda como 'distinto'.
+
+Uso:
+    AIRTABLE_BASE_ID=... AIRTABLE_API_KEY=... GOOGLE_CREDS='{...}' \\
+    python verificar_certificados.py --drive --huellas huellas.jsonl --informe informe.jsonl
+
+    python verificar_certificados.py --directorio certificados   # con certificados/manifest.jsonl
+"""
+
+import os
+import json
+import time
+import hashlib
+import argparse
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from certificado import CAMPOS_CERTIFICADO, verificar_hash_certificado
+from google_servicios import TROZO_DESCARGA
+from lote_certificados import MANIFIESTO, nombre_fichero, nombre_analista
+
+OK = 'ok'
+DISTINTO = 'distinto'
+SIN_REFERENCIA = 'sin_referencia'
+FALTA = 'falta'
+ERROR = 'error'
+
+CAMPOS_AUDITORIA = sorted({'Rec', 'PDF', 'Hash_PDF', 'Fecha_UTC', 'SHA256_PDF', 'Drive_ID', 'Analista(Form)', 'Analista'}
+                          .union(*CAMPOS_CERTIFICADO.values()))
+DRIVE_FOLDER_ID = os.environ.get("DRIVE_FOLDER_ID", "1yNFgOvRclge1SY9QtvnD980f3-4In_hs")
+
+
+class _Huella:
+    """Destino de escritura que solo acumula el SHA-256 y el tamaño."""
+
+    def __init__(self):
+        self.sha256 = hashlib.sha256()
+        self.bytes = 0
+
+    def write(self, datos):
+        self.sha256.update(datos)
+        self.bytes += len(datos)
+        return len(datos)
+
+
+class OrigenDirectorio:
+    """Certificados en un directorio local, con los nombres de lote_certificados.py."""
+
+    def __init__(self, directorio):
+        self.directorio = directorio
+
+    def preparar(self):
+        return self
+
+    def localizar(self, registro):
+        ruta = os.path.join(self.directorio, nombre_fichero(registro['id_partido']))
+        return ruta if os.path.exists(ruta) else None
+
+    def leer(self, ruta, destino, trozo):
+        with open(ruta, "rb") as f:
+            for bloque in iter(lambda: f.read(trozo), b""):
+                destino.write(bloque)
+
+
+class OrigenDrive:
+    """
+    Certificados en una carpeta de Drive. Cuenta el fichero del propio
+    registro ('Drive_ID'); para los registros anteriores, la carpeta se lista
+    una vez (mil ficheros por petición) para ir de nombre a id, y si un
+    partido se entregó varias veces, cuenta el fichero más reciente. Si el
+    enlace de 'PDF' sigue siendo de Drive, su id se usa cuando el nombre no aparece.
+
+    obtener_drive: función que devuelve el servicio de Drive del hilo actual.
+    """
+
+    def __init__(self, obtener_drive, carpeta=DRIVE_FOLDER_ID):
+        self.obtener_drive = obtener_drive
+        self.carpeta = carpeta
+        self.ids = {}
+
+    def preparar(self):
+        from google_servicios import listar_carpeta
+        # listar_carpeta va por createdTime: el último con el mismo nombre gana.
+        self.ids = {f['name']: f['id'] for f in listar_carpeta(self.obtener_drive(), self.carpeta)}
+        return self
+
+    @staticmethod
+    def _id_desde_enlace(url):
+        partes = urllib.parse.urlparse(url or "")
+        if "drive" not in partes.netloc:
+            return None
+        consulta = urllib.parse.parse_qs(partes.query)
+        if consulta.get('id'):
+            return consulta['id'][0]
+        return partes.path.rstrip("/").rsplit("/", 1)[-1] or None
+
+    def localizar(self, registro):
+        return (registro.get('drive_id') or self.ids.get(nombre_fichero(registro['id_partido']))
+                or self._id_desde_enlace(registro.get('url')))
+
+    def leer(self, file_id, destino, trozo):
+        from google_servicios import descargar_por_trozos
+        descargar_por_trozos(self.obtener_drive(), file_id, destino, trozo)
+
+
+def registros_auditables(df):
+    """Registros con certificado ('Hash_PDF' relleno) como dicts ligeros."""
+    if df.empty or 'Hash_PDF' not in df.columns:
+        return []
+    con_hash = df[df['Hash_PDF'].notna() & (df['Hash_PDF'] != '')]
+    campos = sorted(set().union(*CAMPOS_CERTIFICADO.values()))
+    registros = []
+    for fila in con_hash.reindex(columns=CAMPOS_AUDITORIA).to_dict('records'):
+        # Como fila.dropna() en la entrega: las celdas vacías (NaN) no cuentan.
+        fila = {campo: valor for campo, valor in fila.items() if valor is not None and valor == valor}
+        pdf = fila.get('PDF')
+        url = pdf[0].get('url') if isinstance(pdf, list) and pdf and isinstance(pdf[0], dict) else None
+        registros.append({
+            'id_partido': fila.get('ID-partido'), 'rec': fila.get('Rec'), 'hash_pdf': fila['Hash_PDF'], 'url': url,
+            'fecha_utc': fila.get('Fecha_UTC') or None, 'analista': nombre_analista(fila),
+            'sha256_pdf': fila.get('SHA256_PDF') or None, 'drive_id': fila.get('Drive_ID') or None,
+            'datos': {campo: fila[campo] for campo in campos if campo in fila},
+        })
+    return registros
+
+
+def datos_coinciden(registro):
+    """Si 'Hash_PDF' sale de los datos del registro; None si falta 'Fecha_UTC' (certificados anteriores)."""
+    if not registro.get('fecha_utc'):
+        return None
+    return verificar_hash_certificado(registro.get('datos', {}), registro.get('analista'), "N/A",
+                                      registro['fecha_utc'], registro['hash_pdf'])
+
+
+def leer_huellas(*rutas):
+    """{ID-partido: sha256_fichero} de uno o varios manifiestos JSONL; las últimas líneas mandan."""
+    huellas = {}
+    for ruta in rutas:
+        if not ruta or not os.path.exists(ruta):
+            continue
+        with open(ruta, encoding="utf-8") as f:
+            for linea in f:
+                try:
+                    entrada = json.loads(linea)
+                except json.JSONDecodeError:
+                    continue
+                if entrada.get('sha256_fichero'):
+                    huellas[entrada['id_partido']] = entrada['sha256_fichero']
+    return huellas
+
+
+def _es_no_encontrado(excepcion):
+    if isinstance(excepcion, FileNotFoundError):
+        return True
+    respuesta = getattr(excepcion, 'resp', None)
+    return getattr(respuesta, 'status', None) == 404
+
+
+def verificar_registro(registro, origen, huellas, trozo=TROZO_DESCARGA):
+    """Descarga y hashea un certificado; devuelve la línea del informe."""
+    inicio = time.perf_counter()
+    resultado = dict(registro, fichero=None, sha256_fichero=None, bytes=None, referencia=None, error=None)
+    ubicacion = origen.localizar(registro)
+    if ubicacion is None:
+        resultado['estado'] = FALTA
+    else:
+        resultado['fichero'] = ubicacion
+        huella = _Huella()
+        try:
+            origen.leer(ubicacion, huella, trozo)
+        except Exception as e:
+            resultado['estado'] = FALTA if _es_no_encontrado(e) else ERROR
+            resultado['error'] = f"{type(e).__name__}: {e}"
+        else:
+            obtenido = huella.sha256.hexdigest()
+            resultado.update(sha256_fichero=obtenido, bytes=huella.bytes)
+            esperado = huellas.get(registro['id_partido'])
+            if registro.get('sha256_pdf'):
+                resultado.update(referencia='SHA256_PDF', estado=OK if obtenido == registro['sha256_pdf'] else DISTINTO)
+            elif esperado:
+                resultado.update(referencia='manifiesto', estado=OK if obtenido == esperado else DISTINTO)
+            elif obtenido == registro.get('hash_pdf'):
+                resultado.update(referencia='Hash_PDF', estado=OK)
+            else:
+                resultado['estado'] = SIN_REFERENCIA
+            resultado['datos_coinciden'] = datos_coinciden(registro)
+            if resultado['datos_coinciden'] is False:
+                resultado.update(estado=DISTINTO, error="Hash_PDF no corresponde a los datos del registro")
+    resultado['segundos'] = round(time.perf_counter() - inicio, 4)
+    return resultado
+
+
+def verificar(registros, origen, huellas=None, workers=16, trozo=TROZO_DESCARGA):
+    """
+    Verifica los registros en paralelo y va devolviendo los resultados según
+    terminan. Nunca hay más de 2 * workers tareas en vuelo, así que la memoria
+    no crece con el tamaño del archivo.
+    """
+    huellas = huellas or {}
+    registros = iter(registros)
+    with ThreadPoolExecutor(workers, thread_name_prefix="verificar") as pool:
+        en_vuelo = set()
+        for registro in registros:
+            en_vuelo.add(pool.submit(verificar_registro, registro, origen, huellas, trozo))
+            if len(en_vuelo) >= 2 * workers:
+                hechos, en_vuelo = wait(en_vuelo, return_when=FIRST_COMPLETED)
+                for futuro in hechos:
+                    yield futuro.result()
+        for futuro in en_vuelo:
+            yield futuro.result()
+
+
+def auditar(registros, origen, huellas, informe, guardar_huellas=None, workers=16, trozo=TROZO_DESCARGA):
+    """Escribe el informe a medida que llegan los resultados. Devuelve (recuento por estado, bytes, segundos)."""
+    recuento = {estado: 0 for estado in (OK, DISTINTO, SIN_REFERENCIA, FALTA, ERROR)}
+    total_bytes = 0
+    inicio = time.perf_counter()
+    with open(informe, "w", encoding="utf-8") as f_informe, \
+            open(guardar_huellas or os.devnull, "a", encoding="utf-8") as f_huellas:
+        for resultado in verificar(registros, origen.preparar(), huellas, workers, trozo):
+            recuento[resultado['estado']] += 1
+            total_bytes += resultado['bytes'] or 0
+            f_informe.write(json.dumps(resultado, ensure_ascii=False, default=str) + "\n")
+            if resultado['estado'] in (DISTINTO, FALTA, ERROR):
+                print(f"{resultado['estado'].upper():<8} {resultado['id_partido']} {resultado['error'] or resultado['fichero'] or ''}")
+            elif guardar_huellas and resultado['estado'] == SIN_REFERENCIA:
+                # Mismo formato que manifest.jsonl de lote_certificados.
+                f_huellas.write(json.dumps({
+                    'id_partido': resultado['id_partido'], 'rec': resultado['rec'],
+                    'fichero': resultado['fichero'], 'hash_pdf': resultado['hash_pdf'],
+                    'sha256_fichero': resultado['sha256_fichero'], 'bytes': resultado['bytes'],
+                }, ensure_ascii=False) + "\n")
+    return recuento, total_bytes, time.perf_counter() - inicio
+
+
+def _origen_drive(carpeta):
+    from google_servicios import GestorCredenciales, obtener_registro
+    try:
+        creds_info = json.loads(os.environ["GOOGLE_CREDS"])
+    except KeyError:
+        raise RuntimeError("Falta la variable de entorno GOOGLE_CREDS") from None
+    gestor = GestorCredenciales(creds_info, ['https://www.googleapis.com/auth/drive']).iniciar()
+    return OrigenDrive(lambda: obtener_registro().servicio('drive', 'v3', gestor.credenciales()), carpeta)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Verifica el archivo de certificados frente a sus huellas.")
+    origen = parser.add_mutually_exclusive_group(required=True)
+    origen.add_argument("--drive", action="store_true", help="Leer de la carpeta de Drive")
+    origen.add_argument("--directorio", help="Leer de un directorio local (p. ej. la salida de lote_certificados.py)")
+    parser.add_argument("--carpeta", default=DRIVE_FOLDER_ID, help="Carpeta de Drive (DRIVE_FOLDER_ID)")
+    parser.add_argument("--huellas", action="append", default=[], help="Manifiesto JSONL con sha256_fichero (repetible)")
+    parser.add_argument("--guardar-huellas", help="Añade a este manifiesto las huellas de los registros sin referencia")
+    parser.add_argument("--informe", default="informe_verificacion.jsonl", help="Informe JSONL de salida")
+    parser.add_argument("--workers", type=int, default=16, help="Descargas simultáneas")
+    parser.add_argument("--trozo", type=int, default=TROZO_DESCARGA, help="Bytes por trozo de descarga")
+    args = parser.parse_args(argv)
+
+    from airtable_datos import cargar_tabla_entregas, credenciales_airtable_entorno
+    registros = registros_auditables(cargar_tabla_entregas(*credenciales_airtable_entorno(), campos=CAMPOS_AUDITORIA))
+    print(f"{len(registros)} certificados a verificar.")
+
+    if args.drive:
+        origen, rutas_huellas = _origen_drive(args.carpeta), args.huellas
+    else:
+        origen = OrigenDirectorio(args.directorio)
+        rutas_huellas = args.huellas or [os.path.join(args.directorio, MANIFIESTO)]
+    huellas = leer_huellas(*rutas_huellas, args.guardar_huellas)
+
+    recuento, total_bytes, segundos = auditar(registros, origen, huellas, args.informe, args.guardar_huellas,
+                                              args.workers, args.trozo)
+    ritmo = len(registros) / segundos if segundos > 0 else 0.0
+    print(", ".join(f"{n} {estado}" for estado, n in recuento.items()))
+    print(f"{total_bytes / 1e6:.1f} MB en {segundos:.1f} s ({ritmo:.1f} certificados/s). Informe: {args.informe}")
+    return 1 if recuento[DISTINTO] or recuento[FALTA] or recuento[ERROR] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())